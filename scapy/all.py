@@ -22,6 +22,8 @@ from scapy.asn1fields import *
 from scapy.asn1packet import *
 
 from scapy.utils import *
+from scapy.checksum import *
+from scapy.bpf import *
 from scapy.route import *
 from scapy.sendrecv import *
 from scapy.sessions import *
@@ -14,7 +14,7 @@ import sys
 import time
 from scapy.consts import WINDOWS
 from scapy.config import conf
-from scapy.data import MTU, ARPHRD_TO_DLT
+from scapy.data import MTU, ARPHRD_TO_DLT, DLT_EN10MB
 from scapy.error import Scapy_Exception
 
 if not WINDOWS:
@@ -65,11 +65,25 @@ def _select_nonblock(sockets, remain=None):
 # BPF HANDLERS
 
 
+def _compile_filter_native(filter_exp, iface=None, linktype=None):
+    """Compile the filter with scapy.bpf, without libpcap"""
+    from scapy.bpf import bpf_compile
+    if linktype is None:
+        try:
+            arphd = get_if_raw_hwaddr(iface or conf.iface)[0]
+            linktype = ARPHRD_TO_DLT.get(arphd)
+        except Exception:
+            pass
+    return bpf_compile(filter_exp, linktype or DLT_EN10MB).bpf_program()
+
+
 def compile_filter(filter_exp, iface=None, linktype=None,
                    promisc=False):
     """Asks libpcap to parse the filter, then build the matching
     BPF bytecode.
 
+    When libpcap is not available, the filter is compiled with scapy.bpf.
+
     :param iface: if provided, use the interface to compile
     :param linktype: if provided, use the linktype to compile
     """
@@ -83,9 +97,7 @@ def compile_filter(filter_exp, iface=None, linktype=None,
         )
         from scapy.libs.structures import bpf_program
     except OSError:
-        raise ImportError(
-            "libpcap is not available. Cannot compile filter !"
-        )
+        return _compile_filter_native(filter_exp, iface, linktype)
     from ctypes import create_string_buffer
     bpf = bpf_program()
     bpf_filter = create_string_buffer(filter_exp.encode("utf8"))
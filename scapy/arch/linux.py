@@ -11,7 +11,9 @@ from __future__ import absolute_import
 
 
 import array
+import collections
 from fcntl import ioctl
+import mmap
 import os
 from select import select
 import socket
@@ -29,7 +31,7 @@ from scapy.packet import Packet, Padding
 from scapy.config import conf
 from scapy.data import MTU, ETH_P_ALL, SOL_PACKET, SO_ATTACH_FILTER, \
     SO_TIMESTAMPNS
-from scapy.supersocket import SuperSocket
+from scapy.supersocket import SuperSocket, ETH_P_8021Q
 from scapy.error import warning, Scapy_Exception, \
     ScapyInvalidPlatformException, log_runtime
 from scapy.arch.common import get_if, compile_filter
@@ -87,6 +89,18 @@ PACKET_USER = 6  # To user space
 PACKET_KERNEL = 7  # To kernel space
 PACKET_AUXDATA = 8
 PACKET_FASTROUTE = 6  # Fastrouted frame
+PACKET_VERSION = 10
+PACKET_TX_RING = 13
+PACKET_LOSS = 14
+TPACKET_V2 = 1
+TPACKET_V3 = 2
+
+# From net/if_packet.h, tp_status / block_status values
+TP_STATUS_KERNEL = 0
+TP_STATUS_USER = 0x1
+TP_STATUS_SEND_REQUEST = 0x1
+TP_STATUS_VLAN_VALID = 0x10
+TP_STATUS_VLAN_TPID_VALID = 0x40
 # Unused, PACKET_FASTROUTE and PACKET_LOOPBACK are invisible to user space
 
 # Utils
@@ -432,8 +446,72 @@ def set_iface_monitor(iface, monitor):
     return True
 
 
+# Offset of the data in a TX ring frame: the (aligned) tpacket2_hdr
+_TPACKET2_DATA = 32
+
+
+class _TxRing(object):
+    """A PACKET_TX_RING, used to send a batch of frames with a single
+    system call. The frames that do not fit in a slot of the ring are sent
+    with the `fallback` socket."""
+
+    def __init__(self, fallback, frame_size=2048, frame_nr=256):
+        self.fallback = fallback
+        self.frame_size = frame_size
+        self.frame_nr = frame_nr
+        self.snaplen = frame_size - _TPACKET2_DATA
+        self.head = 0
+        self.pending = 0
+        # Protocol 0: this socket does not receive anything
+        self.sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, 0)
+        try:
+            self.sock.setsockopt(SOL_PACKET, PACKET_VERSION, TPACKET_V2)
+            # Skip the frames rejected by the kernel instead of blocking
+            # the ring
+            self.sock.setsockopt(SOL_PACKET, PACKET_LOSS, 1)
+            self.sock.setsockopt(SOL_PACKET, PACKET_TX_RING, struct.pack(
+                "IIII", frame_size * frame_nr, 1, frame_size, frame_nr
+            ))
+            self.ring = mmap.mmap(self.sock.fileno(), frame_size * frame_nr,
+                                  mmap.MAP_SHARED,
+                                  mmap.PROT_READ | mmap.PROT_WRITE)
+        except (socket.error, mmap.error) as ex:
+            self.sock.close()
+            raise Scapy_Exception("Cannot set up the TX ring: %s" % ex)
+
+    def send(self, frames, addr):
+        """Sends frames to the (iface, proto) address `addr`"""
+        ring = self.ring
+        for sx in frames:
+            if len(sx) > self.snaplen:
+                self.flush(addr)
+                self.fallback.sendto(sx, addr)
+                continue
+            off = self.head * self.frame_size
+            ring[off + _TPACKET2_DATA:off + _TPACKET2_DATA + len(sx)] = sx
+            struct.pack_into("I", ring, off + 4, len(sx))
+            struct.pack_into("I", ring, off, TP_STATUS_SEND_REQUEST)
+            self.head = (self.head + 1) % self.frame_nr
+            self.pending += 1
+            if self.pending == self.frame_nr:
+                self.flush(addr)
+        self.flush(addr)
+
+    def flush(self, addr):
+        """Sends the pending frames, and waits until the kernel is done with
+        them"""
+        if self.pending:
+            self.pending = 0
+            self.sock.sendto(b"", addr)
+
+    def close(self):
+        self.ring.close()
+        self.sock.close()
+
+
 class L2Socket(SuperSocket):
     desc = "read/write packets at layer 2 using Linux PF_PACKET sockets"
+    _tx_ring = None
 
     def __init__(self, iface=None, type=ETH_P_ALL, promisc=None, filter=None,
                  nofilter=0, monitor=None):
@@ -510,17 +588,26 @@ class L2Socket(SuperSocket):
                 set_promisc(self.ins, self.iface, 0)
         except (AttributeError, OSError):
             pass
+        if self._tx_ring is not None:
+            self._tx_ring.close()
+            self._tx_ring = None
         SuperSocket.close(self)
 
-    def recv_raw(self, x=MTU):
+    def recv_raw(self, x=MTU, flags=0):
         """Receives a packet, then returns a tuple containing (cls, pkt_data, time)"""  # noqa: E501
-        pkt, sa_ll, ts = self._recv_raw(self.ins, x)
+        pkt, sa_ll, ts = self._recv_raw(self.ins, x, flags)
         if self.outs and sa_ll[2] == socket.PACKET_OUTGOING:
             return None, None, None
         if ts is None:
             ts = get_last_packet_timestamp(self.ins)
         return self.LL, pkt, ts
 
+    def recv(self, x=MTU, flags=0):
+        return self._dissect(*self.recv_raw(x, flags))
+
+    def recv_many(self, max_count=64, timeout=None):
+        return self._recv_many_nonblock(max_count, timeout)
+
     def send(self, x):
         try:
             return SuperSocket.send(self, x)
@@ -533,6 +620,64 @@ class L2Socket(SuperSocket):
                     return SuperSocket.send(self, raw(x) + padding)
             raise
 
+    def send_many(self, x, pps=None, mbps=None):
+        """Sends many packets, in batches written to a PACKET_TX_RING and
+        sent with a single system call.
+
+        :param x: an iterable of packets
+        :param pps: the maximum rate in packets per second
+        :param mbps: the maximum rate in megabits per second
+        :returns: the number of packets sent
+        """
+        addr = (self.iface, self.type)
+        return self._send_frames(((p, addr, raw(p)) for p in x), pps, mbps)
+
+    def _send_frames(self, frames, pps, mbps):
+        """Sends the (packet, address, frame) tuples of `frames` through the
+        TX ring, in batches of about 10ms when the rate is limited"""
+        if self.outs is None:
+            raise Scapy_Exception(
+                "Can't send anything with %s" % self.__class__.__name__
+            )
+        ring = self._tx_ring
+        if ring is None:
+            ring = self._tx_ring = _TxRing(self.outs)
+        bucket = scapy.utils.TokenBucket(pps, mbps)
+        max_count = ring.frame_nr
+        max_size = ring.frame_nr * ring.snaplen
+        if pps:
+            max_count = max(1, min(max_count, int(pps // 100)))
+        if mbps:
+            max_size = max(1, min(max_size, int(mbps * 1250)))
+        n = 0
+        batch = []
+        size = 0
+        addr = None
+        for pkt, dst, sx in frames:
+            if batch and (dst != addr or len(batch) >= max_count or
+                          size >= max_size):
+                n += self._send_batch(ring, bucket, batch, size, addr)
+                batch = []
+                size = 0
+            addr = dst
+            batch.append((pkt, sx))
+            size += len(sx)
+        if batch:
+            n += self._send_batch(ring, bucket, batch, size, addr)
+        return n
+
+    @staticmethod
+    def _send_batch(ring, bucket, batch, size, addr):
+        bucket.wait(len(batch), size)
+        sent_time = time.time()
+        for pkt, _ in batch:
+            try:
+                pkt.sent_time = sent_time
+            except AttributeError:
+                pass
+        ring.send([sx for _, sx in batch], addr)
+        return len(batch)
+
 
 class L2ListenSocket(L2Socket):
     desc = "read packets at layer 2 using Linux PF_PACKET sockets. Also receives the packets going OUT"  # noqa: E501
@@ -544,25 +689,36 @@ class L2ListenSocket(L2Socket):
 class L3PacketSocket(L2Socket):
     desc = "read/write packets at layer 3 using Linux PF_PACKET sockets"
 
-    def recv(self, x=MTU):
-        pkt = SuperSocket.recv(self, x)
+    def recv(self, x=MTU, flags=0):
+        pkt = L2Socket.recv(self, x, flags)
         if pkt and self.lvl == 2:
             pkt.payload.time = pkt.time
             return pkt.payload
         return pkt
 
-    def send(self, x):
+    def _prepare_send(self, x, hatypes=None):
+        """Returns the address to send `x` to, and the function that adds
+        the link layer. `hatypes` caches the link type of the interfaces."""
         iff = x.route()[0]
         if iff is None:
             iff = conf.iface
         sdto = (iff, self.type)
-        self.outs.bind(sdto)
-        sn = self.outs.getsockname()
+        if hatypes is None or iff not in hatypes:
+            self.outs.bind(sdto)
+            hatype = self.outs.getsockname()[3]
+            if hatypes is not None:
+                hatypes[iff] = hatype
+        else:
+            hatype = hatypes[iff]
         ll = lambda x: x
         if type(x) in conf.l3types:
             sdto = (iff, conf.l3types[type(x)])
-        if sn[3] in conf.l2types:
-            ll = lambda x: conf.l2types[sn[3]]() / x
+        if hatype in conf.l2types:
+            ll = lambda x: conf.l2types[hatype]() / x
+        return sdto, ll
+
+    def send(self, x):
+        sdto, ll = self._prepare_send(x)
         sx = raw(ll(x))
         x.sent_time = time.time()
         try:
@@ -576,6 +732,159 @@ class L3PacketSocket(L2Socket):
             else:
                 raise
 
+    def send_many(self, x, pps=None, mbps=None):
+        """Sends many packets, in batches written to a PACKET_TX_RING and
+        sent with a single system call.
+
+        :param x: an iterable of packets
+        :param pps: the maximum rate in packets per second
+        :param mbps: the maximum rate in megabits per second
+        :returns: the number of packets sent
+        """
+        hatypes = {}
+
+        def frames():
+            for p in x:
+                sdto, ll = self._prepare_send(p, hatypes)
+                yield p, sdto, raw(ll(p))
+        return self._send_frames(frames(), pps, mbps)
+
+
+# struct tpacket3_hdr, up to hv1.tp_vlan_tpid
+_TPACKET3_HDR = struct.Struct("IIIIIIHHIIH")
+# Offset of sll_pkttype: the sockaddr_ll follows the (aligned) tpacket3_hdr
+_TPACKET3_PKTTYPE = 48 + 10
+
+
+class L2RingSocket(L2Socket):
+    desc = "read/write packets at layer 2 using a Linux PF_PACKET TPACKET_V3 receive ring"  # noqa: E501
+
+    def __init__(self, iface=None, type=ETH_P_ALL, promisc=None, filter=None,
+                 nofilter=0, monitor=None, block_size=1 << 20, block_nr=16,
+                 frame_size=2048, block_timeout=10):
+        """
+        The frames are received in a ring of `block_nr` blocks of
+        `block_size` bytes shared with the kernel, which fills each block
+        with several frames before handing it to the socket. A block is
+        handed over when full or after `block_timeout` milliseconds.
+
+        :param block_size: the size of a block, a multiple of the page size
+        :param block_nr: the number of blocks of the ring
+        :param frame_size: the maximum size of a frame, with its headers
+        :param block_timeout: the time in ms after which a block that is
+            not full is handed over
+        """
+        L2Socket.__init__(self, iface=iface, type=type, promisc=promisc,
+                          filter=filter, nofilter=nofilter, monitor=monitor)
+        self.block_size = block_size
+        self.block_nr = block_nr
+        self.block_idx = 0
+        self.frames = collections.deque()
+        self.ring = None
+        try:
+            self.ins.setsockopt(SOL_PACKET, PACKET_VERSION, TPACKET_V3)
+            self.ins.setsockopt(SOL_PACKET, PACKET_RX_RING, struct.pack(
+                "IIIIIII", block_size, block_nr, frame_size,
+                block_size // frame_size * block_nr, block_timeout, 0, 0
+            ))
+            self.ring = mmap.mmap(self.ins.fileno(), block_size * block_nr,
+                                  mmap.MAP_SHARED,
+                                  mmap.PROT_READ | mmap.PROT_WRITE)
+        except (socket.error, mmap.error) as ex:
+            self.close()
+            raise Scapy_Exception("Cannot set up the TPACKET_V3 ring: %s" % ex)
+
+    def close(self):
+        if self.closed:
+            return
+        if self.ring is not None:
+            self.ring.close()
+            self.ring = None
+        L2Socket.close(self)
+
+    def _read_block(self):
+        """Moves the frames of the next block of the ring to the pending
+        frames, and gives the block back to the kernel. Returns False if the
+        block has not been handed over by the kernel yet."""
+        ring = self.ring
+        blk = self.block_idx * self.block_size
+        status, num_pkts, off = struct.unpack_from("III", ring, blk + 8)
+        if not status & TP_STATUS_USER:
+            return False
+        frames = self.frames
+        skip_outgoing = self.outs is not None
+        off += blk
+        for _ in range(num_pkts):
+            (next_off, sec, nsec, snaplen, _, tp_status, mac, _, _,
+             tci, tpid) = _TPACKET3_HDR.unpack_from(ring, off)
+            if not (skip_outgoing and struct.unpack_from(
+                    "B", ring, off + _TPACKET3_PKTTYPE
+            )[0] == PACKET_OUTGOING):
+                pkt = ring[off + mac:off + mac + snaplen]
+                if tci != 0 or tp_status & TP_STATUS_VLAN_VALID:
+                    # Insert VLAN tag
+                    if not tp_status & TP_STATUS_VLAN_TPID_VALID:
+                        tpid = ETH_P_8021Q
+                    pkt = pkt[:12] + struct.pack("!HH", tpid, tci) + pkt[12:]
+                frames.append((self.LL, pkt, sec + nsec * 1e-9))
+            off += next_off
+        struct.pack_into("I", ring, blk + 8, TP_STATUS_KERNEL)
+        self.block_idx = (self.block_idx + 1) % self.block_nr
+        return True
+
+    def recv_raw(self, x=MTU, flags=0):
+        """Receives a packet, then returns a tuple containing (cls, pkt_data, time)"""  # noqa: E501
+        while not self.frames:
+            if not self._read_block():
+                if flags & socket.MSG_DONTWAIT:
+                    return None, None, None
+                select([self.ins], [], [])
+        return self.frames.popleft()
+
+    def recv_many(self, max_count=64, timeout=None):
+        """Receives the frames of the blocks handed over by the kernel"""
+        if not self.frames and not self._read_block():
+            if not select([self.ins], [], [], timeout)[0] or \
+               not self._read_block():
+                return []
+        frames = self.frames
+        pkts = []
+        while frames and len(pkts) < max_count:
+            p = self._dissect(*frames.popleft())
+            if p is not None:
+                pkts.append(p)
+            if not frames:
+                self._read_block()
+        return pkts
+
+    def stats(self):
+        """Returns the numbers of frames received and dropped by the kernel
+        since the last call"""
+        return struct.unpack("II", self.ins.getsockopt(
+            SOL_PACKET, PACKET_STATISTICS, 12
+        )[:8])
+
+    @staticmethod
+    def select(sockets, remain=conf.recv_poll_rate):
+        """Returns the sockets whose ring holds frames without waiting, or
+        select() the sockets otherwise"""
+        ready = [s for s in sockets if isinstance(s, L2RingSocket) and
+                 (s.frames or s._read_block())]
+        if ready:
+            return ready, None
+        return SuperSocket.select(sockets, remain)
+
+
+class L2ListenRingSocket(L2RingSocket):
+    desc = "read packets at layer 2 using a Linux PF_PACKET TPACKET_V3 receive ring. Also receives the packets going OUT"  # noqa: E501
+
+    def __init__(self, *args, **kargs):
+        L2RingSocket.__init__(self, *args, **kargs)
+        self.outs = None
+
+    def send(self, x):
+        raise Scapy_Exception("Can't send anything with L2ListenRingSocket")
+
 
 class VEthPair(object):
     """
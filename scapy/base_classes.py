@@ -242,6 +242,7 @@ class Packet_metaclass(type):
         for f in newcls.fields_desc:
             if hasattr(f, "register_owner"):
                 f.register_owner(newcls)
+        newcls._compile_fixed_runs()
         if newcls.__name__[0] != "_":
             from scapy import config
             config.conf.layers.register(newcls)
@@ -253,6 +254,26 @@ class Packet_metaclass(type):
                 return k
         raise AttributeError(attr)
 
+    def __setattr__(self, attr, val):
+        super(Packet_metaclass, self).__setattr__(attr, val)
+        if attr == "fields_desc":
+            self._compile_fixed_runs()
+
+    def _compile_fixed_runs(self):
+        """Precompute the runs of fixed-size fields of the class, used as
+        a fast path to dissect and build them (see FixedFieldsRun), and the
+        fields that can be built on their own.
+
+        This is done again when fields_desc is reassigned, or when its
+        length changes (fields appended, inserted or removed in place).
+        Replacing a field in place requires reassigning fields_desc."""
+        from scapy.fields import compile_fixed_runs, compile_appending_fields
+        self._fixed_runs = compile_fixed_runs(self.fields_desc)
+        self._appending_fields = compile_appending_fields(self.fields_desc)
+        self._fixed_runs_size = len(self.fields_desc)
+        # Forget which fields could be dissected at offsets
+        self.class_offset_dissect.pop(self, None)
+
     def __call__(cls, *args, **kargs):
         if "dispatch_hook" in cls.__dict__:
             try:
@@ -0,0 +1,1221 @@
+# This file is part of Scapy
+# See http://www.secdev.org/projects/scapy for more information
+# Copyright (C) Philippe Biondi <phil@secdev.org>
+# This program is published under a GPLv2 license
+
+"""
+BPF: compile the tcpdump filter syntax to classic BPF programs, and run
+them on raw packets, without libpcap nor tcpdump.
+"""
+
+from __future__ import absolute_import
+import re
+import socket
+import struct
+
+from scapy.data import DLT_EN10MB, DLT_LINUX_SLL, DLT_RAW, DLT_RAW_ALT, \
+    DLT_IPV4, DLT_IPV6, ETH_P_IP, ETH_P_IPV6, ETH_P_ARP
+from scapy.error import Scapy_Exception
+from scapy.extlib import NUMPY, numpy
+from scapy.pton_ntop import inet_pton
+import scapy.modules.six as six
+from scapy.modules.six.moves import range
+
+
+# Instruction classes
+BPF_LD = 0x00
+BPF_LDX = 0x01
+BPF_ST = 0x02
+BPF_STX = 0x03
+BPF_ALU = 0x04
+BPF_JMP = 0x05
+BPF_RET = 0x06
+BPF_MISC = 0x07
+# Sizes
+BPF_W = 0x00
+BPF_H = 0x08
+BPF_B = 0x10
+# Addressing modes
+BPF_IMM = 0x00
+BPF_ABS = 0x20
+BPF_IND = 0x40
+BPF_MEM = 0x60
+BPF_LEN = 0x80
+BPF_MSH = 0xa0
+# ALU operations
+BPF_ADD = 0x00
+BPF_SUB = 0x10
+BPF_MUL = 0x20
+BPF_DIV = 0x30
+BPF_OR = 0x40
+BPF_AND = 0x50
+BPF_LSH = 0x60
+BPF_RSH = 0x70
+BPF_NEG = 0x80
+BPF_MOD = 0x90
+BPF_XOR = 0xa0
+# Jumps
+BPF_JA = 0x00
+BPF_JEQ = 0x10
+BPF_JGT = 0x20
+BPF_JGE = 0x30
+BPF_JSET = 0x40
+# Sources
+BPF_K = 0x00
+BPF_X = 0x08
+BPF_A = 0x10
+# Misc operations
+BPF_TAX = 0x00
+BPF_TXA = 0x80
+
+BPF_MEMWORDS = 16
+# The value returned by tcpdump's programs for the accepted packets
+BPF_SNAPLEN = 262144
+
+_BPF_SIZES = {BPF_W: 4, BPF_H: 2, BPF_B: 1}
+_BPF_STRUCTS = {BPF_W: struct.Struct("!I"), BPF_H: struct.Struct("!H"),
+                BPF_B: struct.Struct("!B")}
+_BPF_ALU = {
+    BPF_ADD: lambda a, b: a + b,
+    BPF_SUB: lambda a, b: a - b,
+    BPF_MUL: lambda a, b: a * b,
+    BPF_DIV: lambda a, b: a // b,
+    BPF_MOD: lambda a, b: a % b,
+    BPF_OR: lambda a, b: a | b,
+    BPF_AND: lambda a, b: a & b,
+    BPF_XOR: lambda a, b: a ^ b,
+    BPF_LSH: lambda a, b: a << b,
+    BPF_RSH: lambda a, b: a >> b,
+}
+_BPF_ALU_NAMES = {
+    BPF_ADD: "add", BPF_SUB: "sub", BPF_MUL: "mul", BPF_DIV: "div",
+    BPF_MOD: "mod", BPF_OR: "or", BPF_AND: "and", BPF_XOR: "xor",
+    BPF_LSH: "lsh", BPF_RSH: "rsh", BPF_NEG: "neg",
+}
+_BPF_JMP_NAMES = {BPF_JA: "ja", BPF_JEQ: "jeq", BPF_JGT: "jgt",
+                  BPF_JGE: "jge", BPF_JSET: "jset"}
+
+
+def bpf_run(insns, data, wirelen=None):
+    """Runs a classic BPF program on a raw packet.
+
+    :param insns: the instructions of the program, as (code, jt, jf, k)
+        tuples
+    :param data: the packet, as bytes
+    :param wirelen: the length of the packet on the wire (default: the
+        length of `data`)
+    :returns: the value returned by the program: the number of bytes to
+        keep, or 0 if the packet is rejected
+    """
+    if wirelen is None:
+        wirelen = len(data)
+    caplen = len(data)
+    a = x = 0
+    mem = [0] * BPF_MEMWORDS
+    pc = 0
+    while pc < len(insns):
+        code, jt, jf, k = insns[pc]
+        pc += 1
+        cls = code & 0x07
+        if cls == BPF_LD or cls == BPF_LDX:
+            mode = code & 0xe0
+            if mode == BPF_IMM:
+                val = k
+            elif mode == BPF_LEN:
+                val = wirelen
+            elif mode == BPF_MEM:
+                val = mem[k]
+            elif mode == BPF_MSH:
+                if k >= caplen:
+                    return 0
+                val = (six.indexbytes(data, k) & 0xf) << 2
+            else:
+                off = k + x if mode == BPF_IND else k
+                size = code & 0x18
+                if off + _BPF_SIZES[size] > caplen:
+                    return 0
+                val = _BPF_STRUCTS[size].unpack_from(data, off)[0]
+            if cls == BPF_LD:
+                a = val
+            else:
+                x = val
+        elif cls == BPF_ST:
+            mem[k] = a
+        elif cls == BPF_STX:
+            mem[k] = x
+        elif cls == BPF_ALU:
+            op = code & 0xf0
+            if op == BPF_NEG:
+                a = -a & 0xffffffff
+                continue
+            val = x if code & BPF_X else k
+            if val == 0 and op in (BPF_DIV, BPF_MOD):
+                return 0
+            if op == BPF_LSH and val >= 32:
+                a = 0
+                continue
+            a = _BPF_ALU[op](a, val) & 0xffffffff
+        elif cls == BPF_JMP:
+            op = code & 0xf0
+            if op == BPF_JA:
+                pc += k
+                continue
+            val = x if code & BPF_X else k
+            if op == BPF_JEQ:
+                res = a == val
+            elif op == BPF_JGT:
+                res = a > val
+            elif op == BPF_JGE:
+                res = a >= val
+            else:
+                res = a & val
+            pc += jt if res else jf
+        elif cls == BPF_RET:
+            return a if code & 0x18 == BPF_A else k
+        elif code & 0xf8 == BPF_TXA:
+            a = x
+        else:
+            x = a
+    return 0
+
+
+def bpf_run_many(insns, packets, wirelens=None):
+    """Runs a classic BPF program on a batch of packets with NumPy.
+
+    The packets are padded to the same length, as the rows of a matrix.
+    As the jumps of a BPF program only go forward, the instructions are
+    run one after the other, each on all the packets that reached it.
+
+    :param insns: the instructions of the program
+    :param packets: a list of packets, as bytes
+    :param wirelens: the lengths of the packets on the wire (default: the
+        lengths of the packets)
+    :returns: a NumPy array of the values returned by the program
+    """
+    if not NUMPY:
+        raise ImportError("NumPy is not available")
+    count = len(packets)
+    caplens = numpy.array([len(pkt) for pkt in packets], dtype=numpy.int64)
+    if wirelens is None:
+        wirelens = caplens
+    wirelens = numpy.asarray(wirelens, dtype=numpy.uint64)
+    width = int(caplens.max()) if count else 0
+    # The padding allows 4-byte loads at any valid offset
+    width += 4
+    data = numpy.frombuffer(
+        b"".join(bytes(pkt).ljust(width, b"\0") for pkt in packets),
+        dtype=numpy.uint8,
+    ).reshape(count, width)
+    mask = numpy.uint64(0xffffffff)
+    a = numpy.zeros(count, dtype=numpy.uint64)
+    x = numpy.zeros(count, dtype=numpy.uint64)
+    mem = numpy.zeros((BPF_MEMWORDS, count), dtype=numpy.uint64)
+    pc = numpy.zeros(count, dtype=numpy.int64)
+    res = numpy.zeros(count, dtype=numpy.uint64)
+
+    def load(sel, off, size):
+        """Loads `size` bytes at `off` for the packets `sel`. The packets
+        for which the load is out of bounds are rejected."""
+        valid = off + size <= caplens[sel]
+        pc[sel[~valid]] = -1
+        sel, off = sel[valid], off[valid]
+        val = numpy.zeros(len(sel), dtype=numpy.uint64)
+        for i in range(size):
+            val = (val << numpy.uint64(8)) | data[sel, off + i]
+        return sel, val
+
+    for i, (code, jt, jf, k) in enumerate(insns):
+        sel = numpy.flatnonzero(pc == i)
+        if not len(sel):
+            continue
+        nxt = i + 1
+        cls = code & 0x07
+        if cls == BPF_LD or cls == BPF_LDX:
+            mode = code & 0xe0
+            if mode == BPF_IMM:
+                val = numpy.uint64(k)
+            elif mode == BPF_LEN:
+                val = wirelens[sel]
+            elif mode == BPF_MEM:
+                val = mem[k, sel]
+            elif mode == BPF_MSH:
+                sel, val = load(sel, numpy.full(len(sel), k), 1)
+                val = (val & numpy.uint64(0xf)) << numpy.uint64(2)
+            else:
+                off = numpy.full(len(sel), k, dtype=numpy.int64)
+                if mode == BPF_IND:
+                    off += x[sel].astype(numpy.int64)
+                sel, val = load(sel, off, _BPF_SIZES[code & 0x18])
+            if cls == BPF_LD:
+                a[sel] = val
+            else:
+                x[sel] = val
+        elif cls == BPF_ST:
+            mem[k, sel] = a[sel]
+        elif cls == BPF_STX:
+            mem[k, sel] = x[sel]
+        elif cls == BPF_ALU:
+            op = code & 0xf0
+            if op == BPF_NEG:
+                a[sel] = (numpy.uint64(1 << 32) - a[sel]) & mask
+            else:
+                if code & BPF_X:
+                    val = x[sel]
+                else:
+                    val = numpy.full(len(sel), k, dtype=numpy.uint64)
+                if op in (BPF_DIV, BPF_MOD):
+                    pc[sel[val == 0]] = -1
+                    sel, val = sel[val != 0], val[val != 0]
+                elif op in (BPF_LSH, BPF_RSH):
+                    # Shifting by 32 or more gives 0
+                    val = numpy.minimum(val, numpy.uint64(63))
+                a[sel] = _BPF_ALU[op](a[sel], val) & mask
+        elif cls == BPF_JMP:
+            op = code & 0xf0
+            if op == BPF_JA:
+                pc[sel] = nxt + k
+                continue
+            val = x[sel] if code & BPF_X else numpy.uint64(k)
+            if op == BPF_JEQ:
+                cond = a[sel] == val
+            elif op == BPF_JGT:
+                cond = a[sel] > val
+            elif op == BPF_JGE:
+                cond = a[sel] >= val
+            else:
+                cond = (a[sel] & val) != 0
+            pc[sel] = numpy.where(cond, nxt + jt, nxt + jf)
+            continue
+        elif cls == BPF_RET:
+            res[sel] = a[sel] if code & 0x18 == BPF_A else k
+            pc[sel] = -1
+            continue
+        elif code & 0xf8 == BPF_TXA:
+            a[sel] = x[sel]
+        else:
+            x[sel] = a[sel]
+        pc[sel] = nxt
+    return res
+
+
+def _disasm(code, jt, jf, k, pc):
+    """Returns an instruction in the format of tcpdump -d"""
+    cls = code & 0x07
+    if cls == BPF_LD or cls == BPF_LDX:
+        mode = code & 0xe0
+        size = {BPF_W: "", BPF_H: "h", BPF_B: "b"}[code & 0x18]
+        op = ("ld" if cls == BPF_LD else "ldx") + size
+        if mode == BPF_IMM:
+            arg = "#0x%x" % k
+        elif mode == BPF_LEN:
+            op, arg = op[:-1] if size else op, "#pktlen"
+        elif mode == BPF_MEM:
+            arg = "M[%d]" % k
+        elif mode == BPF_MSH:
+            op, arg = "ldxb", "4*([%d]&0xf)" % k
+        elif mode == BPF_IND:
+            arg = "[x + %d]" % k
+        else:
+            arg = "[%d]" % k
+    elif cls == BPF_ST or cls == BPF_STX:
+        op, arg = "st" if cls == BPF_ST else "stx", "M[%d]" % k
+    elif cls == BPF_ALU:
+        op = _BPF_ALU_NAMES[code & 0xf0]
+        arg = "" if code & 0xf0 == BPF_NEG else \
+            "x" if code & BPF_X else "#0x%x" % k
+    elif cls == BPF_JMP:
+        op = _BPF_JMP_NAMES[code & 0xf0]
+        if code & 0xf0 == BPF_JA:
+            arg = "%d" % (pc + 1 + k)
+        else:
+            arg = "%-16s jt %d\tjf %d" % (
+                "x" if code & BPF_X else "#0x%x" % k,
+                pc + 1 + jt, pc + 1 + jf,
+            )
+    elif cls == BPF_RET:
+        op, arg = "ret", "a" if code & 0x18 == BPF_A else "#%d" % k
+    else:
+        op, arg = "txa" if code & 0xf8 == BPF_TXA else "tax", ""
+    return ("(%03d) %-8s %s" % (pc, op, arg)).rstrip()
+
+
+class BPFProgram(object):
+    """A classic BPF program, as a list of (code, jt, jf, k) instructions.
+
+    Calling it on a raw packet runs it, and returns the number of bytes
+    to keep (0 if the packet is rejected).
+
+    >>> prog = bpf_compile("tcp port 80")
+    >>> prog(raw(Ether() / IP() / TCP(dport=80)))
+    262144
+    """
+
+    def __init__(self, insns, linktype=None):
+        self.insns = [tuple(insn) for insn in insns]
+        self.linktype = linktype
+
+    def __call__(self, data, wirelen=None):
+        return bpf_run(self.insns, data, wirelen)
+
+    def match(self, data, wirelen=None):
+        """Returns True if the program accepts the packet"""
+        return bpf_run(self.insns, data, wirelen) != 0
+
+    def match_many(self, packets, wirelens=None, as_numpy=None):
+        """Returns, for each packet of `packets`, True if the program
+        accepts it.
+
+        :param as_numpy: run the program on all the packets at once with
+            NumPy, and return a NumPy array (default: if NumPy is available)
+        """
+        if as_numpy is None:
+            as_numpy = bool(NUMPY)
+        if as_numpy:
+            return bpf_run_many(self.insns, packets, wirelens) != 0
+        if wirelens is None:
+            wirelens = [None] * len(packets)
+        return [bpf_run(self.insns, pkt, wirelen) != 0
+                for pkt, wirelen in zip(packets, wirelens)]
+
+    def __len__(self):
+        return len(self.insns)
+
+    def __iter__(self):
+        return iter(self.insns)
+
+    def __repr__(self):
+        return "<BPFProgram: %d instructions>" % len(self.insns)
+
+    def dump(self, dump=False):
+        """Prints the program as tcpdump -d does.
+
+        :param dump: return the text instead of printing it
+        """
+        res = "\n".join(_disasm(code, jt, jf, k, pc)
+                        for pc, (code, jt, jf, k) in enumerate(self.insns))
+        if dump:
+            return res
+        print(res)
+
+    def bpf_program(self):
+        """Returns the program as a `bpf_program` structure, that can be
+        attached to a socket"""
+        import ctypes
+        from scapy.libs.structures import bpf_insn, bpf_program
+        if any(jt > 255 or jf > 255 for _, jt, jf, _ in self.insns):
+            raise Scapy_Exception("BPF program too long: a jump offset "
+                                  "exceeds 255")
+        insns = (bpf_insn * len(self.insns))(*[
+            bpf_insn(code, jt, jf, k - (1 << 32) if k > 0x7fffffff else k)
+            for code, jt, jf, k in self.insns
+        ])
+        prog = bpf_program(len(self.insns),
+                           ctypes.cast(insns, ctypes.POINTER(bpf_insn)))
+        # Keep the instructions alive as long as the program
+        prog._insns = insns
+        return prog
+
+
+# The tcpdump filter syntax
+
+_TOKENS = re.compile(r"""\s*(?:
+    (?P<mac>(?:[0-9a-f]{1,2}[:.\-]){5}[0-9a-f]{1,2})(?![\w:.])|
+    (?P<ip6>(?:[0-9a-f]{0,4}:){2,7}(?:\d+(?:\.\d+){3}|[0-9a-f]{0,4}))
+        (?![\w:.])|
+    (?P<addr>\d+(?:\.\d+){1,3})(?![\w.])|
+    (?P<num>0x[0-9a-f]+|\d+)(?![\w.])|
+    (?P<id>\\?[a-z_][\w.\-]*)|
+    (?P<op>&&|\|\||<<|>>|<=|>=|==|!=|[()\[\]:!&|^+\-*/%<>=])
+)""", re.I | re.X)
+
+_BPF_LINK_PROTOS = {"ether", "link"}
+_BPF_NET_PROTOS = {"ip", "ip6", "arp", "rarp"}
+_BPF_TRANSPORT_PROTOS = {"tcp": 6, "udp": 17, "sctp": 132,
+                         "icmp": 1, "igmp": 2}
+_BPF_PROTOS = (_BPF_LINK_PROTOS | _BPF_NET_PROTOS |
+               set(_BPF_TRANSPORT_PROTOS) | {"icmp6"})
+_BPF_DIRS = {"src", "dst"}
+_BPF_TYPES = {"host", "net", "port", "portrange"}
+_BPF_KEYWORDS = (_BPF_PROTOS | _BPF_DIRS | _BPF_TYPES | {
+    "and", "or", "not", "proto", "broadcast", "multicast", "less",
+    "greater", "vlan", "len", "mask", "gateway", "inbound", "outbound",
+})
+_BPF_ETHER_PROTOS = {"ip": ETH_P_IP, "ip6": ETH_P_IPV6, "arp": ETH_P_ARP,
+                     "rarp": 0x8035}
+_BPF_IP_PROTOS = dict(_BPF_TRANSPORT_PROTOS, icmp6=58)
+_BPF_CONSTANTS = {
+    "tcpflags": 13, "tcp-fin": 0x01, "tcp-syn": 0x02, "tcp-rst": 0x04,
+    "tcp-push": 0x08, "tcp-ack": 0x10, "tcp-urg": 0x20, "tcp-ece": 0x40,
+    "tcp-cwr": 0x80,
+    "icmptype": 0, "icmpcode": 1, "icmp-echoreply": 0, "icmp-unreach": 3,
+    "icmp-sourcequench": 4, "icmp-redirect": 5, "icmp-echo": 8,
+    "icmp-routeradvert": 9, "icmp-routersolicit": 10, "icmp-timxceed": 11,
+    "icmp-paramprob": 12, "icmp-tstamp": 13, "icmp-tstampreply": 14,
+    "icmp-ireq": 15, "icmp-ireqreply": 16, "icmp-maskreq": 17,
+    "icmp-maskreply": 18,
+    "icmp6type": 0, "icmp6code": 1, "icmp6-destinationunreach": 1,
+    "icmp6-packettoobig": 2, "icmp6-timeexceeded": 3,
+    "icmp6-parameterproblem": 4, "icmp6-echo": 128, "icmp6-echoreply": 129,
+    "icmp6-routersolicit": 133, "icmp6-routeradvert": 134,
+    "icmp6-neighborsolicit": 135, "icmp6-neighboradvert": 136,
+    "icmp6-redirect": 137,
+}
+# Priorities of the arithmetic operators
+_BPF_ARITH = {"|": 1, "^": 2, "&": 3, "<<": 4, ">>": 4, "+": 5, "-": 5,
+              "*": 6, "/": 6, "%": 6}
+_BPF_ARITH_OPS = {"|": BPF_OR, "^": BPF_XOR, "&": BPF_AND, "<<": BPF_LSH,
+                  ">>": BPF_RSH, "+": BPF_ADD, "-": BPF_SUB, "*": BPF_MUL,
+                  "/": BPF_DIV, "%": BPF_MOD}
+# Relational operators: (jump, negated)
+_BPF_RELOPS = {"=": (BPF_JEQ, False), "==": (BPF_JEQ, False),
+               "!=": (BPF_JEQ, True), ">": (BPF_JGT, False),
+               ">=": (BPF_JGE, False), "<": (BPF_JGE, True),
+               "<=": (BPF_JGT, True)}
+
+
+def _tokenize(filter_exp):
+    """Splits a filter expression in (kind, value) tokens"""
+    tokens = []
+    pos = 0
+    filter_exp = filter_exp.rstrip()
+    while pos < len(filter_exp):
+        match = _TOKENS.match(filter_exp, pos)
+        if match is None:
+            raise Scapy_Exception("Syntax error in filter expression at %r" %
+                                  filter_exp[pos:].strip())
+        kind = match.lastgroup
+        tokens.append((kind, match.group(kind)))
+        pos = match.end()
+    return tokens
+
+
+def _num(value):
+    """Parses a number as tcpdump does"""
+    if value[:2].lower() == "0x":
+        return int(value, 16)
+    if len(value) > 1 and value[0] == "0":
+        return int(value, 8)
+    return int(value)
+
+
+class _BPFParser(object):
+    """Parses a tcpdump filter expression into a tree of tuples.
+
+    Do not use directly, use BPFFilter.
+    """
+
+    def __init__(self, filter_exp):
+        self.tokens = _tokenize(filter_exp)
+        self.pos = 0
+        # The qualifiers of the last primitive, used by the values without
+        # qualifiers, as in "host a or b"
+        self.quals = None
+
+    def peek(self, offset=0):
+        if self.pos + offset < len(self.tokens):
+            return self.tokens[self.pos + offset]
+        return (None, None)
+
+    def value(self, offset=0):
+        """Returns the value of a token, lower-cased if it is a word"""
+        kind, value = self.peek(offset)
+        if kind in ("id", "mac", "ip6"):
+            return value.lower()
+        return value
+
+    def next(self):
+        tok = self.peek()
+        if tok[0] is None:
+            raise Scapy_Exception("Unexpected end of filter expression")
+        self.pos += 1
+        return tok
+
+    def expect(self, value):
+        if self.value() != value:
+            raise Scapy_Exception("Syntax error in filter expression: "
+                                  "expected %r, got %r" % (value,
+                                                           self.peek()[1]))
+        self.pos += 1
+
+    def error(self):
+        return Scapy_Exception("Syntax error in filter expression near %r" %
+                               (self.peek()[1] or "end"))
+
+    def parse(self):
+        if not self.tokens:
+            return ("true",)
+        node = self.parse_expr()
+        if self.pos != len(self.tokens):
+            raise self.error()
+        return node
+
+    def parse_expr(self):
+        # "and" and "or" have the same priority
+        node = self.parse_term()
+        while self.value() in ("and", "&&", "or", "||"):
+            oper = "and" if self.next()[1].lower() in ("and", "&&") else "or"
+            node = (oper, node, self.parse_term())
+        return node
+
+    def parse_term(self):
+        if self.value() in ("not", "!"):
+            self.next()
+            return ("not", self.parse_term())
+        # Try a comparison first, as in "(ip[0] & 0xf) > 5"
+        pos, quals = self.pos, self.quals
+        try:
+            return self.parse_relation()
+        except Scapy_Exception:
+            self.pos, self.quals = pos, quals
+        if self.value() == "(":
+            self.next()
+            node = self.parse_expr()
+            self.expect(")")
+            return node
+        return self.parse_primitive()
+
+    def parse_relation(self):
+        left = self.parse_arith()
+        oper = self.value()
+        if oper not in _BPF_RELOPS:
+            raise self.error()
+        self.next()
+        return ("rel", left, oper, self.parse_arith())
+
+    def parse_arith(self, priority=1):
+        node = self.parse_operand()
+        while _BPF_ARITH.get(self.value(), 0) >= priority:
+            oper = self.next()[1]
+            node = ("alu", oper, node, self.parse_arith(_BPF_ARITH[oper] + 1))
+        return node
+
+    def parse_operand(self):
+        kind, value = self.next()
+        if kind == "num":
+            return ("num", _num(value))
+        if value == "(":
+            node = self.parse_arith()
+            self.expect(")")
+            return node
+        value = value.lower()
+        if value == "len":
+            return ("len",)
+        if value in _BPF_CONSTANTS:
+            return ("num", _BPF_CONSTANTS[value])
+        if value in _BPF_PROTOS and self.value() == "[":
+            self.next()
+            index = self.parse_arith()
+            size = 1
+            if self.value() == ":":
+                self.next()
+                size = _num(self.next()[1])
+                if size not in (1, 2, 4):
+                    raise Scapy_Exception("Data size must be 1, 2 or 4")
+            self.expect("]")
+            return ("load", value, index, size)
+        self.pos -= 1
+        raise self.error()
+
+    def parse_primitive(self):
+        value = self.value()
+        if value in ("less", "greater"):
+            self.next()
+            return ("rel", ("len",), "<=" if value == "less" else ">=",
+                    ("num", _num(self.next()[1])))
+        if value == "vlan":
+            self.next()
+            if self.peek()[0] == "num":
+                return ("vlan", _num(self.next()[1]))
+            return ("vlan", None)
+        if value in ("inbound", "outbound", "gateway"):
+            raise Scapy_Exception("%r is not supported" % value)
+        proto = direction = typ = None
+        if value in _BPF_PROTOS:
+            proto = self.next()[1].lower()
+        if self.value() == "proto":
+            self.next()
+            return ("proto", proto, self.parse_proto_value())
+        if self.value() in ("broadcast", "multicast"):
+            return ("cast", proto, self.next()[1].lower())
+        if self.value() in _BPF_DIRS:
+            direction = self.next()[1].lower()
+            if self.value() in ("or", "and") and \
+                    self.value(1) in _BPF_DIRS - {direction}:
+                direction = "src and dst" if self.value() in ("and", "&&") \
+                    else "src or dst"
+                self.pos += 2
+        if self.value() in _BPF_TYPES:
+            typ = self.next()[1].lower()
+        if proto is not None and direction is None and typ is None:
+            # A protocol alone, as "tcp"
+            return ("abbrev", proto)
+        if proto is None and direction is None and typ is None:
+            if self.quals is None:
+                typ = "host"
+            else:
+                # A value alone, as "b" in "host a or b"
+                proto, direction, typ = self.quals
+        self.quals = (proto, direction, typ)
+        return self.parse_value(proto, direction, typ)
+
+    def parse_proto_value(self):
+        kind, value = self.next()
+        if kind == "num":
+            return _num(value)
+        value = value.lower().lstrip("\\")
+        if kind == "id" and value in _BPF_ETHER_PROTOS or \
+                value in _BPF_IP_PROTOS:
+            return value
+        raise Scapy_Exception("Unknown protocol %r" % value)
+
+    def parse_value(self, proto, direction, typ):
+        kind, value = self.next()
+        if kind == "op" or value.lower() in _BPF_KEYWORDS:
+            self.pos -= 1
+            raise self.error()
+        if typ == "portrange":
+            if self.value() != "-":
+                raise Scapy_Exception("Invalid port range %r" % value)
+            self.next()
+            return ("portrange", proto, direction,
+                    (value, self.next()[1]))
+        if typ == "net":
+            prefix = None
+            if self.value() == "/":
+                self.next()
+                prefix = ("len", _num(self.next()[1]))
+            elif self.value() == "mask":
+                self.next()
+                prefix = ("mask", self.next()[1])
+            return ("net", proto, direction, (value, prefix))
+        return (typ or "host", proto, direction, value)
+
+
+class _BPFCompiler(object):
+    """Generates the BPF program of a parsed filter, for a link type.
+
+    Do not use directly, use BPFFilter.
+    """
+
+    def __init__(self, linktype):
+        self.linktype = linktype
+        if linktype == DLT_EN10MB:
+            self.off_type, self.off_nl = 12, 14
+        elif linktype == DLT_LINUX_SLL:
+            self.off_type, self.off_nl = 14, 16
+        elif linktype in (DLT_RAW, DLT_RAW_ALT, DLT_IPV4, DLT_IPV6):
+            self.off_type, self.off_nl = None, 0
+        else:
+            raise Scapy_Exception("Unsupported link type %r" % linktype)
+        # [code, jt label, jf label, k], and the labels positions
+        self.insns = []
+        self.labels = []
+        self.scratch = 0
+
+    def compile(self, node):
+        accept, reject = self.label(), self.label()
+        self.gen(node, accept, reject)
+        self.place(accept)
+        self.insns.append([BPF_RET | BPF_K, None, None, BPF_SNAPLEN])
+        self.place(reject)
+        self.insns.append([BPF_RET | BPF_K, None, None, 0])
+        insns = []
+        for pc, (code, jt, jf, k) in enumerate(self.insns):
+            if code & 0x07 == BPF_JMP:
+                if code & 0xf0 == BPF_JA:
+                    k = self.labels[k] - pc - 1
+                else:
+                    jt = self.labels[jt] - pc - 1
+                    jf = self.labels[jf] - pc - 1
+            insns.append((code, jt or 0, jf or 0, k & 0xffffffff))
+        return BPFProgram(insns, self.linktype)
+
+    # Code generation
+
+    def label(self):
+        self.labels.append(None)
+        return len(self.labels) - 1
+
+    def place(self, label):
+        self.labels[label] = len(self.insns)
+
+    def emit(self, code, k=0, jt=None, jf=None):
+        self.insns.append([code, jt, jf, k])
+
+    def alloc(self):
+        if self.scratch >= BPF_MEMWORDS:
+            raise Scapy_Exception("Filter expression too complex")
+        self.scratch += 1
+        return self.scratch - 1
+
+    def gen(self, node, jt, jf):
+        """Emits the code of a boolean expression, that jumps to `jt` if
+        it is true, or `jf`"""
+        kind = node[0]
+        if kind == "and" or kind == "or":
+            middle = self.label()
+            if kind == "and":
+                self.gen(node[1], middle, jf)
+            else:
+                self.gen(node[1], jt, middle)
+            self.place(middle)
+            self.gen(node[2], jt, jf)
+        elif kind == "not":
+            self.gen(node[1], jf, jt)
+        elif kind == "true" or kind == "false":
+            self.emit(BPF_JMP | BPF_JA, jt if kind == "true" else jf)
+        elif kind == "rel":
+            _, left, oper, right = node
+            protos = self.load_protos(left) | self.load_protos(right)
+            cond = ("cmp", left, oper, right)
+            for proto in sorted(protos):
+                cond = _and(self.load_check(proto), cond)
+            if cond[0] == "cmp":
+                self.gen_cmp(left, oper, right, jt, jf)
+            else:
+                self.gen(cond, jt, jf)
+        elif kind == "cmp":
+            self.gen_cmp(node[1], node[2], node[3], jt, jf)
+        else:
+            self.gen(getattr(self, "prim_" + kind)(*node[1:]), jt, jf)
+
+    def gen_cmp(self, left, oper, right, jt, jf):
+        jump, negate = _BPF_RELOPS[oper]
+        if negate:
+            jt, jf = jf, jt
+        if right[0] == "num":
+            self.gen_arith(left)
+            self.emit(BPF_JMP | jump | BPF_K, right[1], jt, jf)
+            return
+        mem = self.alloc()
+        self.gen_arith(right)
+        self.emit(BPF_ST, mem)
+        self.gen_arith(left)
+        self.emit(BPF_LDX | BPF_MEM, mem)
+        self.scratch -= 1
+        self.emit(BPF_JMP | jump | BPF_X, 0, jt, jf)
+
+    def gen_arith(self, node):
+        """Emits the code that loads the value of `node` in A"""
+        kind = node[0]
+        if kind == "num":
+            self.emit(BPF_LD | BPF_IMM, node[1])
+        elif kind == "len":
+            self.emit(BPF_LD | BPF_W | BPF_LEN)
+        elif kind == "ld":
+            # Absolute load
+            self.emit(BPF_LD | _bpf_size(node[2]) | BPF_ABS, node[1])
+        elif kind == "ldt":
+            # Load from the header following an IPv4 header
+            self.emit(BPF_LDX | BPF_B | BPF_MSH, self.off_nl)
+            self.emit(BPF_LD | _bpf_size(node[2]) | BPF_IND,
+                      self.off_nl + node[1])
+        elif kind == "load":
+            _, proto, index, size = node
+            offset, transport = self.load_base(proto)
+            if index[0] == "num":
+                self.gen_arith(("ldt" if transport else "ld",
+                                offset + index[1], size))
+                return
+            self.gen_arith(index)
+            if transport:
+                self.emit(BPF_LDX | BPF_B | BPF_MSH, self.off_nl)
+                self.emit(BPF_ALU | BPF_ADD | BPF_X)
+            self.emit(BPF_MISC | BPF_TAX)
+            self.emit(BPF_LD | _bpf_size(size) | BPF_IND,
+                      self.off_nl + offset if transport else offset)
+        elif kind == "alu":
+            _, oper, left, right = node
+            oper = _BPF_ARITH_OPS[oper]
+            if right[0] == "num":
+                if right[1] == 0 and oper in (BPF_DIV, BPF_MOD):
+                    raise Scapy_Exception("Division by zero in filter "
+                                          "expression")
+                self.gen_arith(left)
+                self.emit(BPF_ALU | oper | BPF_K, right[1])
+                return
+            mem = self.alloc()
+            self.gen_arith(right)
+            self.emit(BPF_ST, mem)
+            self.gen_arith(left)
+            self.emit(BPF_LDX | BPF_MEM, mem)
+            self.scratch -= 1
+            self.emit(BPF_ALU | oper | BPF_X)
+        else:
+            raise Scapy_Exception("Invalid expression %r" % (node,))
+
+    # Protocol headers
+
+    def load_protos(self, node):
+        """Returns the protocols of the proto[index] loads of `node`"""
+        if node[0] == "load":
+            return {node[1]} | self.load_protos(node[2])
+        if node[0] == "alu":
+            return self.load_protos(node[2]) | self.load_protos(node[3])
+        return set()
+
+    def load_base(self, proto):
+        """Returns the offset of the header of `proto`, and whether it
+        follows an IPv4 header"""
+        if proto in _BPF_LINK_PROTOS:
+            if self.off_type is None:
+                raise Scapy_Exception("%s[] is not supported on this link "
+                                      "type" % proto)
+            return 0, False
+        if proto in _BPF_NET_PROTOS:
+            return self.off_nl, False
+        if proto == "icmp6":
+            return self.off_nl + 40, False
+        return 0, True
+
+    def load_check(self, proto):
+        """Returns the condition for proto[index] loads to be valid"""
+        if proto in _BPF_LINK_PROTOS:
+            return ("true",)
+        if proto in _BPF_NET_PROTOS:
+            return self.prim_abbrev(proto)
+        if proto == "icmp6":
+            return self.ip6_proto(58)
+        # A transport header: only in the first fragment
+        return _and(self.ip_proto(_BPF_TRANSPORT_PROTOS[proto]),
+                    self.ip_first_frag())
+
+    def link_proto(self, ethertype):
+        """Returns the condition of the link layer carrying `ethertype`"""
+        if self.off_type is not None:
+            return _eq(("ld", self.off_type, 2), ethertype)
+        # Raw IP: check the version
+        if self.linktype == DLT_IPV4:
+            return ("true",) if ethertype == ETH_P_IP else ("false",)
+        if self.linktype == DLT_IPV6:
+            return ("true",) if ethertype == ETH_P_IPV6 else ("false",)
+        version = {ETH_P_IP: 0x40, ETH_P_IPV6: 0x60}.get(ethertype)
+        if version is None:
+            return ("false",)
+        return _eq(("alu", "&", ("ld", 0, 1), ("num", 0xf0)), version)
+
+    def ip_proto(self, proto):
+        return _and(self.link_proto(ETH_P_IP),
+                    _eq(("ld", self.off_nl + 9, 1), proto))
+
+    def ip6_proto(self, proto):
+        return _and(self.link_proto(ETH_P_IPV6),
+                    _eq(("ld", self.off_nl + 6, 1), proto))
+
+    def ip_first_frag(self):
+        return _eq(("alu", "&", ("ld", self.off_nl + 6, 2),
+                    ("num", 0x1fff)), 0)
+
+    def ether_only(self, what):
+        if self.linktype != DLT_EN10MB:
+            raise Scapy_Exception("%s is not supported on this link type" %
+                                  what)
+
+    # Primitives
+
+    def prim_abbrev(self, proto):
+        if proto in _BPF_ETHER_PROTOS:
+            return self.link_proto(_BPF_ETHER_PROTOS[proto])
+        if proto in ("tcp", "udp", "sctp"):
+            num = _BPF_TRANSPORT_PROTOS[proto]
+            return _or(self.ip_proto(num), self.ip6_proto(num))
+        if proto == "icmp6":
+            return self.ip6_proto(58)
+        if proto in _BPF_TRANSPORT_PROTOS:
+            return self.ip_proto(_BPF_TRANSPORT_PROTOS[proto])
+        raise Scapy_Exception("%r needs a qualifier" % proto)
+
+    def prim_proto(self, proto, value):
+        if proto in _BPF_LINK_PROTOS:
+            if not isinstance(value, int):
+                value = _BPF_ETHER_PROTOS[value]
+            return self.link_proto(value)
+        if not isinstance(value, int):
+            value = _BPF_IP_PROTOS[value]
+        if proto == "ip":
+            return self.ip_proto(value)
+        if proto == "ip6":
+            return self.ip6_proto(value)
+        if proto is None:
+            return _or(self.ip_proto(value), self.ip6_proto(value))
+        raise Scapy_Exception("%s proto is not supported" % proto)
+
+    def prim_cast(self, proto, kind):
+        if proto in (None, "ether", "link"):
+            self.ether_only("%s %s" % (proto or "ether", kind))
+            if kind == "multicast":
+                return _ne(("alu", "&", ("ld", 0, 1), ("num", 1)), 0)
+            return _and(_eq(("ld", 2, 4), 0xffffffff),
+                        _eq(("ld", 0, 2), 0xffff))
+        if kind == "multicast" and proto == "ip":
+            return _and(self.link_proto(ETH_P_IP),
+                        ("rel", ("ld", self.off_nl + 16, 1), ">=",
+                         ("num", 224)))
+        if kind == "multicast" and proto == "ip6":
+            return _and(self.link_proto(ETH_P_IPV6),
+                        _eq(("ld", self.off_nl + 24, 1), 0xff))
+        raise Scapy_Exception("%s %s is not supported" % (proto, kind))
+
+    def prim_vlan(self, vlan_id):
+        self.ether_only("vlan")
+        cond = _or(_eq(("ld", self.off_type, 2), 0x8100),
+                   _or(_eq(("ld", self.off_type, 2), 0x88a8),
+                       _eq(("ld", self.off_type, 2), 0x9100)))
+        if vlan_id is not None:
+            cond = _and(cond, _eq(("alu", "&", ("ld", self.off_nl, 2),
+                                   ("num", 0xfff)), vlan_id))
+        # As with tcpdump, the next primitives apply to the
+        # encapsulated frame
+        self.off_type += 4
+        self.off_nl += 4
+        return cond
+
+    def prim_host(self, proto, direction, value):
+        if proto in _BPF_LINK_PROTOS:
+            self.ether_only("ether host")
+            try:
+                mac = struct.unpack("!HI", bytes(bytearray(
+                    int(byte, 16) for byte in re.split("[:.-]", value)
+                )))
+            except (ValueError, struct.error):
+                raise Scapy_Exception("Invalid MAC address %r" % value)
+
+            def ether(off):
+                return _and(_eq(("ld", off + 2, 4), mac[1]),
+                            _eq(("ld", off, 2), mac[0]))
+            return _dir(direction, ether(6), ether(0))
+        if ":" in value:
+            return self.ip6_net(proto, direction, value, 128)
+        try:
+            addrs = [_ip2int(value)]
+        except Scapy_Exception:
+            if value.replace(".", "").isdigit():
+                raise
+            try:
+                addrs = [_ip2int(addr) for addr in
+                         socket.gethostbyname_ex(value)[2]]
+            except socket.error:
+                raise Scapy_Exception("Unknown host %r" % value)
+        res = ("false",)
+        for addr in addrs:
+            res = _or(res, self.ip_net(proto, direction, addr, 0xffffffff))
+        return res
+
+    def prim_net(self, proto, direction, value):
+        value, prefix = value
+        if ":" in value:
+            if prefix is None or prefix[0] != "len":
+                raise Scapy_Exception("IPv6 networks need a prefix length")
+            return self.ip6_net(proto, direction, value, prefix[1])
+        if prefix is None:
+            # "net 10" or "net 10.1": the given bytes are the network
+            parts = value.split(".")
+            value = ".".join(parts + ["0"] * (4 - len(parts)))
+            prefix = ("len", 8 * len(parts))
+        if prefix[0] == "len":
+            if not 0 <= prefix[1] <= 32:
+                raise Scapy_Exception("Invalid prefix length %d" % prefix[1])
+            mask = (0xffffffff << (32 - prefix[1])) & 0xffffffff
+        else:
+            mask = _ip2int(prefix[1])
+        net = _ip2int(value)
+        if net & ~mask & 0xffffffff:
+            raise Scapy_Exception("Non-network bits set in %r" % value)
+        return self.ip_net(proto, direction, net, mask)
+
+    def ip_net(self, proto, direction, net, mask):
+        offsets = {"ip": (12, 16), "arp": (14, 24), "rarp": (14, 24)}
+        if proto is None:
+            protos = ["ip", "arp", "rarp"]
+        elif proto in offsets:
+            protos = [proto]
+        else:
+            raise Scapy_Exception("%s host/net is not supported" % proto)
+        res = ("false",)
+        for proto in protos:
+            src, dst = offsets[proto]
+
+            def addr(off):
+                load = ("ld", self.off_nl + off, 4)
+                if mask != 0xffffffff:
+                    load = ("alu", "&", load, ("num", mask))
+                return _eq(load, net)
+            res = _or(res, _and(
+                self.link_proto(_BPF_ETHER_PROTOS[proto]),
+                _dir(direction, addr(src), addr(dst)),
+            ))
+        return res
+
+    def ip6_net(self, proto, direction, value, prefix):
+        if proto not in (None, "ip6"):
+            raise Scapy_Exception("%s host/net is not supported for IPv6" %
+                                  proto)
+        try:
+            words = struct.unpack("!4I", inet_pton(socket.AF_INET6, value))
+        except (socket.error, ValueError):
+            raise Scapy_Exception("Invalid IPv6 address %r" % value)
+        if not 0 <= prefix <= 128:
+            raise Scapy_Exception("Invalid prefix length %d" % prefix)
+
+        def addr(off):
+            res = ("true",)
+            for i, word in enumerate(words):
+                bits = min(max(prefix - 32 * i, 0), 32)
+                if not bits:
+                    break
+                mask = (0xffffffff << (32 - bits)) & 0xffffffff
+                load = ("ld", self.off_nl + off + 4 * i, 4)
+                if bits < 32:
+                    load = ("alu", "&", load, ("num", mask))
+                res = _and(res, _eq(load, word & mask))
+            return res
+        return _and(self.link_proto(ETH_P_IPV6),
+                    _dir(direction, addr(8), addr(24)))
+
+    def prim_port(self, proto, direction, value):
+        return self.prim_portrange(proto, direction, (value, value))
+
+    def prim_portrange(self, proto, direction, value):
+        if proto is None:
+            protos = ["tcp", "udp", "sctp"]
+        elif proto in ("tcp", "udp", "sctp"):
+            protos = [proto]
+        else:
+            raise Scapy_Exception("%s port is not supported" % proto)
+        res = ("false",)
+        for proto in protos:
+            low, high = [_port(port, proto) for port in value]
+            if low > high:
+                low, high = high, low
+
+            def port(load):
+                if low == high:
+                    return _eq(load, low)
+                return _and(("rel", load, ">=", ("num", low)),
+                            ("rel", load, "<=", ("num", high)))
+            num = _BPF_TRANSPORT_PROTOS[proto]
+            ip4 = _and(_and(self.ip_proto(num), self.ip_first_frag()),
+                       _dir(direction, port(("ldt", 0, 2)),
+                            port(("ldt", 2, 2))))
+            off = self.off_nl + 40
+            ip6 = _and(self.ip6_proto(num),
+                       _dir(direction, port(("ld", off, 2)),
+                            port(("ld", off + 2, 2))))
+            res = _or(res, _or(ip4, ip6))
+        return res
+
+
+def _bpf_size(size):
+    return {1: BPF_B, 2: BPF_H, 4: BPF_W}[size]
+
+
+def _and(left, right):
+    if left[0] == "false" or right[0] == "true":
+        return left
+    if left[0] == "true" or right[0] == "false":
+        return right
+    return ("and", left, right)
+
+
+def _or(left, right):
+    if left[0] == "true" or right[0] == "false":
+        return left
+    if left[0] == "false" or right[0] == "true":
+        return right
+    return ("or", left, right)
+
+
+def _eq(load, value):
+    return ("cmp", load, "==", ("num", value))
+
+
+def _ne(load, value):
+    return ("cmp", load, "!=", ("num", value))
+
+
+def _dir(direction, src, dst):
+    if direction == "src":
+        return src
+    if direction == "dst":
+        return dst
+    if direction == "src and dst":
+        return _and(src, dst)
+    return _or(src, dst)
+
+
+def _ip2int(addr):
+    try:
+        if addr.count(".") != 3:
+            raise ValueError
+        return struct.unpack("!I", inet_pton(socket.AF_INET, addr))[0]
+    except (socket.error, ValueError):
+        raise Scapy_Exception("Invalid IPv4 address %r" % addr)
+
+
+def _port(value, proto):
+    try:
+        return _num(value)
+    except ValueError:
+        try:
+            return socket.getservbyname(value, proto)
+        except (socket.error, OSError):
+            try:
+                return socket.getservbyname(value)
+            except (socket.error, OSError):
+                raise Scapy_Exception("Unknown port %r" % value)
+
+
+class BPFFilter(object):
+    """A tcpdump filter expression, parsed once, and compiled to a BPF
+    program for each link type it is used with.
+
+    It supports the common part of the tcpdump filter syntax (see
+    pcap-filter(7)): the ether, ip, ip6, arp, rarp, tcp, udp, sctp, icmp,
+    icmp6 and igmp protocols, the host, net, port and portrange primitives
+    with their src and dst qualifiers, proto, broadcast, multicast, vlan,
+    less, greater, and comparisons of arithmetic expressions of
+    proto[index:size] loads. The Ethernet, Linux cooked (SLL) and raw IP
+    link types are supported.
+
+    >>> flt = BPFFilter("tcp dst port 80 and not host 10.0.0.1")
+    >>> flt.match(raw(Ether() / IP() / TCP()))
+    True
+
+    :param filter_exp: the filter expression
+    """
+
+    def __init__(self, filter_exp):
+        self.filter_exp = filter_exp
+        self.tree = _BPFParser(filter_exp).parse()
+        self.programs = {}
+
+    def compile(self, linktype=DLT_EN10MB):
+        """Returns the BPFProgram of the filter for `linktype`"""
+        try:
+            return self.programs[linktype]
+        except KeyError:
+            prog = _BPFCompiler(linktype).compile(self.tree)
+            self.programs[linktype] = prog
+            return prog
+
+    def match(self, data, linktype=DLT_EN10MB, wirelen=None):
+        """Returns True if the raw packet `data` matches the filter"""
+        return self.compile(linktype).match(data, wirelen)
+
+    def __repr__(self):
+        return "<BPFFilter %r>" % self.filter_exp
+
+
+def bpf_compile(filter_exp, linktype=DLT_EN10MB):
+    """Compiles a tcpdump filter expression to a BPF program, without
+    libpcap.
+
+    >>> bpf_compile("udp port 53").dump()
+    (000) ldh      [12]
+    [...]
+
+    :param filter_exp: the filter expression (see BPFFilter)
+    :param linktype: the link type of the packets
+    :returns: a BPFProgram
+    """
+    return BPFFilter(filter_exp).compile(linktype)
@@ -0,0 +1,139 @@
+# This file is part of Scapy
+# See http://www.secdev.org/projects/scapy for more information
+# Copyright (C) Philippe Biondi <phil@secdev.org>
+# This program is published under a GPLv2 license
+
+"""
+Checksums: Internet checksum (RFC 1071), with incremental updates
+(RFC 1624) and batches, and CRC32-C.
+"""
+
+from __future__ import absolute_import
+import binascii
+import struct
+
+from scapy.extlib import NUMPY, numpy
+import scapy.modules.six as six
+from scapy.modules.six.moves import range
+
+
+if six.PY2:
+    def _to_int(data):
+        return int(binascii.hexlify(data) or b"0", 16)
+else:
+    def _to_int(data):
+        return int.from_bytes(data, "big")
+
+
+def checksum_sum(*parts):
+    """Returns the one's complement sum of the 16-bit words of the
+    concatenated parts, in [0, 0xffff].
+
+    As 2**16 = 1 modulo 0xffff, this sum is computed as the remainder of the
+    data read as one big integer, which avoids iterating over its words.
+    All the parts but the last one must have an even length.
+    """
+    s = 0
+    for part in parts:
+        if len(part) % 2 == 1:
+            s += _to_int(part) << 8
+        else:
+            s += _to_int(part)
+    s %= 0xffff
+    if s == 0 and any(any(bytearray(part)) for part in parts):
+        # Non-zero data sums to -0
+        return 0xffff
+    return s
+
+
+def checksum(*parts):
+    """Computes the Internet checksum (RFC 1071) of the concatenated
+    parts, e.g. a pseudo-header and the upper layer, without copying them.
+    All the parts but the last one must have an even length.
+
+    :returns: the checksum, as an integer to pack in network order
+    """
+    return ~checksum_sum(*parts) & 0xffff
+
+
+def checksum_update(chksum, old, new, odd=False):
+    """Update an Internet checksum when the bytes `old` of the data are
+    replaced by `new`, without summing the whole data again (RFC 1624)
+
+    :param chksum: the checksum to update, as an integer
+    :param old: the replaced bytes
+    :param new: the new bytes, of the same length
+    :param odd: True if the bytes start at an odd offset of the data
+    :returns: the updated checksum
+    """
+    if odd:
+        old = b"\0" + old
+        new = b"\0" + new
+    if len(old) % 2 == 1:
+        old += b"\0"
+        new += b"\0"
+    fmt = "!%dH" % (len(old) // 2)
+    # HC' = ~(~HC + ~m + m')
+    s = (~chksum & 0xffff) + sum(struct.unpack(fmt, new))
+    s += sum(0xffff - w for w in struct.unpack(fmt, old))
+    while s >> 16:
+        s = (s >> 16) + (s & 0xffff)
+    return ~s & 0xffff
+
+
+def checksums(buffers, as_numpy=None):
+    """Computes the Internet checksums of many buffers at once.
+
+    With NumPy, the buffers are padded to the same length and summed as
+    the rows of a matrix of 16-bit words.
+
+    :param buffers: a list of strings
+    :param as_numpy: use NumPy (default: if NumPy is available)
+    :returns: a list of checksums (a NumPy array with NumPy)
+    """
+    if as_numpy is None:
+        as_numpy = bool(NUMPY)
+    elif as_numpy and not NUMPY:
+        raise ImportError("NumPy is not available")
+    if not as_numpy:
+        return [checksum(buf) for buf in buffers]
+    width = max([len(buf) for buf in buffers] or [0])
+    width += width % 2
+    if not buffers or not width:
+        return numpy.full(len(buffers), 0xffff, dtype=numpy.uint16)
+    words = numpy.frombuffer(
+        b"".join(buf.ljust(width, b"\0") for buf in buffers),
+        dtype=">u2",
+    ).reshape(len(buffers), width // 2)
+    s = words.sum(axis=1, dtype=numpy.uint64)
+    for _ in range(3):
+        s = (s & 0xffff) + (s >> 16)
+    return (~s & 0xffff).astype(numpy.uint16)
+
+
+# CRC32-C (Castagnoli), reflected polynomial of 0x1EDC6F41
+def _crc32c_table():
+    table = []
+    for i in range(256):
+        crc = i
+        for _ in range(8):
+            crc = (crc >> 1) ^ (0x82F63B78 if crc & 1 else 0)
+        table.append(crc)
+    return table
+
+
+crc32c_table = _crc32c_table()
+
+
+def crc32c(buf):
+    """Computes the CRC32-C of `buf`, used by SCTP (RFC 3309).
+
+    :returns: the CRC, as an integer to pack in network order
+    """
+    crc = 0xffffffff
+    table = crc32c_table
+    for c in bytearray(buf):
+        crc = (crc >> 8) ^ table[(crc ^ c) & 0xFF]
+    crc = (~crc) & 0xffffffff
+    # reverse endianness
+    return struct.unpack(">I", struct.pack("<I", crc))[0]
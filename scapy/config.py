@@ -9,7 +9,9 @@ Implementation of the configuration object.
 
 from __future__ import absolute_import
 from __future__ import print_function
+from collections import OrderedDict
 import functools
+import gzip
 import os
 import re
 import time
@@ -228,25 +230,74 @@ def lsc():
     print(repr(conf.commands))
 
 
-class CacheInstance(dict, object):
-    __slots__ = ["timeout", "name", "_timetable", "__dict__"]
+class CacheInstance(OrderedDict, object):
+    """A dict whose entries expire `timeout` seconds after they were set,
+    holding at most `max_size` entries.
 
-    def __init__(self, name="noname", timeout=None):
+    The entries are kept in least recently used order, and the least
+    recently used ones are evicted when the cache is full. The expired
+    entries are removed as new ones are set, or when the cache is read
+    as a whole (len(), items(), ...). The hits, misses, evictions and
+    expirations are counted.
+
+    :param name: the name of the cache, in NetCache
+    :param timeout: lifetime of the entries, in seconds (None: unlimited)
+    :param max_size: maximum number of entries (None: unlimited)
+    """
+    __slots__ = ["timeout", "name", "max_size", "_timetable", "hits",
+                 "misses", "evictions", "expirations"]
+
+    def __init__(self, name="noname", timeout=None, max_size=None):
+        OrderedDict.__init__(self)
         self.timeout = timeout
         self.name = name
-        self._timetable = {}
+        self.max_size = max_size
+        # {key: time it was set}, from the oldest
+        self._timetable = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
 
     def flush(self):
-        self.__init__(name=self.name, timeout=self.timeout)
+        OrderedDict.clear(self)
+        self._timetable.clear()
+
+    def _expire(self, now=None):
+        """Removes the expired entries"""
+        if self.timeout is None:
+            return
+        if now is None:
+            now = time.time()
+        timetable = self._timetable
+        while timetable:
+            key = next(iter(timetable))
+            if now - timetable[key] <= self.timeout:
+                break
+            del timetable[key]
+            OrderedDict.__delitem__(self, key)
+            self.expirations += 1
+
+    def _is_valid(self, item):
+        return self.timeout is None or \
+            time.time() - self._timetable[item] <= self.timeout
 
     def __getitem__(self, item):
         if item in self.__slots__:
             return object.__getattribute__(self, item)
-        val = dict.__getitem__(self, item)
-        if self.timeout is not None:
-            t = self._timetable[item]
-            if time.time() - t > self.timeout:
-                raise KeyError(item)
+        try:
+            val = dict.__getitem__(self, item)
+        except KeyError:
+            self.misses += 1
+            raise
+        if not self._is_valid(item):
+            self.misses += 1
+            self._expire()
+            raise KeyError(item)
+        # Move the entry to the most recently used end
+        OrderedDict.__delitem__(self, item)
+        OrderedDict.__setitem__(self, item, val)
+        self.hits += 1
         return val
 
     def get(self, item, default=None):
@@ -257,73 +308,159 @@ class CacheInstance(dict, object):
         except KeyError:
             return default
 
+    def __contains__(self, item):
+        return dict.__contains__(self, item) and self._is_valid(item)
+
+    def _set(self, item, v, set_time):
+        if dict.__contains__(self, item):
+            OrderedDict.__delitem__(self, item)
+            del self._timetable[item]
+        OrderedDict.__setitem__(self, item, v)
+        self._timetable[item] = set_time
+
     def __setitem__(self, item, v):
         if item in self.__slots__:
             return object.__setattr__(self, item, v)
-        self._timetable[item] = time.time()
-        dict.__setitem__(self, item, v)
+        now = time.time()
+        self._set(item, v, now)
+        self._expire(now)
+        if self.max_size is not None:
+            while dict.__len__(self) > self.max_size:
+                key = next(OrderedDict.__iter__(self))
+                OrderedDict.__delitem__(self, key)
+                del self._timetable[key]
+                self.evictions += 1
+
+    def __delitem__(self, item):
+        OrderedDict.__delitem__(self, item)
+        del self._timetable[item]
+
+    # The methods removing or setting entries are overloaded to keep the
+    # timetable in sync with the entries
+
+    def pop(self, item, *default):
+        self._expire()
+        if not dict.__contains__(self, item):
+            if default:
+                return default[0]
+            raise KeyError(item)
+        val = dict.__getitem__(self, item)
+        del self[item]
+        return val
+
+    def popitem(self, last=True):
+        self._expire()
+        if not dict.__len__(self):
+            raise KeyError("dictionary is empty")
+        if last:
+            key = next(OrderedDict.__reversed__(self))
+        else:
+            key = next(OrderedDict.__iter__(self))
+        val = dict.__getitem__(self, key)
+        del self[key]
+        return key, val
+
+    def clear(self):
+        self.flush()
+
+    def setdefault(self, item, default=None):
+        try:
+            return self[item]
+        except KeyError:
+            self[item] = default
+            return default
 
     def update(self, other):
+        other_times = getattr(other, "_timetable", None)
+        now = time.time()
         for key, value in six.iteritems(other):
+            set_time = now if other_times is None else other_times[key]
             # We only update an element from `other` either if it does
             # not exist in `self` or if the entry in `self` is older.
-            if key not in self or self._timetable[key] < other._timetable[key]:
-                dict.__setitem__(self, key, value)
-                self._timetable[key] = other._timetable[key]
+            if key not in self or self._timetable[key] < set_time:
+                self._set(key, value, set_time)
+        # Keep the timetable from the oldest entry
+        self._timetable = OrderedDict(
+            sorted(six.iteritems(self._timetable), key=lambda x: x[1])
+        )
+        self._expire(now)
+
+    def copy(self):
+        other = self.__class__(name=self.name, timeout=self.timeout,
+                               max_size=self.max_size)
+        for key in OrderedDict.__iter__(self):
+            other._set(key, dict.__getitem__(self, key),
+                       self._timetable[key])
+        other._timetable = self._timetable.copy()
+        return other
 
     def iteritems(self):
-        if self.timeout is None:
-            return six.iteritems(self.__dict__)
-        t0 = time.time()
-        return ((k, v) for (k, v) in six.iteritems(self.__dict__) if t0 - self._timetable[k] < self.timeout)  # noqa: E501
+        return iter(self.items())
 
     def iterkeys(self):
-        if self.timeout is None:
-            return six.iterkeys(self.__dict__)
-        t0 = time.time()
-        return (k for k in six.iterkeys(self.__dict__) if t0 - self._timetable[k] < self.timeout)  # noqa: E501
+        return iter(self.keys())
 
     def __iter__(self):
-        return six.iterkeys(self.__dict__)
+        return iter(self.keys())
 
     def itervalues(self):
-        if self.timeout is None:
-            return six.itervalues(self.__dict__)
-        t0 = time.time()
-        return (v for (k, v) in six.iteritems(self.__dict__) if t0 - self._timetable[k] < self.timeout)  # noqa: E501
+        return iter(self.values())
 
     def items(self):
-        if self.timeout is None:
-            return dict.items(self)
-        t0 = time.time()
-        return [(k, v) for (k, v) in six.iteritems(self.__dict__) if t0 - self._timetable[k] < self.timeout]  # noqa: E501
+        self._expire()
+        return [(k, dict.__getitem__(self, k))
+                for k in OrderedDict.__iter__(self)]
 
     def keys(self):
-        if self.timeout is None:
-            return dict.keys(self)
-        t0 = time.time()
-        return [k for k in six.iterkeys(self.__dict__) if t0 - self._timetable[k] < self.timeout]  # noqa: E501
+        self._expire()
+        return list(OrderedDict.__iter__(self))
 
     def values(self):
-        if self.timeout is None:
-            return list(six.itervalues(self))
-        t0 = time.time()
-        return [v for (k, v) in six.iteritems(self.__dict__) if t0 - self._timetable[k] < self.timeout]  # noqa: E501
+        self._expire()
+        return [dict.__getitem__(self, k) for k in OrderedDict.__iter__(self)]
 
     def __len__(self):
-        if self.timeout is None:
-            return dict.__len__(self)
-        return len(self.keys())
+        self._expire()
+        return dict.__len__(self)
+
+    def __reduce__(self):
+        return (self.__class__, (self.name, self.timeout, self.max_size),
+                None, None, iter(self.items()))
+
+    def save(self):
+        """Returns the valid entries, as (key, value, time set) tuples"""
+        return [(k, v, self._timetable[k]) for k, v in self.items()]
+
+    def load(self, entries):
+        """Adds the entries returned by save(), except the expired ones,
+        unless newer entries exist"""
+        now = time.time()
+        for key, value, set_time in sorted(entries, key=lambda x: x[2]):
+            if self.timeout is not None and now - set_time > self.timeout:
+                continue
+            if key not in self or self._timetable[key] < set_time:
+                self._set(key, value, set_time)
+        self._timetable = OrderedDict(
+            sorted(six.iteritems(self._timetable), key=lambda x: x[1])
+        )
+        if self.max_size is not None:
+            while dict.__len__(self) > self.max_size:
+                key = next(OrderedDict.__iter__(self))
+                del self[key]
 
     def summary(self):
-        return "%s: %i valid items. Timeout=%rs" % (self.name, len(self), self.timeout)  # noqa: E501
+        return "%s: %i valid items. Timeout=%rs. Max size=%r. Hits=%i, misses=%i, evictions=%i, expirations=%i" % (  # noqa: E501
+            self.name, len(self), self.timeout, self.max_size, self.hits,
+            self.misses, self.evictions, self.expirations,
+        )
 
     def __repr__(self):
         s = []
-        if self:
-            mk = max(len(k) for k in six.iterkeys(self.__dict__))
+        items = self.items()
+        if items:
+            mk = max(len(str(k)) for k, _ in items)
             fmt = "%%-%is %%s" % (mk + 1)
-            for item in six.iteritems(self.__dict__):
+            for item in items:
                 s.append(fmt % item)
         return "\n".join(s)
 
@@ -336,8 +473,8 @@ class NetCache:
         self._caches_list.append(cache)
         setattr(self, cache.name, cache)
 
-    def new_cache(self, name, timeout=None):
-        c = CacheInstance(name=name, timeout=timeout)
+    def new_cache(self, name, timeout=None, max_size=None):
+        c = CacheInstance(name=name, timeout=timeout, max_size=max_size)
         self.add_cache(c)
 
     def __delattr__(self, attr):
@@ -354,9 +491,30 @@ class NetCache:
         for c in self._caches_list:
             c.flush()
 
-    def __repr__(self):
+    def save(self, fname):
+        """Saves the valid entries of the caches to a file, to be loaded
+        with load(), e.g. in a later Scapy session"""
+        with gzip.open(fname, "wb") as fdesc:
+            six.moves.cPickle.dump(
+                dict((c.name, c.save()) for c in self._caches_list),
+                fdesc, -1
+            )
+
+    def load(self, fname):
+        """Loads the entries saved with save() into the caches, except the
+        expired ones"""
+        with gzip.open(fname, "rb") as fdesc:
+            saved = six.moves.cPickle.load(fdesc)
+        for c in self._caches_list:
+            if c.name in saved:
+                c.load(saved[c.name])
+
+    def summary(self):
         return "\n".join(c.summary() for c in self._caches_list)
 
+    def __repr__(self):
+        return self.summary()
+
 
 def _version_checker(module, minver):
     """Checks that module has a higher version that minver.
@@ -541,7 +699,8 @@ class Conf(ConfClass):
         padding: includes padding in disassembled packets
         except_filter : BPF filter for packets to ignore
         debug_match: when 1, store received packet that are not matched into
-            `debug.recv`
+            `debug.recv`, and the statistics of the answers index into
+            `debug.index`
         route: holds the Scapy routing table and provides methods to
             manipulate it
         warning_threshold : how much time between warnings from the same place
@@ -560,6 +719,15 @@ class Conf(ConfClass):
         recv_poll_rate: how often to check for new packets. Defaults to 0.05s.
         raise_no_dst_mac: When True, raise exception if no dst MAC found
             otherwise broadcast. Default is False.
+        lazy_dissection: When True, the payload of each layer is only
+            dissected when it is first accessed. Default is False.
+        zero_copy_dissection: When True, the fields of each layer are
+            dissected from a memoryview at increasing offsets, rather than
+            by slicing the remaining string. Default is False.
+        sprintf_cache_size: number of format strings compiled by
+            Packet.sprintf() that are kept. Default is 512.
+        route_cache_size: number of destinations whose route is kept by
+            conf.route and conf.route6. Default is 4096.
     """
     version = ReadOnlyAttribute("version", VERSION)
     session = ""
@@ -642,6 +810,10 @@ class Conf(ConfClass):
     auto_crop_tables = True
     recv_poll_rate = 0.05
     raise_no_dst_mac = False
+    zero_copy_dissection = False
+    lazy_dissection = False
+    sprintf_cache_size = 512
+    route_cache_size = 4096
 
     def __getattr__(self, attr):
         # Those are loaded on runtime to avoid import loops
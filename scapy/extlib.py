@@ -36,6 +36,16 @@ except (ImportError, RuntimeError):
     MATPLOTLIB_DEFAULT_PLOT_KARGS = dict()
     log_loading.info("Can't import matplotlib. Won't be able to plot.")
 
+# NUMPY
+
+try:
+    import numpy
+    NUMPY = 1
+except ImportError:
+    numpy = None
+    NUMPY = 0
+    log_loading.info("Can't import numpy. Columns will be returned as arrays.")  # noqa: E501
+
 # PYX
 
 
@@ -161,6 +161,24 @@ class Field(six.with_metaclass(Field_metaclass, object)):
         """
         return s[self.sz:], self.m2i(pkt, self.struct.unpack(s[:self.sz])[0])
 
+    def getfield_at(self, pkt, buf, off):
+        """Extract an internal value from a buffer, without copying it
+
+        Zero-copy counterpart of getfield(), used by Packet.do_dissect()
+        when conf.zero_copy_dissection is set. `buf` is a memoryview of the
+        raw layer and `off` the offset of the field in it (or a tuple
+        (offset, bits) inside bit fields).
+
+        Returns a two-element list,
+        first the offset right after the extracted field,
+        second the extracted field itself in internal representation.
+
+        Fields that only override getfield() are still dissected through it,
+        see offset_dissect_capable().
+        """
+        return off + self.sz, self.m2i(pkt,
+                                       self.struct.unpack_from(buf, off)[0])
+
     def do_copy(self, x):
         if hasattr(x, "copy"):
             return x.copy()
@@ -247,6 +265,12 @@ class ConditionalField(object):
         else:
             return s, None
 
+    def getfield_at(self, pkt, buf, off):
+        if self._evalcond(pkt):
+            return self.fld.getfield_at(pkt, buf, off)
+        else:
+            return off, None
+
     def addfield(self, pkt, s, val):
         if self._evalcond(pkt):
             return self.fld.addfield(pkt, s, val)
@@ -360,6 +384,9 @@ the value to set is also known) of ._find_fld_pkt() instead.
     def getfield(self, pkt, s):
         return self._find_fld_pkt(pkt).getfield(pkt, s)
 
+    def getfield_at(self, pkt, buf, off):
+        return self._find_fld_pkt(pkt).getfield_at(pkt, buf, off)
+
     def addfield(self, pkt, s, val):
         fld, val = self._find_fld_pkt_val(pkt, val)
         return fld.addfield(pkt, s, val)
@@ -415,6 +442,10 @@ class PadField(object):
         padlen = self.padlen(len(s) - len(remain))
         return remain[padlen:], val
 
+    def getfield_at(self, pkt, buf, off):
+        end, val = self._fld.getfield_at(pkt, buf, off)
+        return min(end + self.padlen(end - off), len(buf)), val
+
     def addfield(self, pkt, s, val):
         sval = self._fld.addfield(pkt, b"", val)
         return s + sval + struct.pack("%is" % (self.padlen(len(sval))), self._padwith)  # noqa: E501
@@ -438,6 +469,38 @@ class ReversePadField(PadField):
         return s + struct.pack("%is" % (self.padlen(len(s))), self._padwith) + sval  # noqa: E501
 
 
+def offset_dissect_capable(fld):
+    """Returns True if `fld` can be dissected with getfield_at().
+
+    This is the case when getfield_at() is implemented at least as deep as
+    getfield() in the field class hierarchy: a field (e.g. third-party) that
+    only overrides getfield() must keep being dissected through it.
+    Wrapping fields are capable if all the fields they wrap are.
+    """
+    if isinstance(fld, Emph):
+        return offset_dissect_capable(fld.fld)
+    if isinstance(fld, ActionField):
+        return offset_dissect_capable(fld._fld)
+    if isinstance(fld, ConditionalField):
+        wrapped = [fld.fld]
+    elif isinstance(fld, PadField):
+        wrapped = [fld._fld]
+    elif isinstance(fld, MultipleTypeField):
+        wrapped = [f for f, _ in fld.flds] + [fld.dflt]
+    else:
+        wrapped = []
+    if not all(offset_dissect_capable(f) for f in wrapped):
+        return False
+    mro = fld.__class__.__mro__
+
+    def _defined_in(attr):
+        for i, cls in enumerate(mro):
+            if attr in cls.__dict__:
+                return i
+        return len(mro)
+    return _defined_in("getfield_at") <= _defined_in("getfield")
+
+
 class FCSField(Field):
     """Special Field that gets its value from the end of the *packet*
     (Note: not layer, but packet).
@@ -722,6 +785,9 @@ class ThreeBytesField(ByteField):
     def getfield(self, pkt, s):
         return s[3:], self.m2i(pkt, struct.unpack(self.fmt, b"\x00" + s[:3])[0])  # noqa: E501
 
+    def getfield_at(self, pkt, buf, off):
+        return off + 3, self.m2i(pkt, struct.unpack(self.fmt, b"\x00" + buf[off:off + 3].tobytes())[0])  # noqa: E501
+
 
 class X3BytesField(ThreeBytesField, XByteField):
     def i2repr(self, pkt, x):
@@ -738,6 +804,9 @@ class LEThreeBytesField(ByteField):
     def getfield(self, pkt, s):
         return s[3:], self.m2i(pkt, struct.unpack(self.fmt, s[:3] + b"\x00")[0])  # noqa: E501
 
+    def getfield_at(self, pkt, buf, off):
+        return off + 3, self.m2i(pkt, struct.unpack(self.fmt, buf[off:off + 3].tobytes() + b"\x00")[0])  # noqa: E501
+
 
 class LEX3BytesField(LEThreeBytesField, XByteField):
     def i2repr(self, pkt, x):
@@ -1005,6 +1074,10 @@ class StrField(Field):
         else:
             return s[-self.remain:], self.m2i(pkt, s[:-self.remain])
 
+    def getfield_at(self, pkt, buf, off):
+        end = max(off, len(buf) - self.remain)
+        return end, self.m2i(pkt, buf[off:end].tobytes())
+
     def randval(self):
         return RandBin(RandNum(0, 1200))
 
@@ -1056,6 +1129,17 @@ class PacketLenField(PacketField):
             i = conf.raw_layer(load=s[:len_pkt])
         return s[len_pkt:], i
 
+    def getfield_at(self, pkt, buf, off):
+        len_pkt = self.length_from(pkt)
+        s = buf[off:][:len_pkt].tobytes()
+        try:
+            i = self.m2i(pkt, s)
+        except Exception:
+            if conf.debug_dissector:
+                raise
+            i = conf.raw_layer(load=s)
+        return off + len(s), i
+
 
 class PacketListField(PacketField):
     """PacketListField represents a series of Packet instances that might
@@ -1260,6 +1344,11 @@ class StrFixedLenField(StrField):
         len_pkt = self.length_from(pkt)
         return s[len_pkt:], self.m2i(pkt, s[:len_pkt])
 
+    def getfield_at(self, pkt, buf, off):
+        len_pkt = self.length_from(pkt)
+        val = buf[off:][:len_pkt]
+        return off + len(val), self.m2i(pkt, val.tobytes())
+
     def addfield(self, pkt, s, val):
         len_pkt = self.length_from(pkt)
         if len_pkt is None:
@@ -1323,6 +1412,11 @@ class StrLenField(StrField):
         len_pkt = self.length_from(pkt)
         return s[len_pkt:], self.m2i(pkt, s[:len_pkt])
 
+    def getfield_at(self, pkt, buf, off):
+        len_pkt = self.length_from(pkt)
+        val = buf[off:][:len_pkt]
+        return off + len(val), self.m2i(pkt, val.tobytes())
+
     def randval(self):
         return RandBin(RandNum(0, self.max_length or 1200))
 
@@ -1578,6 +1672,40 @@ class BitField(Field):
         # split the substring byte by byte
         _bytes = struct.unpack('!%dB' % nb_bytes, w)
 
+        b = self._bytes2bits(_bytes, bn)
+
+        bn += self.size
+        s = s[bn // 8:]
+        bn = bn % 8
+        b = self.m2i(pkt, b)
+        if bn:
+            return (s, bn), b
+        else:
+            return s, b
+
+    def getfield_at(self, pkt, buf, off):
+        if isinstance(off, tuple):
+            off, bn = off
+        else:
+            bn = 0
+        nb_bytes = (self.size + bn - 1) // 8 + 1
+        _bytes = struct.unpack_from('!%dB' % nb_bytes, buf, off)
+
+        b = self._bytes2bits(_bytes, bn)
+
+        bn += self.size
+        off += bn // 8
+        bn = bn % 8
+        b = self.m2i(pkt, b)
+        if bn:
+            return (off, bn), b
+        else:
+            return off, b
+
+    def _bytes2bits(self, _bytes, bn):
+        """Extract the value of the field from the bytes it spans, knowing
+        that `bn` bits of the first byte were already consumed"""
+        nb_bytes = len(_bytes)
         b = 0
         for c in range(nb_bytes):
             b |= int(_bytes[c]) << (nb_bytes - c - 1) * 8
@@ -1590,15 +1718,7 @@ class BitField(Field):
 
         if self.rev:
             b = self.reverse(b)
-
-        bn += self.size
-        s = s[bn // 8:]
-        bn = bn % 8
-        b = self.m2i(pkt, b)
-        if bn:
-            return (s, bn), b
-        else:
-            return s, b
+        return b
 
     def randval(self):
         return RandNum(0, 2**self.size - 1)
@@ -1625,6 +1745,196 @@ class XBitField(BitField):
         return lhex(self.i2h(pkt, x))
 
 
+class FixedFieldsRun(object):
+    """A run of consecutive fixed-size fields of a layer, handled with a
+    single precompiled struct.Struct.
+
+    Runs are computed once per Packet class by compile_fixed_runs() (see
+    Packet_metaclass) and used by Packet.do_dissect() and
+    Packet.self_build() instead of calling getfield()/addfield() for each
+    field. Each item of the struct is either a field, or a list of
+    (field, shift, mask) for bit fields packed in a whole number of bytes.
+    """
+    __slots__ = ["start", "stop", "struct", "sz", "items"]
+
+    def __init__(self, start, stop, fmt, items):
+        self.start = start
+        self.stop = stop
+        self.struct = struct.Struct(fmt)
+        self.sz = self.struct.size
+        self.items = items
+
+    def dissect(self, pkt, buf, off=0):
+        """Set the values of the fields of the run in `pkt`, from the raw
+        bytes of `buf` starting at `off`"""
+        for item, val in zip(self.items, self.struct.unpack_from(buf, off)):
+            if isinstance(item, list):
+                for fld, shift, mask in item:
+                    self._setfield(pkt, fld, (val >> shift) & mask)
+            else:
+                self._setfield(pkt, item, val)
+
+    @staticmethod
+    def _setfield(pkt, fld, val):
+        val = fld.m2i(pkt, val)
+        if fld.ismutable:
+            pkt.raw_packet_cache_fields[fld.name] = fld.do_copy(val)
+        pkt.fields[fld.name] = val
+
+    def build(self, pkt, vals):
+        """Returns the raw bytes of the run, given the internal values of
+        its fields"""
+        args = []
+        vals = iter(vals)
+        for item in self.items:
+            if isinstance(item, list):
+                v = 0
+                for fld, shift, mask in item:
+                    v |= (fld.i2m(pkt, next(vals)) & mask) << shift
+                args.append(v)
+            else:
+                args.append(item.i2m(pkt, next(vals)))
+        return self.struct.pack(*args)
+
+    def __repr__(self):
+        return "<FixedFieldsRun [%d:%d] %r>" % (
+            self.start, self.stop, self.struct.format
+        )
+
+
+def _fixed_field_kind(fld):
+    """Returns how `fld` can be part of a FixedFieldsRun: (fld, None, size)
+    for a bit field, (fld, order, code) for a field with a struct format,
+    or None if it has to be handled on its own"""
+    if isinstance(fld, Emph):
+        fld = fld.fld
+    if not isinstance(fld, Field) or fld.islist or fld.holds_packets:
+        return None
+    cls = fld.__class__
+    _u = six.get_unbound_function
+
+    def _inherits(base, *attrs):
+        return all(_u(getattr(cls, attr)) is _u(getattr(base, attr))
+                   for attr in attrs)
+    if isinstance(fld, BitField):
+        if not fld.rev and _inherits(BitField, "getfield", "addfield",
+                                     "getfield_at"):
+            return fld, None, fld.size
+        return None
+    if not _inherits(Field, "getfield", "addfield", "getfield_at") or \
+       fld.fmt[0] not in "!<>":
+        return None
+    try:
+        if len(fld.struct.unpack(b"\x00" * fld.sz)) != 1:
+            return None
+    except struct.error:
+        return None
+    return fld, "<" if fld.fmt[0] == "<" else "!", fld.fmt[1:]
+
+
+_FIXED_BITS_CODES = {8: "B", 16: "H", 32: "I", 64: "Q"}
+
+
+def _compile_fixed_run(flist, start):
+    order = None
+    fmt = ""
+    items = []
+    group = []
+    bits = 0
+    stop = start
+    for i in range(start, len(flist)):
+        kind = _fixed_field_kind(flist[i])
+        if kind is None:
+            break
+        fld, ford, code = kind
+        ford = ford or "!"
+        if order is None:
+            order = ford
+        elif ford != order:
+            break
+        if isinstance(code, int):
+            # bit field, `code` is its size
+            group.append(fld)
+            bits += code
+            if bits > 64:
+                break
+            if bits in _FIXED_BITS_CODES:
+                shift = bits
+                item = []
+                for gfld in group:
+                    shift -= gfld.size
+                    item.append((gfld, shift, (1 << gfld.size) - 1))
+                items.append(item)
+                fmt += _FIXED_BITS_CODES[bits]
+                group = []
+                bits = 0
+                stop = i + 1
+        else:
+            if group:
+                # bit fields not ending on a supported boundary
+                break
+            items.append(fld)
+            fmt += code
+            stop = i + 1
+    if stop - start < 2:
+        return None
+    return FixedFieldsRun(start, stop, order + fmt, items)
+
+
+def compile_fixed_runs(flist):
+    """Find the runs of consecutive fixed-size fields of `flist`.
+
+    Returns a dict mapping the index of the first field of each run to its
+    FixedFieldsRun. Only fields that do not override the generic
+    getfield()/addfield() are considered, so that a layer dissects and
+    builds the same way with or without the runs.
+    """
+    runs = {}
+    i = 0
+    while i < len(flist):
+        run = _compile_fixed_run(flist, i)
+        if run is None:
+            i += 1
+        else:
+            runs[i] = run
+            i = run.stop
+    return runs
+
+
+def _appends_only(fld):
+    """Returns True if `fld.addfield(pkt, s, val)` only appends to `s` (or
+    to the string of a bit fields tuple) without reading it, so that it can
+    be called with b"" and its output concatenated to the layer"""
+    if isinstance(fld, Emph):
+        fld = fld.fld
+    _u = six.get_unbound_function
+    try:
+        func = _u(fld.__class__.addfield)
+    except AttributeError:
+        return False
+    if func is _u(ConditionalField.addfield):
+        return _appends_only(fld.fld)
+    if func is _u(MultipleTypeField.addfield):
+        return _appends_only(fld.dflt) and \
+            all(_appends_only(f) for f, _ in fld.flds)
+    if func is _u(PadField.addfield):
+        return _appends_only(fld._fld)
+    if func is _u(FieldListField.addfield):
+        return _appends_only(fld.field)
+    return func in _APPENDING_ADDFIELDS
+
+
+def compile_appending_fields(flist):
+    """Find the fields of `flist` whose addfield() only appends to the
+    layer built so far (see _appends_only()).
+
+    Returns a dict mapping their indexes to the fields. Packet.self_build()
+    builds them on their own, and concatenates the whole layer once.
+    """
+    return dict((i, fld) for i, fld in enumerate(flist)
+                if _appends_only(fld))
+
+
 class _EnumField(Field):
     def __init__(self, name, default, enum, fmt="H"):
         """ Initializes enum fields.
@@ -2659,3 +2969,13 @@ class MSBExtendedField(BitExtendedField):
     # This is a BitExtendedField with the extension bit on MSB
     def __init__(self, name, default):
         BitExtendedField.__init__(self, name, default, extension_bit=7)
+
+
+# The addfield() methods that only append to their `s` argument
+_APPENDING_ADDFIELDS = set(
+    six.get_unbound_function(cls.addfield) for cls in [
+        Field, ThreeBytesField, LEThreeBytesField, StrField,
+        PacketListField, StrFixedLenField, StrNullField, BitField,
+        _IPPrefixFieldBase, BitExtendedField, FCSField,
+    ]
+)
@@ -504,6 +504,47 @@ class HTTPResponse(_HTTPContent):
 # General HTTP class + defragmentation
 
 
+def _detect_chunked_end(data, metadata):
+    """Walks the chunks of a chunked HTTP body, from metadata["chunk_pos"].
+    Returns True if the last chunk was received. Otherwise, stores in
+    metadata["tcp_need"] the length of data needed to receive the current
+    chunk, so that it is only walked once.
+    """
+    pos = metadata["chunk_pos"]
+    while True:
+        eol = data.find(b"\r\n", pos)
+        if eol == -1:
+            break
+        try:
+            size = int(data[pos:eol].split(b";", 1)[0], 16)
+        except ValueError:
+            # Not a valid chunk
+            metadata.pop("tcp_need", None)
+            return data.endswith(b"\r\n\r\n")
+        if size == 0:
+            # The last chunk, followed by the (optional) trailers
+            if data.find(b"\r\n\r\n", eol) != -1:
+                return True
+            break
+        end = eol + size + 4
+        if end > len(data):
+            metadata["tcp_need"] = end
+            return False
+        pos = metadata["chunk_pos"] = end
+    metadata["tcp_need"] = len(data) + 1
+    return False
+
+
+def _http_no_body(http_packet):
+    """Tells if an HTTP message without Content-Length nor chunked
+    encoding has no body: requests, and 1xx, 204 and 304 responses
+    (RFC 7230, section 3.3.3)"""
+    if isinstance(http_packet.payload, HTTPRequest):
+        return True
+    status = http_packet.payload.Status_Code or b""
+    return status[:1] == b"1" or status in (b"204", b"304")
+
+
 class HTTP(Packet):
     name = "HTTP 1"
     fields_desc = []
@@ -555,6 +596,8 @@ class HTTP(Packet):
                 if http_packet.payload.payload or length == 0:
                     http_length = len(data) - len(http_packet.payload.payload)
                     detect_end = lambda dat: len(dat) - http_length >= length
+                    # Don't get called again before the end of the content
+                    metadata["tcp_need"] = http_length + length
                 else:
                     # The HTTP layer isn't fully received.
                     detect_end = lambda dat: False
@@ -563,14 +606,28 @@ class HTTP(Packet):
                 # It's not Content-Length based. It could be chunked
                 encodings = http_packet[HTTP].payload._get_encodings()
                 chunked = ("chunked" in encodings)
-                if chunked:
-                    detect_end = lambda dat: dat.endswith(b"\r\n\r\n")
+                http_length = data.find(b"\r\n\r\n") + 4
+                if chunked and http_length > 3:
+                    metadata["chunk_pos"] = http_length
+                    detect_end = lambda dat: _detect_chunked_end(dat,
+                                                                 metadata)
+                elif chunked:
+                    # The HTTP layer isn't fully received.
+                    detect_end = lambda dat: False
+                    metadata["detect_unknown"] = True
+                elif http_length > 3 and _http_no_body(http_packet):
+                    # Neither Content-Length nor chunked is specified,
+                    # and the message has no body
+                    detect_end = lambda dat: True
                 else:
                     # If neither Content-Length nor chunked is specified,
-                    # it means it's the TCP packet that contains the data,
-                    # or that the information hasn't been given yet.
+                    # the body ends with the connection (a TCP FIN or RST),
+                    # or the information hasn't been given yet.
                     detect_end = lambda dat: metadata.get("tcp_end", False)
                     metadata["detect_unknown"] = True
+                    if http_length > 3:
+                        # The headers were received: wait for the end
+                        metadata["tcp_need"] = float("inf")
             metadata["detect_end"] = detect_end
             if detect_end(data):
                 return http_packet
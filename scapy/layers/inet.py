@@ -17,13 +17,14 @@ import select
 import socket
 from collections import defaultdict
 
-from scapy.utils import checksum, do_graph, incremental_label, \
-    linehexdump, strxor, whois, colgen
+from scapy.checksum import checksum
+from scapy.utils import do_graph, incremental_label, linehexdump, strxor, \
+    whois, colgen
 from scapy.base_classes import Gen, Net
 from scapy.data import ETH_P_IP, ETH_P_ALL, DLT_RAW, DLT_RAW_ALT, DLT_IPV4, \
     IP_PROTOS, TCP_SERVICES, UDP_SERVICES
-from scapy.layers.l2 import Ether, Dot3, getmacbyip, CookedLinux, GRE, SNAP, \
-    Loopback
+from scapy.layers.l2 import Ether, Dot3, getmacbyip, getmacsbyip, \
+    CookedLinux, GRE, SNAP, Loopback
 from scapy.compat import raw, chb, orb, bytes_encode
 from scapy.config import conf
 from scapy.extlib import plt, MATPLOTLIB, MATPLOTLIB_INLINED, \
@@ -514,6 +515,18 @@ class IP(Packet, IPTools):
                     struct.pack("B", self.proto) + self.payload.hashret())
         return struct.pack("B", self.proto) + self.payload.hashret()
 
+    def request_keys(self):
+        # ICMP errors quote the IP id of the request
+        return [b"IP" + struct.pack("!H", self.id)] + \
+            self.payload.request_keys()
+
+    def answer_key(self):
+        if ((self.proto == socket.IPPROTO_ICMP) and
+            (isinstance(self.payload, ICMP)) and
+                (isinstance(self.payload.payload, IP))):
+            return b"IP" + struct.pack("!H", self.payload.payload.id)
+        return self.payload.answer_key()
+
     def answers(self, other):
         if not conf.checkIPinIP:  # skip IP in IP and IPv6 in IP
             if self.proto in [4, 41]:
@@ -603,7 +616,7 @@ def in4_chksum(proto, u, p):
                          inet_pton(socket.AF_INET, u.dst),
                          proto,
                          ln)
-    return checksum(psdhdr + p)
+    return checksum(psdhdr, p)
 
 
 class TCP(Packet):
@@ -645,6 +658,19 @@ class TCP(Packet):
         else:
             return self.payload.hashret()
 
+    def request_keys(self):
+        # The sequence number that the answers acknowledge
+        ack = self.seq + (1 if self.flags.S else 0) + \
+            (1 if self.flags.F else 0)
+        if not isinstance(self.payload, NoPayload):
+            ack += len(self.payload)
+        return [b"TCP" + struct.pack("!I", ack & 0xffffffff)]
+
+    def answer_key(self):
+        if self.flags.A:
+            return b"TCP" + struct.pack("!I", self.ack)
+        return b""
+
     def answers(self, other):
         if not isinstance(other, TCP):
             return 0
@@ -722,6 +748,13 @@ class UDP(Packet):
     def hashret(self):
         return self.payload.hashret()
 
+    def request_keys(self):
+        return [b"UDP" + struct.pack("!H", self.sport)] + \
+            self.payload.request_keys()
+
+    def answer_key(self):
+        return b"UDP" + struct.pack("!H", self.dport)
+
     def answers(self, other):
         if not isinstance(other, UDP):
             return 0
@@ -968,8 +1001,14 @@ def inet_register_l3(l2, l3):
     return getmacbyip(l3.dst)
 
 
+def inet_register_l3_bulk(dsts):
+    return getmacsbyip(dsts)
+
+
 conf.neighbor.register_l3(Ether, IP, inet_register_l3)
 conf.neighbor.register_l3(Dot3, IP, inet_register_l3)
+conf.neighbor.register_l3_bulk(Ether, IP, inet_register_l3_bulk)
+conf.neighbor.register_l3_bulk(Dot3, IP, inet_register_l3_bulk)
 
 
 ###################
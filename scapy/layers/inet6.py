@@ -48,12 +48,14 @@ from scapy.fields import BitEnumField, BitField, ByteEnumField, ByteField, \
     X3BytesField, XBitField, XIntField, XShortField
 from scapy.layers.inet import IP, IPTools, TCP, TCPerror, TracerouteResult, \
     UDP, UDPerror
-from scapy.layers.l2 import CookedLinux, Ether, GRE, Loopback, SNAP
+from scapy.layers.l2 import CookedLinux, Ether, GRE, Loopback, SNAP, \
+    _NeighborLookups
 import scapy.modules.six as six
 from scapy.packet import bind_layers, Packet, Raw
-from scapy.sendrecv import sendp, sniff, sr, srp1
+from scapy.sendrecv import sendp, sniff, sr, srp, srp1
 from scapy.supersocket import SuperSocket, L3RawSocket
-from scapy.utils import checksum, strxor
+from scapy.checksum import checksum
+from scapy.utils import strxor
 from scapy.pton_ntop import inet_pton, inet_ntop
 from scapy.utils6 import in6_getnsma, in6_getnsmac, in6_isaddr6to4, \
     in6_isaddrllallnodes, in6_isaddrllallservers, in6_isaddrTeredo, \
@@ -77,7 +79,30 @@ if conf.route6 is None:
 #  Neighbor cache stuff  #
 ##########################
 
-conf.netcache.new_cache("in6_neighbor", 120)
+conf.netcache.new_cache("in6_neighbor", 120, max_size=4096)
+# addresses that did not answer a bulk resolution, not queried again by
+# the next bulk resolutions before 30s
+conf.netcache.new_cache("in6_unresolved", 30, max_size=4096)
+
+_in6_lookups = _NeighborLookups()
+
+
+def _neighsol_pkt(addr, src, iface):
+    """Returns the Neighbor Solicitation message for addr"""
+    nsma = in6_getnsma(inet_pton(socket.AF_INET6, addr))
+    d = inet_ntop(socket.AF_INET6, nsma)
+    dm = in6_getnsmac(nsma)
+    p = Ether(dst=dm) / IPv6(dst=d, src=src, hlim=255)
+    p /= ICMPv6ND_NS(tgt=addr)
+    p /= ICMPv6NDOptSrcLLAddr(lladdr=get_if_hwaddr(iface))
+    return p
+
+
+def _neighsol_mac(res):
+    """Returns the MAC address advertised in a Neighbor Advertisement"""
+    if ICMPv6NDOptDstLLAddr in res:
+        return res[ICMPv6NDOptDstLLAddr].lladdr
+    return res.src
 
 
 @conf.commands.register
@@ -94,61 +119,137 @@ def neighsol(addr, src, iface, timeout=1, chainCC=0):
     returned (ethernet frame).
     """
 
-    nsma = in6_getnsma(inet_pton(socket.AF_INET6, addr))
-    d = inet_ntop(socket.AF_INET6, nsma)
-    dm = in6_getnsmac(nsma)
-    p = Ether(dst=dm) / IPv6(dst=d, src=src, hlim=255)
-    p /= ICMPv6ND_NS(tgt=addr)
-    p /= ICMPv6NDOptSrcLLAddr(lladdr=get_if_hwaddr(iface))
+    p = _neighsol_pkt(addr, src, iface)
     res = srp1(p, type=ETH_P_IPV6, iface=iface, timeout=1, verbose=0,
                chainCC=chainCC)
 
     return res
 
 
-@conf.commands.register
-def getmacbyip6(ip6, chainCC=0):
-    """Returns the MAC address corresponding to an IPv6 address
-
-    neighborCache.get() method is used on instantiated neighbor cache.
-    Resolution mechanism is described in associated doc string.
-
-    (chainCC parameter value ends up being passed to sending function
-     used to perform the resolution, if needed)
-    """
-
+def _in6_target(ip6):
+    """Returns (mac, iface, src, ip6) where mac is the MAC address of ip6
+    when it does not need to be resolved, and ip6 the address to resolve"""
     if isinstance(ip6, Net6):
         ip6 = str(ip6)
 
     if in6_ismaddr(ip6):  # Multicast
         mac = in6_getnsmac(inet_pton(socket.AF_INET6, ip6))
-        return mac
+        return mac, None, None, ip6
 
     iff, a, nh = conf.route6.route(ip6)
 
     if iff == scapy.consts.LOOPBACK_INTERFACE:
-        return "ff:ff:ff:ff:ff:ff"
+        return "ff:ff:ff:ff:ff:ff", iff, a, ip6
 
     if nh != '::':
         ip6 = nh  # Found next hop
+    return None, iff, a, ip6
+
+
+@conf.commands.register
+def getmacbyip6(ip6, chainCC=0):
+    """Returns the MAC address corresponding to an IPv6 address
+
+    neighborCache.get() method is used on instantiated neighbor cache.
+    Resolution mechanism is described in associated doc string.
+
+    (chainCC parameter value ends up being passed to sending function
+     used to perform the resolution, if needed)
+    """
+
+    mac, iff, a, ip6 = _in6_target(ip6)
+    if mac:
+        return mac
 
     mac = conf.netcache.in6_neighbor.get(ip6)
     if mac:
         return mac
 
-    res = neighsol(ip6, a, iff, chainCC=chainCC)
+    mine, events = _in6_lookups.acquire([ip6])
+    if events:
+        # Another thread is resolving this address
+        events[0].wait()
+        return conf.netcache.in6_neighbor.get(ip6)
+    try:
+        res = neighsol(ip6, a, iff, chainCC=chainCC)
+    finally:
+        _in6_lookups.release(mine)
 
     if res is not None:
-        if ICMPv6NDOptDstLLAddr in res:
-            mac = res[ICMPv6NDOptDstLLAddr].lladdr
-        else:
-            mac = res.src
+        mac = _neighsol_mac(res)
         conf.netcache.in6_neighbor[ip6] = mac
         return mac
 
     return None
 
 
+@conf.commands.register
+def getmacsbyip6(ip6s, timeout=1, chainCC=0):
+    """Returns the MAC addresses corresponding to several IPv6 addresses
+
+    The addresses that are not in the neighbor cache are resolved at once:
+    the Neighbor Solicitation messages for all of them are sent before the
+    answers are collected, and the neighbor cache is filled with the
+    answers. The addresses that do not answer are not queried again by
+    getmacsbyip6() for 30s: getmacbyip6() still queries them, e.g. when
+    the packets sent by sendp() or srp() are built.
+
+    :param ip6s: a list of IPv6 addresses, or a Net6
+    :param timeout: how long to wait for the answers, in seconds
+    :returns: a dict {ip6: MAC address or None}
+    """
+    if isinstance(ip6s, six.string_types):
+        ip6s = [ip6s]
+    result = {}
+    targets = {}  # {ip6: address to resolve}
+    to_resolve = {}  # {iface: {address: source address}}
+    for ip6 in ip6s:
+        try:
+            mac, iff, a, target = _in6_target(ip6)
+        except (socket.error, ValueError):
+            warning("getmacsbyip6: invalid address %r" % ip6)
+            continue
+        if mac:
+            result[ip6] = mac
+            continue
+        targets[ip6] = target
+        if target in conf.netcache.in6_neighbor or \
+                target in conf.netcache.in6_unresolved:
+            continue
+        to_resolve.setdefault(iff, {})[target] = a
+    mine, events = _in6_lookups.acquire(
+        [target for addrs in six.itervalues(to_resolve) for target in addrs]
+    )
+    try:
+        for iff, addrs in six.iteritems(to_resolve):
+            pkts = [_neighsol_pkt(target, a, iff)
+                    for target, a in sorted(six.iteritems(addrs))
+                    if target in mine]
+            if not pkts:
+                continue
+            try:
+                ans, _ = srp(pkts, type=ETH_P_IPV6, iface=iff,
+                             timeout=timeout, verbose=0, chainCC=chainCC)
+            except Exception as ex:
+                warning("getmacsbyip6 failed on %s" % ex)
+                continue
+            for snd, rcv in ans:
+                conf.netcache.in6_neighbor[snd[ICMPv6ND_NS].tgt] = \
+                    _neighsol_mac(rcv)
+            for pkt in pkts:
+                target = pkt[ICMPv6ND_NS].tgt
+                if target not in conf.netcache.in6_neighbor:
+                    conf.netcache.in6_unresolved[target] = True
+    finally:
+        _in6_lookups.release(mine)
+    # Wait for the addresses resolved by other threads
+    for event in events:
+        event.wait()
+    for ip6, target in six.iteritems(targets):
+        result[ip6] = conf.netcache.in6_neighbor.get(target)
+    return result
+
+
 #############################################################################
 #############################################################################
 #                                IPv6 Class                                 #
@@ -462,7 +563,12 @@ def inet6_register_l3(l2, l3):
     return getmacbyip6(l3.dst)
 
 
+def inet6_register_l3_bulk(dsts):
+    return getmacsbyip6(dsts)
+
+
 conf.neighbor.register_l3(Ether, IPv6, inet6_register_l3)
+conf.neighbor.register_l3_bulk(Ether, IPv6, inet6_register_l3_bulk)
 
 
 class IPerror6(IPv6):
@@ -616,7 +722,7 @@ def in6_chksum(nh, u, p):
         ph6.dst = u.dst
     ph6.uplen = len(p)
     ph6s = raw(ph6)
-    return checksum(ph6s + p)
+    return checksum(ph6s, p)
 
 
 #############################################################################
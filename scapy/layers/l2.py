@@ -9,14 +9,16 @@ Classes and functions for layer 2 protocols.
 
 from __future__ import absolute_import
 from __future__ import print_function
+import itertools
 import os
 import struct
+import threading
 import time
 import socket
 
 from scapy.ansmachine import AnsweringMachine
 from scapy.arch import get_if_addr, get_if_hwaddr
-from scapy.base_classes import Gen, Net
+from scapy.base_classes import Gen, Net, SetGen
 from scapy.compat import chb, orb
 from scapy.config import conf
 from scapy import consts
@@ -32,6 +34,7 @@ from scapy.fields import BCDFloatField, BitField, ByteField, \
     ShortEnumField, ShortField, SourceIP6Field, SourceIPField, \
     StrFixedLenField, StrLenField, X3BytesField, XByteField, XIntField, \
     XShortEnumField, XShortField
+from scapy.modules import six
 from scapy.modules.six import viewitems
 from scapy.packet import bind_layers, Packet
 from scapy.plist import PacketList, SndRcvList
@@ -51,43 +54,144 @@ if conf.route is None:
 class Neighbor:
     def __init__(self):
         self.resolvers = {}
+        self.bulk_resolvers = {}
+        # maximum number of destinations resolved at once by resolve_all()
+        self.max_bulk = 1024
 
     def register_l3(self, l2, l3, resolve_method):
         self.resolvers[l2, l3] = resolve_method
 
+    def register_l3_bulk(self, l2, l3, resolve_method):
+        """Registers a method resolving at once the destinations of l3
+        layers over l2 layers, e.g. before sending packets.
+
+        resolve_method is called with the set of the destination
+        addresses (dst field) of the l3 layers, and must fill the neighbor
+        cache used by the method registered with register_l3().
+        """
+        self.bulk_resolvers[l2, l3] = resolve_method
+
     def resolve(self, l2inst, l3inst):
         k = l2inst.__class__, l3inst.__class__
         if k in self.resolvers:
             return self.resolvers[k](l2inst, l3inst)
 
+    def resolve_all(self, pkts):
+        """Resolves at once the destinations of the packets whose l2
+        destination is not set, so that building them later does not
+        resolve them one by one.
+
+        When the packets have more than `max_bulk` destinations of a
+        kind, none of them is resolved here: they are resolved one by one
+        as the packets are built, without expanding them all beforehand.
+
+        :param pkts: a packet (possibly generating several packets) or a
+            list of packets
+        """
+        if isinstance(pkts, Packet):
+            pkts = [pkts]
+        targets = {}
+        too_many = set()
+        for pkt in pkts:
+            if not isinstance(pkt, Packet):
+                continue
+            k = pkt.__class__, pkt.payload.__class__
+            if k not in self.bulk_resolvers or k in too_many or \
+                    pkt.getfieldval("dst") is not None:
+                continue
+            # Only the destinations are expanded, not the whole packets,
+            # and no more than needed to know that there are too many
+            dsts = targets.setdefault(k, set())
+            dst = pkt.payload.getfieldval("dst")
+            if isinstance(dst, (Gen, list)):
+                dsts.update(itertools.islice(SetGen(dst),
+                                             self.max_bulk + 1))
+            elif dst is not None:
+                dsts.add(dst)
+            if len(dsts) > self.max_bulk:
+                too_many.add(k)
+                del targets[k]
+        for k, dsts in six.iteritems(targets):
+            self.bulk_resolvers[k](dsts)
+
     def __repr__(self):
         return "\n".join("%-15s -> %-15s" % (l2.__name__, l3.__name__) for l2, l3 in self.resolvers)  # noqa: E501
 
 
 conf.neighbor = Neighbor()
 
-conf.netcache.new_cache("arp_cache", 120)  # cache entries expire after 120s
+# cache entries expire after 120s, at most 4096 entries are kept
+conf.netcache.new_cache("arp_cache", 120, max_size=4096)
+# addresses that did not answer a bulk resolution, not queried again by
+# the next bulk resolutions before 30s
+conf.netcache.new_cache("arp_unresolved", 30, max_size=4096)
 
 
-@conf.commands.register
-def getmacbyip(ip, chainCC=0):
-    """Return MAC address corresponding to a given IP address"""
+class _NeighborLookups(object):
+    """Tracks the addresses being resolved, so that the threads looking up
+    an address already being resolved wait for the answer instead of
+    sending their own request. Do not use directly."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = {}
+
+    def acquire(self, addrs):
+        """Returns the addresses that the caller must resolve, and the
+        events of the lookups in progress of the other ones"""
+        mine, events = [], []
+        with self.lock:
+            for addr in addrs:
+                if addr in self.pending:
+                    events.append(self.pending[addr])
+                else:
+                    self.pending[addr] = threading.Event()
+                    mine.append(addr)
+        return mine, events
+
+    def release(self, addrs):
+        with self.lock:
+            for addr in addrs:
+                self.pending.pop(addr).set()
+
+
+_arp_lookups = _NeighborLookups()
+
+
+def _arp_target(ip):
+    """Returns (mac, iface, ip) where mac is the MAC address of ip when it
+    does not need to be resolved, and ip the address to resolve"""
     if isinstance(ip, Net):
         ip = next(iter(ip))
     ip = inet_ntoa(inet_aton(ip or "0.0.0.0"))
     tmp = [orb(e) for e in inet_aton(ip)]
     if (tmp[0] & 0xf0) == 0xe0:  # mcast @
-        return "01:00:5e:%.2x:%.2x:%.2x" % (tmp[1] & 0x7f, tmp[2], tmp[3])
+        mac = "01:00:5e:%.2x:%.2x:%.2x" % (tmp[1] & 0x7f, tmp[2], tmp[3])
+        return mac, None, ip
     iff, _, gw = conf.route.route(ip)
     if ((iff == consts.LOOPBACK_INTERFACE) or (ip == conf.route.get_if_bcast(iff))):  # noqa: E501
-        return "ff:ff:ff:ff:ff:ff"
+        return "ff:ff:ff:ff:ff:ff", iff, ip
     if gw != "0.0.0.0":
         ip = gw
+    return None, iff, ip
+
+
+@conf.commands.register
+def getmacbyip(ip, chainCC=0):
+    """Return MAC address corresponding to a given IP address"""
+    mac, iff, ip = _arp_target(ip)
+    if mac:
+        return mac
 
     mac = conf.netcache.arp_cache.get(ip)
     if mac:
         return mac
 
+    mine, events = _arp_lookups.acquire([ip])
+    if events:
+        # Another thread is resolving this address
+        events[0].wait()
+        return conf.netcache.arp_cache.get(ip)
     try:
         res = srp1(Ether(dst=ETHER_BROADCAST) / ARP(op="who-has", pdst=ip),
                    type=ETH_P_ARP,
@@ -99,6 +203,8 @@ def getmacbyip(ip, chainCC=0):
     except Exception as ex:
         warning("getmacbyip failed on %s" % ex)
         return None
+    finally:
+        _arp_lookups.release(mine)
     if res is not None:
         mac = res.payload.hwsrc
         conf.netcache.arp_cache[ip] = mac
@@ -106,6 +212,75 @@ def getmacbyip(ip, chainCC=0):
     return None
 
 
+@conf.commands.register
+def getmacsbyip(ips, timeout=2, chainCC=0):
+    """Return the MAC addresses corresponding to several IP addresses
+
+    The addresses that are not in the ARP cache are resolved at once: the
+    ARP requests for all of them are sent before the answers are
+    collected, and the ARP cache is filled with the answers. The
+    addresses that do not answer are not queried again by getmacsbyip()
+    for 30s: getmacbyip() still queries them, e.g. when the packets sent
+    by sendp() or srp() are built.
+
+    :param ips: a list of IP addresses, or a Net
+    :param timeout: how long to wait for the answers, in seconds
+    :returns: a dict {ip: MAC address or None}
+    """
+    if isinstance(ips, six.string_types):
+        ips = [ips]
+    result = {}
+    targets = {}  # {ip: address to resolve}
+    to_resolve = {}  # {iface: [addresses]}
+    for ip in ips:
+        try:
+            mac, iff, target = _arp_target(ip)
+        except (socket.error, ValueError):
+            warning("getmacsbyip: invalid address %r" % ip)
+            continue
+        if mac:
+            result[ip] = mac
+            continue
+        targets[ip] = target
+        if target in conf.netcache.arp_cache or \
+                target in conf.netcache.arp_unresolved:
+            continue
+        to_resolve.setdefault(iff, set()).add(target)
+    mine, events = _arp_lookups.acquire(
+        [target for addrs in six.itervalues(to_resolve) for target in addrs]
+    )
+    try:
+        for iff, addrs in six.iteritems(to_resolve):
+            addrs = sorted(addrs.intersection(mine))
+            if not addrs:
+                continue
+            try:
+                ans, _ = srp(Ether(dst=ETHER_BROADCAST) /
+                             ARP(op="who-has", pdst=addrs),
+                             type=ETH_P_ARP,
+                             iface=iff,
+                             timeout=timeout,
+                             verbose=0,
+                             chainCC=chainCC,
+                             nofilter=1)
+            except Exception as ex:
+                warning("getmacsbyip failed on %s" % ex)
+                continue
+            for snd, rcv in ans:
+                conf.netcache.arp_cache[snd.payload.pdst] = rcv.payload.hwsrc
+            for target in addrs:
+                if target not in conf.netcache.arp_cache:
+                    conf.netcache.arp_unresolved[target] = True
+    finally:
+        _arp_lookups.release(mine)
+    # Wait for the addresses resolved by other threads
+    for event in events:
+        event.wait()
+    for ip, target in six.iteritems(targets):
+        result[ip] = conf.netcache.arp_cache.get(target)
+    return result
+
+
 # Fields
 
 class DestMACField(MACField):
@@ -397,6 +572,12 @@ class ARP(Packet):
         return struct.pack(">HHH", self.hwtype, self.ptype,
                            ((self.op + 1) // 2)) + self.payload.hashret()
 
+    def request_keys(self):
+        return [self.get_field('pdst').i2m(self, self.pdst)]
+
+    def answer_key(self):
+        return self.get_field('psrc').i2m(self, self.psrc)
+
     def answers(self, other):
         if not isinstance(other, ARP):
             return False
@@ -10,22 +10,26 @@ Provides:
  - the default Packet classes
  - binding mechanisms
  - fuzz() method
+ - packet templates
  - exploration methods: explore() / ls()
 """
 
 from __future__ import absolute_import
 from __future__ import print_function
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 import re
 import time
 import itertools
 import copy
+import struct
 import types
 import warnings
 
 from scapy.fields import StrField, ConditionalField, Emph, PacketListField, \
-    BitField, MultiEnumField, EnumField, FlagsField, MultipleTypeField
+    BitField, MultiEnumField, EnumField, FlagsField, MultipleTypeField, \
+    offset_dissect_capable
 from scapy.config import conf, _version_checker
+from scapy.checksum import checksum_update
 from scapy.compat import raw, orb, bytes_encode
 from scapy.base_classes import BasePacket, Gen, SetGen, Packet_metaclass, \
     _CanvasDumpExtended
@@ -66,7 +70,11 @@ class Packet(six.with_metaclass(Packet_metaclass, BasePacket,
         "original", "explicit", "raw_packet_cache",
         "raw_packet_cache_fields", "_pkt", "post_transforms",
         # then payload and underlayer
-        "payload", "underlayer",
+        "_payload", "underlayer",
+        # used by haslayer() and getlayer()
+        "_layer_lookups", "_layer_index", "_indexed",
+        # used for lazy dissection
+        "_lazy_payload",
         "name",
         # used for sr()
         "_answered",
@@ -88,6 +96,7 @@ class Packet(six.with_metaclass(Packet_metaclass, BasePacket,
     class_default_fields = dict()
     class_default_fields_ref = dict()
     class_fieldtype = dict()
+    class_offset_dissect = dict()
 
     @classmethod
     def from_hexcap(cls):
@@ -105,12 +114,15 @@ class Packet(six.with_metaclass(Packet_metaclass, BasePacket,
 
     def _unpickle(self, dlist):
         """Used to unpack pickling"""
-        self.__init__(b"".join(dlist))
+        self.__init__(dlist[0])
+        if len(dlist) > 1:
+            self.time, self.sent_time, self.wirelen = dlist[1:]
         return self
 
     def __reduce__(self):
         """Used by pickling methods"""
-        return (self.__class__, (), (self.build(),))
+        return (self.__class__, (), (self.build(), self.time, self.sent_time,
+                                     self.wirelen))
 
     def __reduce_ex__(self, proto):
         """Used by pickling methods"""
@@ -128,7 +140,7 @@ class Packet(six.with_metaclass(Packet_metaclass, BasePacket,
         """Used by copy.deepcopy"""
         return self.copy()
 
-    def __init__(self, _pkt=b"", post_transform=None, _internal=0, _underlayer=None, **fields):  # noqa: E501
+    def __init__(self, _pkt=b"", post_transform=None, _internal=0, _underlayer=None, _lazy=None, **fields):  # noqa: E501
         self.time = time.time()
         self.sent_time = None
         self.name = (self.__class__.__name__
@@ -140,9 +152,21 @@ class Packet(six.with_metaclass(Packet_metaclass, BasePacket,
         self.fields = {}
         self.fieldtype = {}
         self.packetfields = []
+        self._lazy_payload = None
+        self._layer_lookups = _LayerIndex.min_lookups
+        self._layer_index = None
+        self._indexed = False
         self.payload = NoPayload()
         self.init_fields()
         self.underlayer = _underlayer
+        if _lazy is None:
+            # Upper layers inherit the dissection mode of their underlayer
+            _lazy = conf.lazy_dissection or (
+                _underlayer is not None and
+                _underlayer._lazy_payload is not None
+            )
+        if _lazy:
+            self._lazy_payload = []
         self.original = _pkt
         self.explicit = 0
         self.raw_packet_cache = None
@@ -270,10 +294,28 @@ class Packet(six.with_metaclass(Packet_metaclass, BasePacket,
         # Last to avoid racing issues
         Packet.class_default_fields[cls_name] = class_default_fields
 
+    @property
+    def payload(self):
+        if self._lazy_payload:
+            self.do_dissect_lazy_payload()
+        return self._payload
+
+    @payload.setter
+    def payload(self, value):
+        if self._lazy_payload:
+            self._lazy_payload = []
+        self._payload = value
+        if self._indexed:
+            _LayerIndex.generation += 1
+
     def dissection_done(self, pkt):
         """DEV: will be called after a dissection is completed"""
         self.post_dissection(pkt)
-        self.payload.dissection_done(pkt)
+        if self._lazy_payload:
+            # Will be called once the payload is dissected
+            self._lazy_payload[2] = pkt
+        else:
+            self._payload.dissection_done(pkt)
 
     def post_dissection(self, pkt):
         """DEV: is called after the dissection of the whole packet"""
@@ -326,8 +368,14 @@ class Packet(six.with_metaclass(Packet_metaclass, BasePacket,
         )
         clone.wirelen = self.wirelen
         clone.post_transforms = self.post_transforms[:]
-        clone.payload = self.payload.copy()
-        clone.payload.add_underlayer(clone)
+        if self._lazy_payload:
+            payl, pads, dissected = self._lazy_payload
+            clone._lazy_payload = [payl, pads[:], dissected]
+        else:
+            clone.payload = self.payload.copy()
+            clone.payload.add_underlayer(clone)
+            if self._lazy_payload is not None:
+                clone._lazy_payload = []
         clone.time = self.time
         return clone
 
@@ -391,7 +439,7 @@ class Packet(six.with_metaclass(Packet_metaclass, BasePacket,
             self.payload.setfieldval(attr, val)
 
     def __setattr__(self, attr, val):
-        if attr in self.__all_slots__:
+        if attr in self.__all_slots__ or attr == "payload":
             if attr == "sent_time":
                 self.update_sent_time(val)
             return object.__setattr__(self, attr, val)
@@ -563,17 +611,49 @@ class Packet(six.with_metaclass(Packet_metaclass, BasePacket,
                     break
             if self.raw_packet_cache is not None:
                 return self.raw_packet_cache
+        # The layer is built as a list of chunks, joined once. `p` is what
+        # is passed to addfield(): b"", or the state of unfinished bit
+        # fields. Only the fields that read it get the layer built so far.
+        chunks = []
         p = b""
-        for f in self.fields_desc:
+        flist = self.fields_desc
+        if len(flist) != self._fixed_runs_size:
+            # fields_desc was changed in place
+            self.__class__._compile_fixed_runs()
+        fixed_runs = self._fixed_runs
+        appending = self._appending_fields
+        i = 0
+        while i < len(flist):
+            run = fixed_runs.get(i)
+            if run is not None and not isinstance(p, tuple):
+                vals = [self.getfieldval(f.name) for f in flist[i:run.stop]]
+                if not any(isinstance(val, RawVal) for val in vals):
+                    chunks.append(run.build(self, vals))
+                    i = run.stop
+                    continue
+            f = flist[i]
             val = self.getfieldval(f.name)
             if isinstance(val, RawVal):
                 sval = raw(val)
-                p += sval
+                chunks.append(sval)
                 if field_pos_list is not None:
-                    field_pos_list.append((f.name, sval.encode("string_escape"), len(p), len(sval)))  # noqa: E501
+                    field_pos_list.append((f.name, sval.encode("string_escape"), len(b"".join(chunks)), len(sval)))  # noqa: E501
             else:
+                if appending.get(i) is not f:
+                    prev = b"".join(chunks)
+                    chunks = []
+                    if isinstance(p, tuple):
+                        p = (prev + p[0],) + p[1:]
+                    else:
+                        p = prev
                 p = f.addfield(self, p, val)
-        return p
+                if not isinstance(p, tuple):
+                    chunks.append(p)
+                    p = b""
+            i += 1
+        if isinstance(p, tuple):
+            return (b"".join(chunks) + p[0],) + p[1:]
+        return b"".join(chunks)
 
     def do_build_payload(self):
         """
@@ -581,6 +661,8 @@ class Packet(six.with_metaclass(Packet_metaclass, BasePacket,
 
         :return: a string of payload layer
         """
+        if self._lazy_payload:
+            return self._lazy_payload[0]
         return self.payload.do_build()
 
     def do_build(self):
@@ -589,18 +671,37 @@ class Packet(six.with_metaclass(Packet_metaclass, BasePacket,
 
         :return: a string of the packet with the payload
         """
+        return b"".join(self._do_build_chunks())
+
+    def _do_build_chunks(self):
+        """
+        Build the layer and its payload as a list of strings. They are
+        only concatenated by the layers that override post_build(), the
+        other layers pass the chunks of their payload along.
+
+        :return: a list of strings
+        """
         if not self.explicit:
             self = next(iter(self))
         pkt = self.self_build()
         for t in self.post_transforms:
             pkt = t(pkt)
-        pay = self.do_build_payload()
-        if self.raw_packet_cache is None:
-            return self.post_build(pkt, pay)
+        if self._lazy_payload or \
+           _get_function(self.do_build_payload) is not _do_build_payload:
+            pay = [self.do_build_payload()]
+        elif _get_function(self.payload.do_build) is _do_build:
+            pay = self.payload._do_build_chunks()
         else:
-            return pkt + pay
+            pay = [self.payload.do_build()]
+        if self.raw_packet_cache is None and \
+           _get_function(self.post_build) is not _post_build:
+            return [self.post_build(pkt, b"".join(pay))]
+        pay.insert(0, pkt)
+        return pay
 
     def build_padding(self):
+        if self._lazy_payload:
+            return b"".join(self._lazy_payload[1])
         return self.payload.build_padding()
 
     def build(self):
@@ -625,6 +726,8 @@ class Packet(six.with_metaclass(Packet_metaclass, BasePacket,
         return pkt + pay
 
     def build_done(self, p):
+        if self._lazy_payload:
+            return p
         return self.payload.build_done(p)
 
     def do_build_ps(self):
@@ -825,11 +928,28 @@ class Packet(six.with_metaclass(Packet_metaclass, BasePacket,
         return s
 
     def do_dissect(self, s):
+        if conf.zero_copy_dissection and isinstance(s, (bytes, bytearray)):
+            return self.do_dissect_offsets(s)
         _raw = s
         self.raw_packet_cache_fields = {}
-        for f in self.fields_desc:
+        flist = self.fields_desc
+        if len(flist) != self._fixed_runs_size:
+            # fields_desc was changed in place
+            self.__class__._compile_fixed_runs()
+        fixed_runs = self._fixed_runs
+        i = 0
+        while i < len(flist):
             if not s:
                 break
+            run = fixed_runs.get(i)
+            if run is not None and not isinstance(s, tuple) and \
+               len(s) >= run.sz:
+                run.dissect(self, s)
+                s = s[run.sz:]
+                i = run.stop
+                continue
+            f = flist[i]
+            i += 1
             s, fval = f.getfield(self, s)
             # We need to track fields with mutable values to discard
             # .raw_packet_cache when needed.
@@ -840,6 +960,69 @@ class Packet(six.with_metaclass(Packet_metaclass, BasePacket,
         self.explicit = 1
         return s
 
+    def do_dissect_offsets(self, s):
+        """
+        Zero-copy version of do_dissect(), used when
+        conf.zero_copy_dissection is set.
+
+        The fields are read from a memoryview of the layer, at increasing
+        offsets, instead of slicing the remaining string after each field.
+        Fields that do not implement getfield_at() are dissected through
+        getfield() on a copy of the remaining bytes.
+
+        :param str s: the raw layer
+        :return: the remaining bytes, after the fields of the layer
+        """
+        _raw = s
+        self.raw_packet_cache_fields = {}
+        flist = self.fields_desc
+        if len(flist) != self._fixed_runs_size:
+            # fields_desc was changed in place
+            self.__class__._compile_fixed_runs()
+        capable = self.class_offset_dissect.get(self.__class__)
+        if capable is None:
+            capable = [offset_dissect_capable(f) for f in flist]
+            Packet.class_offset_dissect[self.__class__] = capable
+        buf = memoryview(s)
+        off = 0
+        fixed_runs = self._fixed_runs
+        i = 0
+        while i < len(flist):
+            if off == len(buf):
+                break
+            run = fixed_runs.get(i)
+            if run is not None and not isinstance(off, tuple) and \
+               len(buf) - off >= run.sz:
+                run.dissect(self, buf, off)
+                off += run.sz
+                i = run.stop
+                continue
+            f, zero_copy = flist[i], capable[i]
+            i += 1
+            if zero_copy:
+                off, fval = f.getfield_at(self, buf, off)
+            else:
+                if isinstance(off, tuple):
+                    s = (buf[off[0]:].tobytes(),) + off[1:]
+                else:
+                    s = buf[off:].tobytes()
+                s, fval = f.getfield(self, s)
+                if isinstance(s, tuple):
+                    buf, off = memoryview(s[0]), (0,) + s[1:]
+                else:
+                    buf, off = memoryview(s), 0
+            # We need to track fields with mutable values to discard
+            # .raw_packet_cache when needed.
+            if f.islist or f.holds_packets or f.ismutable:
+                self.raw_packet_cache_fields[f.name] = f.do_copy(fval)
+            self.fields[f.name] = fval
+        if isinstance(off, tuple):
+            off = off[0]
+        s = buf[off:].tobytes()
+        self.raw_packet_cache = _raw[:-len(s)] if s else _raw
+        self.explicit = 1
+        return s
+
     def do_dissect_payload(self, s):
         """
         Perform the dissection of the layer's payload
@@ -871,10 +1054,38 @@ class Packet(six.with_metaclass(Packet_metaclass, BasePacket,
         s = self.post_dissect(s)
 
         payl, pad = self.extract_padding(s)
+        if self._lazy_payload is not None:
+            # Lazy dissection: keep the payload (and padding) until needed
+            pads = [pad] if pad and conf.padding else []
+            if payl or pads:
+                self._lazy_payload = [payl, pads, None]
+            return
         self.do_dissect_payload(payl)
         if pad and conf.padding:
             self.add_payload(conf.padding_layer(pad))
 
+    def do_dissect_lazy_payload(self):
+        """
+        Perform the dissection of the payload kept by a lazily dissected
+        layer. Called on the first access to the payload.
+        """
+        payl, pads, dissected = self._lazy_payload
+        self._lazy_payload = []
+        self.do_dissect_payload(payl)
+        pay = self._payload
+        if pads and pay._lazy_payload is not None:
+            # Keep the padding at the end of the packet, without forcing
+            # the dissection of the upper layers
+            if pay._lazy_payload:
+                pay._lazy_payload[1].extend(pads)
+            else:
+                pay._lazy_payload = [b"", pads, None]
+        else:
+            for pad in pads:
+                self.add_payload(conf.padding_layer(pad))
+        if dissected is not None:
+            self._payload.dissection_done(dissected)
+
     def guess_payload_class(self, payload):
         """
         DEV: Guesses the next payload class from layer bonds.
@@ -1068,26 +1279,41 @@ class Packet(six.with_metaclass(Packet_metaclass, BasePacket,
         and its answer."""
         return self.payload.hashret()
 
+    def request_keys(self):
+        """DEV: returns a list of strings, one of which is likely to be the
+        answer_key() of the answers to this request. They tell apart the
+        requests that have the same hashret()."""
+        return self.payload.request_keys()
+
+    def answer_key(self):
+        """DEV: returns a string that is likely to be one of the
+        request_keys() of the request this packet answers, or b"" """
+        return self.payload.answer_key()
+
     def answers(self, other):
         """DEV: true if self is an answer from other"""
         if other.__class__ == self.__class__:
             return self.payload.answers(other.payload)
         return 0
 
-    def layers(self):
-        """returns a list of layer classes (including subclasses) in this packet"""  # noqa: E501
-        layers = []
-        lyr = self
-        while lyr:
-            layers.append(lyr.__class__)
-            lyr = lyr.payload.getlayer(0, _subclass=True)
-        return layers
+    def _get_layer_index(self):
+        """DEV: returns the index of the layers of this packet, or None
+        for its first _LayerIndex.min_lookups lookups, which walk the
+        layers instead: the index only pays off when a packet is looked
+        up several times. It is dropped when the payload of one of the
+        indexed layers changes. Do not use directly.
+        """
+        lookups = self._layer_lookups
+        if lookups:
+            self._layer_lookups = lookups - 1
+            return None
+        index = self._layer_index
+        if index is None or not index.is_valid():
+            index = self._layer_index = _LayerIndex(self)
+        return index
 
-    def haslayer(self, cls):
-        """true if self has a layer that is an instance of cls. Superseded by "cls in self" syntax."""  # noqa: E501
-        if self.__class__ == cls or cls in [self.__class__.__name__,
-                                            self._name]:
-            return True
+    def _packetfields_layers(self):
+        """DEV: yields the packets held by the fields of this layer"""
         for f in self.packetfields:
             fvalue_gen = self.getfieldval(f.name)
             if fvalue_gen is None:
@@ -1096,10 +1322,46 @@ class Packet(six.with_metaclass(Packet_metaclass, BasePacket,
                 fvalue_gen = SetGen(fvalue_gen, _iterpacket=0)
             for fvalue in fvalue_gen:
                 if isinstance(fvalue, Packet):
+                    yield fvalue
+
+    def layers(self):
+        """returns a list of layer classes (including subclasses) in this packet"""  # noqa: E501
+        index = self._get_layer_index()
+        if index is not None:
+            return index.get_layers()
+        layers = []
+        lyr = self
+        while True:
+            layers.append(lyr.__class__)
+            lyr = lyr.payload
+            if _LayerIndex.overrides(lyr):
+                layers.extend(lyr.layers())
+                return layers
+
+    def haslayer(self, cls):
+        """true if self has a layer that is an instance of cls. Superseded by "cls in self" syntax."""  # noqa: E501
+        # _get_layer_index(), inlined for the first lookups
+        lookups = self._layer_lookups
+        if not lookups:
+            return self._get_layer_index().haslayer(cls)
+        self._layer_lookups = lookups - 1
+        overrides = _LayerIndex.class_overrides
+        lyr = self
+        while True:
+            if lyr.__class__ == cls or cls in [lyr.__class__.__name__,
+                                               lyr._name]:
+                return True
+            if lyr.packetfields:
+                for fvalue in lyr._packetfields_layers():
                     ret = fvalue.haslayer(cls)
                     if ret:
                         return ret
-        return self.payload.haslayer(cls)
+            lyr = lyr.payload if lyr._lazy_payload else lyr._payload
+            tail = overrides.get(lyr.__class__)
+            if tail is None:
+                tail = _LayerIndex.overrides(lyr)
+            if tail:
+                return lyr.haslayer(cls)
 
     def getlayer(self, cls, nb=1, _track=None, _subclass=None, **flt):
         """Return the nb^th layer that is an instance of cls, matching flt
@@ -1107,10 +1369,6 @@ values.
         """
         if _subclass is None:
             _subclass = self.match_subclass or None
-        if _subclass:
-            match = lambda cls1, cls2: issubclass(cls1, cls2)
-        else:
-            match = lambda cls1, cls2: cls1 == cls2
         if isinstance(cls, int):
             nb = cls + 1
             cls = None
@@ -1118,33 +1376,45 @@ values.
             ccls, fld = cls.split(".", 1)
         else:
             ccls, fld = cls, None
-        if cls is None or match(self.__class__, cls) \
-           or ccls in [self.__class__.__name__, self._name]:
-            if all(self.getfieldval(fldname) == fldvalue
-                   for fldname, fldvalue in six.iteritems(flt)):
-                if nb == 1:
-                    if fld is None:
-                        return self
+        # _get_layer_index(), inlined for the first lookups
+        lookups = self._layer_lookups
+        if not lookups:
+            return self._get_layer_index().getlayer(cls, ccls, fld, nb,
+                                                    _track, _subclass, flt)
+        self._layer_lookups = lookups - 1
+        is_class = isinstance(ccls, Packet_metaclass)
+        overrides = _LayerIndex.class_overrides
+        lyr = self
+        while True:
+            if _subclass is None:
+                _subclass = lyr.match_subclass or None
+            if cls is None or ccls in [lyr.__class__.__name__, lyr._name] \
+               or (is_class and (issubclass(lyr.__class__, ccls)
+                                 if _subclass else lyr.__class__ == ccls)):
+                if all(lyr.getfieldval(fldname) == fldvalue
+                       for fldname, fldvalue in six.iteritems(flt)):
+                    if nb == 1:
+                        if fld is None:
+                            return lyr
+                        else:
+                            return lyr.getfieldval(fld)
                     else:
-                        return self.getfieldval(fld)
-                else:
-                    nb -= 1
-        for f in self.packetfields:
-            fvalue_gen = self.getfieldval(f.name)
-            if fvalue_gen is None:
-                continue
-            if not f.islist:
-                fvalue_gen = SetGen(fvalue_gen, _iterpacket=0)
-            for fvalue in fvalue_gen:
-                if isinstance(fvalue, Packet):
+                        nb -= 1
+            if lyr.packetfields:
+                for fvalue in lyr._packetfields_layers():
                     track = []
                     ret = fvalue.getlayer(cls, nb=nb, _track=track,
                                           _subclass=_subclass, **flt)
                     if ret is not None:
                         return ret
                     nb = track[0]
-        return self.payload.getlayer(cls, nb=nb, _track=_track,
-                                     _subclass=_subclass, **flt)
+            lyr = lyr.payload if lyr._lazy_payload else lyr._payload
+            tail = overrides.get(lyr.__class__)
+            if tail is None:
+                tail = _LayerIndex.overrides(lyr)
+            if tail:
+                return lyr.getlayer(cls, nb=nb, _track=_track,
+                                    _subclass=_subclass, **flt)
 
     def firstlayer(self):
         q = self
@@ -1305,87 +1575,85 @@ values.
 
           A side effect is that, to obtain "{" and "}" characters, you must use
           "%(" and "%)".
-        """
 
-        escape = {"%": "%",
-                  "(": "{",
-                  ")": "}"}
-
-        # Evaluate conditions
-        while "{" in fmt:
-            i = fmt.rindex("{")
-            j = fmt[i + 1:].index("}")
-            cond = fmt[i + 1:i + j + 1]
-            k = cond.find(":")
-            if k < 0:
-                raise Scapy_Exception("Bad condition in format string: [%s] (read sprintf doc!)" % cond)  # noqa: E501
-            cond, format_ = cond[:k], cond[k + 1:]
-            res = False
-            if cond[0] == "!":
-                res = True
-                cond = cond[1:]
-            if self.haslayer(cond):
-                res = not res
-            if not res:
-                format_ = ""
-            fmt = fmt[:i] + format_ + fmt[i + j + 2:]
+        The format strings are parsed once, and the results are kept in a
+        cache of ``conf.sprintf_cache_size`` entries.
+        """
 
+        if "{" in fmt:
+            # Evaluate conditions
+            fmt = self._sprintf_conditions(_get_sprintf_plan(fmt))
         # Evaluate directives
-        s = ""
-        while "%" in fmt:
-            i = fmt.index("%")
-            s += fmt[:i]
-            fmt = fmt[i + 1:]
-            if fmt and fmt[0] in escape:
-                s += escape[fmt[0]]
-                fmt = fmt[1:]
+        s = []
+        for item in _get_sprintf_plan(fmt):
+            if not isinstance(item, tuple):
+                s.append(item)
                 continue
-            try:
-                i = fmt.index("%")
-                sfclsfld = fmt[:i]
-                fclsfld = sfclsfld.split(",")
-                if len(fclsfld) == 1:
-                    f = "s"
-                    clsfld = fclsfld[0]
-                elif len(fclsfld) == 2:
-                    f, clsfld = fclsfld
-                else:
-                    raise Scapy_Exception
-                if "." in clsfld:
-                    cls, fld = clsfld.split(".")
-                else:
-                    cls = self.__class__.__name__
-                    fld = clsfld
-                num = 1
-                if ":" in cls:
-                    cls, num = cls.split(":")
-                    num = int(num)
-                fmt = fmt[i + 1:]
-            except Exception:
-                raise Scapy_Exception("Bad format string [%%%s%s]" % (fmt[:25], fmt[25:] and "..."))  # noqa: E501
+            f, raw_f, cls, num, fld, sfclsfld = item
+            if fld == "time":
+                val = time.strftime("%H:%M:%S.%%06i", time.localtime(self.time)) % int((self.time - int(self.time)) * 1000000)  # noqa: E501
+                s.append(("%" + f) % val)
+                continue
+            lyr = self._sprintf_layer(cls, num, fld)
+            if lyr is None:
+                if not relax:
+                    raise Scapy_Exception("Format not found [%%%s%%]" %
+                                          sfclsfld)
+                s.append("??")
+            elif raw_f is not None:  # Raw field value
+                s.append(("%" + raw_f) % getattr(lyr, fld))
             else:
-                if fld == "time":
-                    val = time.strftime("%H:%M:%S.%%06i", time.localtime(self.time)) % int((self.time - int(self.time)) * 1000000)  # noqa: E501
-                elif cls == self.__class__.__name__ and hasattr(self, fld):
-                    if num > 1:
-                        val = self.payload.sprintf("%%%s,%s:%s.%s%%" % (f, cls, num - 1, fld), relax)  # noqa: E501
-                        f = "s"
-                    elif f[-1] == "r":  # Raw field value
-                        val = getattr(self, fld)
-                        f = f[:-1]
-                        if not f:
-                            f = "s"
-                    else:
-                        val = getattr(self, fld)
-                        if fld in self.fieldtype:
-                            val = self.fieldtype[fld].i2repr(self, val)
-                else:
-                    val = self.payload.sprintf("%%%s%%" % sfclsfld, relax)
-                    f = "s"
-                s += ("%" + f) % val
-
-        s += fmt
-        return s
+                val = getattr(lyr, fld)
+                if fld in lyr.fieldtype:
+                    val = lyr.fieldtype[fld].i2repr(lyr, val)
+                s.append(("%" + f) % val)
+        return "".join(s)
+
+    def _sprintf_conditions(self, tree):
+        """DEV: returns the format string selected by the conditions of a
+        tree returned by _compile_sprintf_conditions()"""
+        s = []
+        for item in tree:
+            if not isinstance(item, tuple):
+                s.append(item)
+            else:
+                cond, negated, subtree = item
+                if bool(self.haslayer(cond)) != negated:
+                    s.append(self._sprintf_conditions(subtree))
+        return "".join(s)
+
+    def _sprintf_layer(self, cls, num, fld):
+        """DEV: returns the num^th layer named cls holding fld, for
+        sprintf(), or None. When cls is None, the first layer holding fld.
+        """
+        if cls is None:
+            lyr = self
+        elif num == 1 and self.__class__.__name__ == cls and \
+                hasattr(self, fld):
+            # e.g. the formats of mysummary()
+            return self
+        else:
+            index = self._get_layer_index()
+            if index is None:
+                lyr = self
+            else:
+                for pos in index.exact.get(cls, ()):
+                    lyr = index.layers[pos]
+                    if lyr.__class__.__name__ == cls and hasattr(lyr, fld):
+                        if num == 1:
+                            return lyr
+                        num -= 1
+                lyr = index.get_tail()
+                if lyr is None:
+                    return None
+        while not isinstance(lyr, NoPayload):
+            if (cls is None or lyr.__class__.__name__ == cls) and \
+               hasattr(lyr, fld):
+                if num == 1:
+                    return lyr
+                num -= 1
+            lyr = lyr.payload
+        return None
 
     def mysummary(self):
         """DEV: can be overloaded to return a string that summarizes the layer.
@@ -1518,12 +1786,315 @@ values.
             yield cls.convert_packet(pkt, **kwargs)
 
 
+# The default build methods, to detect the layers that override them
+_get_function = six.get_method_function
+_do_build = six.get_unbound_function(Packet.do_build)
+_do_build_payload = six.get_unbound_function(Packet.do_build_payload)
+_post_build = six.get_unbound_function(Packet.post_build)
+
+
+# The compiled sprintf() format strings, in least recently used order
+_sprintf_plans = OrderedDict()
+
+
+def _compile_sprintf_conditions(fmt):
+    """Parses the {layer:string} conditions of a sprintf() format string
+    into a tree: a list of strings and of (layer, negated, subtree) tuples.
+    """
+    stack = [[]]
+    for tok in re.split("([{}])", fmt):
+        if tok == "{":
+            stack.append([])
+        elif tok == "}" and len(stack) > 1:
+            node = stack.pop()
+            if not node or isinstance(node[0], tuple) or \
+               ":" not in node[0]:
+                cond = "".join(x for x in node if not isinstance(x, tuple))
+                raise Scapy_Exception("Bad condition in format string: [%s] (read sprintf doc!)" % cond)  # noqa: E501
+            cond, node[0] = node[0].split(":", 1)
+            negated = cond.startswith("!")
+            if negated:
+                cond = cond[1:]
+            stack[-1].append((cond, negated, node))
+        elif tok:
+            stack[-1].append(tok)
+    if len(stack) > 1:
+        raise Scapy_Exception("Bad condition in format string: unbalanced "
+                              "'{' (read sprintf doc!)")
+    return stack[0]
+
+
+def _compile_sprintf_directives(fmt):
+    """Parses the %...% directives of a sprintf() format string without
+    conditions into a list of strings and of (fmt, raw_fmt, cls, num,
+    field, directive) tuples. cls is None when the layer is not given,
+    raw_fmt is None unless the raw value is requested.
+    """
+    escape = {"%": "%",
+              "(": "{",
+              ")": "}"}
+    plan = []
+    s = ""
+    while "%" in fmt:
+        i = fmt.index("%")
+        s += fmt[:i]
+        fmt = fmt[i + 1:]
+        if fmt and fmt[0] in escape:
+            s += escape[fmt[0]]
+            fmt = fmt[1:]
+            continue
+        try:
+            i = fmt.index("%")
+            sfclsfld = fmt[:i]
+            fclsfld = sfclsfld.split(",")
+            if len(fclsfld) == 1:
+                f = "s"
+                clsfld = fclsfld[0]
+            elif len(fclsfld) == 2:
+                f, clsfld = fclsfld
+            else:
+                raise Scapy_Exception
+            if "." in clsfld:
+                cls, fld = clsfld.split(".")
+            else:
+                cls = None
+                fld = clsfld
+            num = 1
+            if cls is not None and ":" in cls:
+                cls, num = cls.split(":")
+                num = int(num)
+            fmt = fmt[i + 1:]
+        except Exception:
+            raise Scapy_Exception("Bad format string [%%%s%s]" % (fmt[:25], fmt[25:] and "..."))  # noqa: E501
+        raw_f = None
+        if f[-1:] == "r":
+            raw_f = f[:-1] or "s"
+        if s:
+            plan.append(s)
+            s = ""
+        plan.append((f, raw_f, cls, num, fld, sfclsfld))
+    s += fmt
+    if s:
+        plan.append(s)
+    return plan
+
+
+def _get_sprintf_plan(fmt):
+    """Returns the compiled conditions of a sprintf() format string if it
+    has some, or its compiled directives.
+    """
+    plan = _sprintf_plans.pop(fmt, None)
+    if plan is None:
+        if "{" in fmt:
+            plan = _compile_sprintf_conditions(fmt)
+        else:
+            plan = _compile_sprintf_directives(fmt)
+    _sprintf_plans[fmt] = plan
+    while len(_sprintf_plans) > max(conf.sprintf_cache_size, 1):
+        _sprintf_plans.popitem(last=False)
+    return plan
+
+
+_haslayer = six.get_unbound_function(Packet.haslayer)
+_getlayer = six.get_unbound_function(Packet.getlayer)
+
+
+class _LayerIndex(object):
+    """The layers of a packet, from a given layer, indexed by class and by
+    name, as used by Packet.haslayer() and Packet.getlayer().
+
+    The index stops before a layer overriding these methods, and at a
+    layer whose payload has not been dissected yet: this "tail" is
+    looked up by its own methods. Do not use directly.
+    """
+    __slots__ = ["layers", "exact", "bases", "nested", "sub", "tail",
+                 "lazy", "checked"]
+    # Number of lookups of a packet before its layers get indexed
+    min_lookups = 5
+    # Incremented each time the payload of an indexed layer is set
+    generation = 0
+    # class -> (names of the class, classes it inherits from)
+    class_keys = {}
+    # class -> whether it overrides haslayer() or getlayer()
+    class_overrides = {}
+
+    def __init__(self, pkt):
+        self.checked = _LayerIndex.generation
+        self.layers = []
+        # class or name -> positions of the layers
+        self.exact = defaultdict(list)
+        # class -> positions of the layers of this class or of a subclass
+        self.bases = defaultdict(list)
+        # positions of the layers with fields holding packets
+        self.nested = []
+        self.sub = None
+        self.tail = None
+        self.lazy = False
+        lyr = pkt
+        while True:
+            pos = len(self.layers)
+            self.layers.append(lyr)
+            lyr._indexed = True
+            names, bases = self.get_class_keys(lyr.__class__)
+            for key in names:
+                self.exact[key].append(pos)
+            for base in bases:
+                self.bases[base].append(pos)
+            if self.sub is None and lyr.match_subclass:
+                self.sub = pos
+            if lyr.packetfields:
+                self.nested.append(pos)
+            if lyr._lazy_payload:
+                self.tail = lyr
+                self.lazy = True
+                break
+            lyr = lyr.payload
+            if isinstance(lyr, NoPayload):
+                break
+            if self.overrides(lyr):
+                self.tail = lyr
+                break
+        if self.sub is None:
+            self.sub = len(self.layers) + 1
+        # Do not create keys on lookups
+        self.exact.default_factory = None
+        self.bases.default_factory = None
+
+    @classmethod
+    def get_class_keys(cls, pkt_cls):
+        """Returns the keys of the layers of class pkt_cls in the index"""
+        try:
+            return cls.class_keys[pkt_cls]
+        except KeyError:
+            pass
+        names = tuple(set([pkt_cls, pkt_cls.__name__, pkt_cls._name]))
+        mro = pkt_cls.__mro__
+        keys = cls.class_keys[pkt_cls] = names, mro[:mro.index(Packet) + 1]
+        return keys
+
+    @classmethod
+    def overrides(cls, pkt):
+        """Tells whether a layer overrides haslayer() or getlayer(), and
+        has to be looked up by its own methods (as NoPayload does)
+        """
+        pkt_cls = pkt.__class__
+        try:
+            return cls.class_overrides[pkt_cls]
+        except KeyError:
+            ret = cls.class_overrides[pkt_cls] = (
+                six.get_unbound_function(pkt_cls.haslayer) is not _haslayer or
+                six.get_unbound_function(pkt_cls.getlayer) is not _getlayer
+            )
+            return ret
+
+    def is_valid(self):
+        """Checks that the indexed layers are still chained together"""
+        if self.checked == _LayerIndex.generation:
+            return True
+        layers = self.layers
+        for i in range(len(layers) - 1):
+            if layers[i]._payload is not layers[i + 1]:
+                return False
+        last = layers[-1]
+        if self.lazy:
+            if not last._lazy_payload:
+                return False
+        elif last._lazy_payload:
+            return False
+        elif self.tail is not None:
+            if last._payload is not self.tail:
+                return False
+        elif not isinstance(last._payload, NoPayload):
+            return False
+        self.checked = _LayerIndex.generation
+        return True
+
+    def get_tail(self):
+        """Returns the layer following the indexed ones, if any"""
+        if self.lazy:
+            return self.tail.payload
+        return self.tail
+
+    def get_layers(self):
+        """Packet.layers() using the index"""
+        layers = [lyr.__class__ for lyr in self.layers]
+        tail = self.get_tail()
+        if tail is not None:
+            layers.extend(tail.layers())
+        return layers
+
+    def haslayer(self, cls):
+        """Packet.haslayer() using the index"""
+        if cls in self.exact:
+            return True
+        for pos in self.nested:
+            for fvalue in self.layers[pos]._packetfields_layers():
+                ret = fvalue.haslayer(cls)
+                if ret:
+                    return ret
+        tail = self.get_tail()
+        if tail is not None:
+            return tail.haslayer(cls)
+        return False
+
+    def getlayer(self, cls, ccls, fld, nb, _track, _subclass, flt):
+        """Packet.getlayer() using the index, once its arguments have been
+        parsed
+        """
+        layers = self.layers
+        # Layers below a layer with match_subclass match subclasses of cls
+        sub = 0 if _subclass else self.sub
+        if cls is None:
+            candidates = range(len(layers))
+        elif isinstance(ccls, Packet_metaclass):
+            candidates = [pos for pos in self.bases.get(ccls, ())
+                          if pos >= sub or layers[pos].__class__ is ccls]
+        else:
+            candidates = self.exact.get(ccls, ())
+        if self.nested:
+            # The packets held by fields come right after their layer
+            matches = set(candidates)
+            positions = sorted(matches.union(self.nested))
+        else:
+            matches = None
+            positions = candidates
+        for pos in positions:
+            lyr = layers[pos]
+            if (matches is None or pos in matches) and all(
+                    lyr.getfieldval(fldname) == fldvalue
+                    for fldname, fldvalue in six.iteritems(flt)
+            ):
+                if nb == 1:
+                    if fld is None:
+                        return lyr
+                    else:
+                        return lyr.getfieldval(fld)
+                else:
+                    nb -= 1
+            if pos in self.nested:
+                for fvalue in lyr._packetfields_layers():
+                    track = []
+                    ret = fvalue.getlayer(cls, nb=nb, _track=track,
+                                          _subclass=pos >= sub or None,
+                                          **flt)
+                    if ret is not None:
+                        return ret
+                    nb = track[0]
+        tail = self.get_tail()
+        if tail is not None:
+            return tail.getlayer(cls, nb=nb, _track=_track,
+                                 _subclass=len(layers) >= sub or None, **flt)
+        if _track is not None:
+            _track.append(nb)
+        return None
+
+
 class NoPayload(Packet):
     def __new__(cls, *args, **kargs):
         singl = cls.__dict__.get("__singl__")
         if singl is None:
             cls.__singl__ = singl = Packet.__new__(cls)
-            Packet.__init__(singl)
+            Packet.__init__(singl, _lazy=False)
         return singl
 
     def __init__(self, *args, **kargs):
@@ -1604,6 +2175,12 @@ class NoPayload(Packet):
     def hashret(self):
         return b""
 
+    def request_keys(self):
+        return []
+
+    def answer_key(self):
+        return b""
+
     def answers(self, other):
         return isinstance(other, NoPayload) or isinstance(other, conf.padding_layer)  # noqa: E501
 
@@ -2258,3 +2835,237 @@ def fuzz(p, _inplace=0):
         q.default_fields.update(new_default_fields)
         q = q.payload
     return p
+
+
+###############
+#  Templates  #
+###############
+
+class PacketTemplate(Gen):
+    """
+    Generate the packets of a Packet with generators, as iterating over it
+    does, while building it only once.
+
+    The fields whose value varies are located in a first build. Each
+    packet is then built by patching their bytes in a copy of it, and by
+    updating the Internet checksums that cover them (RFC 1624). The
+    checksums are found by building the packet with a couple of other
+    values of each field; the bytes of other dependent fields must not
+    change with these values, or the packets are built normally.
+
+    The packets are the ones of the Packet iterator: the patched bytes
+    are only stored as the build cache of their layers.
+
+    >>> t = PacketTemplate(IP(dst="192.168.0.0/24")/TCP(dport=(1, 1024)))
+    >>> send(t)
+
+    :param pkt: the packet to generate the packets of
+    """
+    # Number of values of a field that are looked at for the probes
+    nb_probe_values = 64
+
+    def __init__(self, pkt):
+        self.pkt = pkt
+        self.raw = None
+        self.offsets = None
+        self.slots = None
+        self._compile()
+
+    def __iter__(self):
+        for pkt in self.pkt:
+            if self.slots is not None:
+                self._patch(pkt)
+            yield pkt
+
+    def __iterlen__(self):
+        return self.pkt.__iterlen__()
+
+    def __repr__(self):
+        return "<PacketTemplate %s (%s)>" % (
+            self.pkt.summary(),
+            "%i fields" % len(self.slots) if self.slots is not None
+            else "disabled"
+        )
+
+    @staticmethod
+    def _layers(pkt):
+        layers = []
+        while not isinstance(pkt, NoPayload):
+            layers.append(pkt)
+            pkt = pkt.payload
+        return layers
+
+    @staticmethod
+    def _varying_fields(layer):
+        """Returns the names of the fields that Packet.__iter__() may
+        iterate over, in a layer of the template"""
+        if layer.explicit or layer.raw_packet_cache is not None:
+            return []
+        names = []
+        for name in set(itertools.chain(layer.default_fields,
+                                        layer.overloaded_fields,
+                                        layer.fields)):
+            val = layer.getfieldval(name)
+            fld = layer.get_field(name)
+            if isinstance(val, BasePacket):
+                if val.__iterlen__() != 1:
+                    names.append(name)
+            elif isinstance(val, (Gen, VolatileValue)) or (
+                    fld is not None and not fld.islist and
+                    isinstance(val, (list, tuple))):
+                names.append(name)
+        return names
+
+    def _values(self, layer, name):
+        """Yields some values of a field, to probe it"""
+        gen = layer.getfieldval(name)
+        if isinstance(gen, VolatileValue):
+            gen = [gen] * self.nb_probe_values
+        elif not isinstance(gen, Gen):
+            gen = SetGen(gen)
+        for val in itertools.islice(gen, self.nb_probe_values):
+            if isinstance(val, VolatileValue):
+                val = val._fix()
+            yield val
+
+    @staticmethod
+    def _locate(layer, name):
+        """Returns the field called `name` of the layer, and the length of
+        the fields before it, if it can be built on its own"""
+        if len(layer.fields_desc) != layer._fixed_runs_size:
+            # fields_desc was changed in place
+            layer.__class__._compile_fixed_runs()
+        p = b""
+        for i, f in enumerate(layer.fields_desc):
+            if f.name == name:
+                if isinstance(p, tuple) or \
+                   layer._appending_fields.get(i) is not f:
+                    return None, None
+                return f, len(p)
+            val = layer.getfieldval(f.name)
+            if isinstance(val, RawVal):
+                if isinstance(p, tuple):
+                    return None, None
+                p += raw(val)
+            else:
+                p = f.addfield(layer, p, val)
+        return None, None
+
+    @staticmethod
+    def _apply(buf, off, new, sums):
+        """Patches the bytes of a field in `buf` and the checksums that
+        cover it. Returns False if a checksum cannot be patched."""
+        old = bytes(buf[off:off + len(new)])
+        buf[off:off + len(new)] = new
+        for pos, odd in sums:
+            chksum = checksum_update(
+                struct.unpack("!H", bytes(buf[pos:pos + 2]))[0],
+                old, new, odd
+            )
+            # 0 and 0xffff are both a valid sum, and UDP e.g. never
+            # uses the former: leave these cases to the layers.
+            if chksum in (0, 0xffff):
+                return False
+            buf[pos:pos + 2] = struct.pack("!H", chksum)
+        return True
+
+    def _probe(self, base, depth, fld, off, enc):
+        """Builds the packet with other values of a field, and looks for
+        the checksums that depend on it. Returns a list of
+        (offset, odd) tuples, or None if the field cannot be patched."""
+        layer = self._layers(base)[depth]
+        probes = []
+        for val in self._values(self._layers(self.pkt)[depth], fld.name):
+            new = fld.addfield(layer, b"", val)
+            if not isinstance(new, bytes) or new == enc or \
+               len(new) != len(enc) or \
+               any(new == prev for prev, _ in probes):
+                continue
+            pkt = base.copy()
+            self._layers(pkt)[depth].fields[fld.name] = val
+            probes.append((new, pkt.do_build()))
+            if len(probes) == 2:
+                break
+        if not probes:
+            return None
+        sums = []
+        for new, built in probes:
+            if len(built) != len(self.raw):
+                return None
+            expected = bytearray(self.raw)
+            expected[off:off + len(new)] = new
+            built = bytearray(built)
+            for pos in range(len(built)):
+                if built[pos] == expected[pos] or \
+                   any(c <= pos < c + 2 for c, _ in sums):
+                    continue
+                # The checksums are at an even offset of their layer
+                start = max(o for o in self.offsets if o <= pos)
+                c = pos - (pos - start) % 2
+                odd = (off - c) % 2 == 1
+                if c + 2 > len(built) or c + 2 > off and c < off + len(new):
+                    return None
+                sums.append((c, odd))
+            buf = bytearray(self.raw)
+            if not self._apply(buf, off, new, sums) or buf != built:
+                return None
+        return sums
+
+    def _compile(self):
+        base = next(iter(self.pkt), None)
+        if base is None:
+            return
+        self.raw = base.do_build()
+        layers = self._layers(base)
+        offsets = []
+        for layer in layers:
+            built = layer.do_build()
+            if not self.raw.endswith(built):
+                return
+            offsets.append(len(self.raw) - len(built))
+        self.offsets = offsets
+        slots = []
+        for depth, layer in enumerate(self._layers(self.pkt)):
+            if depth >= len(layers):
+                return
+            for name in self._varying_fields(layer):
+                blayer = layers[depth]
+                fld, off = self._locate(blayer, name)
+                if fld is None:
+                    return
+                enc = fld.addfield(blayer, b"", blayer.getfieldval(name))
+                off += offsets[depth]
+                if not isinstance(enc, bytes) or \
+                   self.raw[off:off + len(enc)] != enc:
+                    return
+                sums = self._probe(base, depth, fld, off, enc)
+                if sums is None:
+                    return
+                slots.append((depth, name, fld, off, enc, sums))
+        self.slots = slots
+
+    def _patch(self, pkt):
+        """Stores the patched bytes of a packet as the cache of its
+        layers"""
+        layers = self._layers(pkt)
+        if len(layers) != len(self.offsets):
+            return
+        buf = bytearray(self.raw)
+        for depth, name, fld, off, enc, sums in self.slots:
+            layer = layers[depth]
+            new = fld.addfield(layer, b"", layer.getfieldval(name))
+            if new == enc:
+                continue
+            if not isinstance(new, bytes) or len(new) != len(enc) or \
+               not self._apply(buf, off, new, sums):
+                return
+        buf = bytes(buf)
+        ends = self.offsets[1:] + [len(buf)]
+        for layer, start, end in zip(layers, self.offsets, ends):
+            layer.raw_packet_cache = buf[start:end]
+            layer.raw_packet_cache_fields = {}
+            for f in layer.fields_desc:
+                if (f.islist or f.holds_packets or f.ismutable) and \
+                   f.name in layer.fields:
+                    layer.raw_packet_cache_fields[f.name] = \
+                        f.do_copy(layer.fields[f.name])
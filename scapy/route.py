@@ -9,6 +9,7 @@ Routing and handling of network interfaces.
 
 
 from __future__ import absolute_import
+from collections import OrderedDict
 
 
 import scapy.consts
@@ -23,11 +24,47 @@ from scapy.utils import atol, ltoa, itom, plain_str, pretty_list
 ##############################
 
 class Route:
+    """The IPv4 routing table.
+
+    The routes are looked up in tables of prefixes, one per netmask, built
+    from `routes` when it changes. The results are kept in a cache of
+    ``conf.route_cache_size`` destinations, in least recently used order.
+    Call invalidate_cache() after modifying a route in place.
+    """
+
     def __init__(self):
         self.resync()
 
     def invalidate_cache(self):
-        self.cache = {}
+        self.cache = OrderedDict()
+        self._table = None
+
+    def _get_table(self):
+        """Returns the netmasks of the routes, from the most specific, and
+        a dict {netmask: {network: (sort key, route)}} of the best route
+        to each network. A route is either (iface, output_ip, gateway_ip)
+        or, for the addresses of the interfaces, the address.
+        """
+        table = self._table
+        if table is not None and table[0] is self.routes and \
+           table[1] == len(self.routes):
+            return table[2], table[3]
+        self.cache.clear()
+        tables = {}
+        for i, (d, m, gw, iface, a, me) in enumerate(self.routes):
+            if not a:  # some interfaces may not currently be connected
+                continue
+            # Use metrics, then the order of the routes, as tie-breakers
+            for msk, net, key, path in [
+                    (0xffffffff, atol(a), (1, 2 * i), a),
+                    (m, d & m, (me, 2 * i + 1), (iface, a, gw)),
+            ]:
+                prefixes = tables.setdefault(msk, {})
+                if net not in prefixes or key < prefixes[net][0]:
+                    prefixes[net] = (key, path)
+        masks = sorted(tables, reverse=True)
+        self._table = (self.routes, len(self.routes), masks, tables)
+        return masks, tables
 
     def resync(self):
         from scapy.arch import read_routes
@@ -141,8 +178,11 @@ class Route:
                 dst = plain_str(dst)
             except UnicodeDecodeError:
                 raise TypeError("Unknown IP address input (bytes)")
-        if dst in self.cache:
-            return self.cache[dst]
+        masks, tables = self._get_table()
+        ret = self.cache.pop(dst, None)
+        if ret is not None:
+            self.cache[dst] = ret
+            return ret
         # Transform "192.168.*.1-5" to one IP of the set
         _dst = dst.split("/")[0].replace("*", "0")
         while True:
@@ -153,28 +193,22 @@ class Route:
             _dst = _dst[:idx] + _dst[idx + m:]
 
         atol_dst = atol(_dst)
-        paths = []
-        for d, m, gw, i, a, me in self.routes:
-            if not a:  # some interfaces may not currently be connected
-                continue
-            aa = atol(a)
-            if aa == atol_dst:
-                paths.append(
-                    (0xffffffff, 1, (scapy.consts.LOOPBACK_INTERFACE, a, "0.0.0.0"))  # noqa: E501
-                )
-            if (atol_dst & m) == (d & m):
-                paths.append((m, me, (i, a, gw)))
-
-        if not paths:
+        # Choose the more specific route
+        for msk in masks:
+            path = tables[msk].get(atol_dst & msk)
+            if path is not None:
+                ret = path[1]
+                break
+        else:
             if verbose:
                 warning("No route found (no default route?)")
             return scapy.consts.LOOPBACK_INTERFACE, "0.0.0.0", "0.0.0.0"
-        # Choose the more specific route
-        # Sort by greatest netmask and use metrics as a tie-breaker
-        paths.sort(key=lambda x: (-x[0], x[1]))
-        # Return interface
-        ret = paths[0][2]
+        if not isinstance(ret, tuple):
+            # The address of an interface
+            ret = (scapy.consts.LOOPBACK_INTERFACE, ret, "0.0.0.0")
         self.cache[dst] = ret
+        while len(self.cache) > conf.route_cache_size:
+            self.cache.popitem(last=False)
         return ret
 
     def get_if_bcast(self, iff):
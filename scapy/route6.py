@@ -15,11 +15,13 @@ Routing and network interface handling for IPv6.
 #############################################################################
 
 from __future__ import absolute_import
+from collections import OrderedDict
 import socket
+import struct
 import scapy.consts
 from scapy.config import conf
 from scapy.utils6 import in6_ptop, in6_cidr2mask, in6_and, \
-    in6_islladdr, in6_ismlladdr, in6_isincluded, in6_isgladdr, \
+    in6_islladdr, in6_ismlladdr, in6_isgladdr, \
     in6_isaddr6to4, in6_ismaddr, construct_source_candidate_set, \
     get_source_addr_from_candidate_set
 from scapy.arch import read_routes6, in6_getifaddr
@@ -29,14 +31,78 @@ import scapy.modules.six as six
 from scapy.utils import pretty_list
 
 
+def _in6_toint(addr):
+    hi, lo = struct.unpack("!QQ", inet_pton(socket.AF_INET6, addr))
+    return (hi << 64) | lo
+
+
 class Route6:
+    """The IPv6 routing table.
+
+    The routes are looked up in tables of prefixes, one per prefix length,
+    built from `routes` when it changes. The results are kept in a cache
+    of ``conf.route_cache_size`` destinations, in least recently used
+    order. Call invalidate_cache() after modifying a route in place.
+    """
 
     def __init__(self):
         self.resync()
         self.invalidate_cache()
 
     def invalidate_cache(self):
-        self.cache = {}
+        self.cache = OrderedDict()
+        self._table = None
+
+    def _get_table(self):
+        """Returns the prefix lengths of the routes, from the longest, a
+        dict {plen: {prefix >> (128 - plen): [indexes of the routes]}}
+        and a dict {plen: [indexes of the routes]} of the routes to
+        link-local prefixes, also used for link-local multicast
+        destinations.
+        """
+        table = self._table
+        if table is not None and table[0] is self.routes and \
+           table[1] == len(self.routes):
+            return table[2:]
+        self.cache.clear()
+        prefixes = {}
+        lls = {}
+        for i, (p, plen, gw, iface, cset, me) in enumerate(self.routes):
+            net = _in6_toint(p)
+            if not net & ((1 << (128 - plen)) - 1):
+                prefixes.setdefault(plen, {}).setdefault(
+                    net >> (128 - plen), []
+                ).append(i)
+            if in6_islladdr(p):
+                lls.setdefault(plen, []).append(i)
+        plens = sorted(set(prefixes).union(lls), reverse=True)
+        self._table = (self.routes, len(self.routes), plens, prefixes, lls)
+        return plens, prefixes, lls
+
+    def _lookup(self, dst, dev=None):
+        """Returns the most specific routes to dst with the lowest metric,
+        as (plen, metric, (iface, cset, gw)) tuples"""
+        plens, prefixes, lls = self._get_table()
+        dst_int = _in6_toint(dst)
+        mll = in6_ismlladdr(dst)
+        for plen in plens:
+            idxs = prefixes.get(plen, {}).get(dst_int >> (128 - plen), [])
+            if mll and plen in lls:
+                # The candidate sets are sorted in place by
+                # get_source_addr_from_candidate_set()
+                idxs = sorted(set(idxs).union(
+                    i for i in lls[plen]
+                    if self.routes[i][4] and
+                    in6_islladdr(self.routes[i][4][0])
+                ))
+            paths = [(plen, me, (iface, cset, gw))
+                     for p, _, gw, iface, cset, me in
+                     (self.routes[i] for i in idxs)
+                     if dev is None or iface == dev]
+            if paths:
+                metric = min(x[1] for x in paths)
+                return [x for x in paths if x[1] == metric]
+        return []
 
     def flush(self):
         self.invalidate_cache()
@@ -260,22 +326,18 @@ class Route6:
         k = dst
         if dev is not None:
             k = dst + "%%" + (dev if isinstance(dev, six.string_types) else dev.pcap_name)  # noqa: E501
-        if k in self.cache:
-            return self.cache[k]
-
-        paths = []
+        # Refresh the tables (and the cache) if the routes have changed
+        self._get_table()
+        res = self.cache.pop(k, None)
+        if res is not None:
+            self.cache[k] = res
+            return res
 
         # TODO : review all kinds of addresses (scope and *cast) to see
         #        if we are able to cope with everything possible. I'm convinced
         #        it's not the case.
         # -- arnaud
-        for p, plen, gw, iface, cset, me in self.routes:
-            if dev is not None and iface != dev:
-                continue
-            if in6_isincluded(dst, p, plen):
-                paths.append((plen, me, (iface, cset, gw)))
-            elif (in6_ismlladdr(dst) and in6_islladdr(p) and in6_islladdr(cset[0])):  # noqa: E501
-                paths.append((plen, me, (iface, cset, gw)))
+        paths = self._lookup(dst, dev)
 
         if not paths:
             if dst == "::1":
@@ -286,12 +348,6 @@ class Route6:
                             "(no default route?)", dst)
                 return (scapy.consts.LOOPBACK_INTERFACE, "::", "::")
 
-        # Sort with longest prefix first then use metrics as a tie-breaker
-        paths.sort(key=lambda x: (-x[0], x[1]))
-
-        best_plen = (paths[0][0], paths[0][1])
-        paths = [x for x in paths if (x[0], x[1]) == best_plen]
-
         res = []
         for p in paths:  # Here we select best source address for every route
             tmp = p[2]
@@ -330,6 +386,8 @@ class Route6:
         if dev is not None:
             k = dst + "%%" + (dev if isinstance(dev, six.string_types) else dev.pcap_name)  # noqa: E501
         self.cache[k] = res[0][2]
+        while len(self.cache) > conf.route_cache_size:
+            self.cache.popitem(last=False)
 
         return res[0][2]
 
@@ -8,21 +8,22 @@ Functions to send and receive packets.
 """
 
 from __future__ import absolute_import, print_function
-import itertools
-from threading import Thread, Event
+import collections
+from threading import Condition, Lock, Thread, Event
 import os
 import re
 import subprocess
 import time
 import types
 
-from scapy.compat import plain_str
+from scapy.bpf import BPFFilter
+from scapy.compat import plain_str, raw
 from scapy.data import ETH_P_ALL
 from scapy.config import conf
 from scapy.error import warning
-from scapy.packet import Gen, Packet
+from scapy.packet import Gen, Packet, PacketTemplate
 from scapy.utils import get_temp_file, tcpdump, wrpcap, \
-    ContextManagerSubprocess, PcapReader
+    ContextManagerSubprocess, PcapReader, TokenBucket
 from scapy.plist import PacketList, SndRcvList
 from scapy.error import log_runtime, log_interactive, Scapy_Exception
 from scapy.base_classes import SetGen
@@ -43,6 +44,7 @@ class debug:
     recv = []
     sent = []
     match = []
+    index = {}
     crashed_on = None
 
 
@@ -73,9 +75,121 @@ _DOC_SNDRCV_PARAMS = """
         un-answered packets.
     :param prebuild: pre-build the packets before starting to send them.
         Automatically enabled when a generator is passed as the packet
+    :param template: build the packets generated by a Packet by patching
+        one build of it (see PacketTemplate)
+    :param window: if set, the maximum number of packets waiting for an
+        answer. `timeout` and `retry` then apply to each packet, which is
+        sent again as soon as it times out (see WindowedSndRcvHandler)
+    :param pps: with a window, the initial sending rate, in packets per
+        second. It adapts to the answers and losses
+    :param prn: with a window, a function called with each sent packet and
+        its answer, which are then not stored
+    :param prnfail: with a window, a function called with each unanswered
+        packet, which is then not stored
+        (pps, prn and prnfail raise a Scapy_Exception without a window)
+    :param spool: a PcapSpool (or any object with an append() method) to
+        store the answers to, instead of memory. The returned SndRcvList
+        reads them from it
     """
 
 
+class AnswerIndex(object):
+    """
+    Index of the packets waiting for an answer, used by SndRcvHandler.
+
+    Each packet is stored in the bucket of its hashret(), and in the
+    buckets of its request_keys(), which split it further. An answer is
+    looked up in the bucket of its answer_key(), then in the one of its
+    hashret(). The buckets are ordered dicts, to remove the answered
+    packets from all of them in constant time. A lock protects them from
+    the sending thread.
+
+    :param multi: keep the packets that have been answered
+    """
+    def __init__(self, multi=False):
+        self.multi = multi
+        self.buckets = {}
+        self.entries = collections.OrderedDict()
+        self.lock = Lock()
+        self._n = 0
+        self.lookups = 0
+        self.comparisons = 0
+        self.fast_matches = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, pkt):
+        """Stores a packet, and returns its key in the index"""
+        h = pkt.hashret()
+        keys = [h] + [(h, k) for k in pkt.request_keys()]
+        with self.lock:
+            n = self._n
+            self._n += 1
+            for key in keys:
+                bucket = self.buckets.setdefault(key,
+                                                 collections.OrderedDict())
+                bucket[n] = pkt
+            self.entries[n] = (pkt, keys)
+        return n
+
+    def _remove(self, n):
+        _, keys = self.entries.pop(n)
+        for key in keys:
+            bucket = self.buckets[key]
+            bucket.pop(n, None)
+            if not bucket:
+                del self.buckets[key]
+
+    def discard(self, n):
+        """Removes the packet stored with the key `n`, if it is still
+        stored"""
+        with self.lock:
+            if n in self.entries:
+                self._remove(n)
+
+    def lookup(self, r):
+        """Returns the key and the packet that `r` answers, or None"""
+        self.lookups += 1
+        h = r.hashret()
+        if h not in self.buckets:
+            return None
+        k = r.answer_key()
+        with self.lock:
+            for key in [(h, k), h] if k else [h]:
+                for n, pkt in six.iteritems(self.buckets.get(key, {})):
+                    self.comparisons += 1
+                    if r.answers(pkt):
+                        if key is not h:
+                            self.fast_matches += 1
+                        if not self.multi:
+                            self._remove(n)
+                        return n, pkt
+        return None
+
+    def match(self, r):
+        """Returns the packet that `r` answers, or None"""
+        found = self.lookup(r)
+        return found and found[1]
+
+    def remaining(self):
+        """Returns the packets that are still stored, in sending order"""
+        return [pkt for pkt, _ in six.itervalues(self.entries)]
+
+    def stats(self):
+        """Returns a dict of statistics about the buckets and the
+        lookups"""
+        sizes = [len(bucket) for bucket in six.itervalues(self.buckets)]
+        return {
+            "packets": len(self.entries),
+            "buckets": len(sizes),
+            "largest_bucket": max(sizes or [0]),
+            "lookups": self.lookups,
+            "comparisons": self.comparisons,
+            "fast_matches": self.fast_matches,
+        }
+
+
 class SndRcvHandler(object):
     """
     Util to send/receive packets, used by sr*().
@@ -89,14 +203,20 @@ class SndRcvHandler(object):
         when sending a big amount of packets. Disabled by default
       - DEVS: store the outgoing timestamp right BEFORE sending the packet
         to avoid races that could result in negative latency. We aren't Stadia
+      - the packets waiting for an answer are stored in an index_class
+        instance (see AnswerIndex)
     """
+    index_class = AnswerIndex
+
     def __init__(self, pks, pkt,
                  timeout=None, inter=0, verbose=None,
                  chainCC=False,
                  retry=0, multi=False, rcv_pks=None,
                  prebuild=False, _flood=None,
                  threaded=False,
-                 session=None):
+                 session=None,
+                 template=False,
+                 spool=None):
         # Instantiate all arguments
         if verbose is None:
             verbose = conf.verb
@@ -105,7 +225,7 @@ class SndRcvHandler(object):
             debug.sent = PacketList([], "Sent")
             debug.match = SndRcvList([], "Matched")
         self.nbrecv = 0
-        self.ans = []
+        self.ans = [] if spool is None else spool
         self.pks = pks
         self.rcv_pks = rcv_pks or pks
         self.inter = inter
@@ -115,6 +235,8 @@ class SndRcvHandler(object):
         self.timeout = timeout
         self.session = session
         # Instantiate packet holders
+        if template and isinstance(pkt, Packet):
+            pkt = PacketTemplate(pkt)
         if _flood:
             self.tobesent = pkt
             self.notans = _flood[0]
@@ -129,15 +251,21 @@ class SndRcvHandler(object):
                 self.notans = self.tobesent.__iterlen__()
 
         if retry < 0:
-            autostop = retry = -retry
+            self.autostop = self.retry = -retry
         else:
-            autostop = 0
+            self.autostop = 0
+            self.retry = retry
 
         if timeout is not None and timeout < 0:
             self.timeout = None
 
-        while retry >= 0:
-            self.hsent = {}
+        self._sndrcv_loop(threaded, _flood)
+
+    def _sndrcv_loop(self, threaded, _flood):
+        """Sends the packets and receives the answers, until there is
+        nothing left to retry"""
+        while True:
+            self.index = self.index_class(multi=self.multi)
 
             if threaded or _flood:
                 # Send packets in thread.
@@ -158,34 +286,43 @@ class SndRcvHandler(object):
             else:
                 self._sndrcv_rcv(self._sndrcv_snd)
 
-            if multi:
-                remain = [
-                    p for p in itertools.chain(*six.itervalues(self.hsent))
-                    if not hasattr(p, '_answered')
-                ]
-            else:
-                remain = list(itertools.chain(*six.itervalues(self.hsent)))
-
-            if autostop and len(remain) > 0 and \
-               len(remain) != len(self.tobesent):
-                retry = autostop
-
-            self.tobesent = remain
-            if len(self.tobesent) == 0:
+            if not self._next_round():
                 break
-            retry -= 1
-
+        self._sndrcv_end()
+
+    def _next_round(self):
+        """Keeps the unanswered packets in self.tobesent, and returns
+        whether they have to be sent again"""
+        remain = self.index.remaining()
+        if self.multi:
+            remain = [p for p in remain if not hasattr(p, '_answered')]
+
+        if self.autostop and len(remain) > 0 and \
+           len(remain) != len(self.tobesent):
+            self.retry = self.autostop
+
+        self.tobesent = remain
+        if len(self.tobesent) == 0 or self.retry <= 0:
+            return False
+        self.retry -= 1
+        return True
+
+    def _sndrcv_end(self):
+        """Builds the results once all the rounds are over"""
+        remain = self.tobesent
         if conf.debug_match:
             debug.sent = PacketList(remain[:], "Sent")
             debug.match = SndRcvList(self.ans[:])
+            debug.index = self.index.stats()
 
-        # Clean the ans list to delete the field _answered
-        if multi:
+        # Clean the ans list to delete the field _answered (the spooled
+        # answers are copies)
+        if self.multi and isinstance(self.ans, list):
             for snd, _ in self.ans:
                 if hasattr(snd, '_answered'):
                     del snd._answered
 
-        if verbose:
+        if self.verbose:
             print(
                 "\nReceived %i packets, got %i answers, "
                 "remaining %i packets" % (
@@ -206,10 +343,10 @@ class SndRcvHandler(object):
                 print("Begin emission:")
             i = 0
             for p in self.tobesent:
-                # Populate the dictionary of _sndrcv_rcv
+                # Populate the index of _sndrcv_rcv
                 # _sndrcv_rcv won't miss the answer of a packet that
                 # has not been sent
-                self.hsent.setdefault(p.hashret(), []).append(p)
+                self.index.add(p)
                 # Send packet
                 self.pks.send(p)
                 time.sleep(self.inter)
@@ -226,25 +363,20 @@ class SndRcvHandler(object):
         if r is None:
             return
         ok = False
-        h = r.hashret()
-        if h in self.hsent:
-            hlst = self.hsent[h]
-            for i, sentpkt in enumerate(hlst):
-                if r.answers(sentpkt):
-                    self.ans.append((sentpkt, r))
-                    if self.verbose > 1:
-                        os.write(1, b"*")
-                    ok = True
-                    if not self.multi:
-                        del hlst[i]
-                        self.notans -= 1
-                    else:
-                        if not hasattr(sentpkt, '_answered'):
-                            self.notans -= 1
-                        sentpkt._answered = 1
-                    break
+        sentpkt = self.index.match(r)
+        if sentpkt is not None:
+            self.ans.append((sentpkt, r))
+            if self.verbose > 1:
+                os.write(1, b"*")
+            ok = True
+            if not self.multi:
+                self.notans -= 1
+            else:
+                if not hasattr(sentpkt, '_answered'):
+                    self.notans -= 1
+                sentpkt._answered = 1
         if self.notans <= 0 and not self.multi:
-            self.sniffer.stop(join=False)
+            self._sndrcv_stop()
         if not ok:
             if self.verbose > 1:
                 os.write(1, b".")
@@ -252,6 +384,10 @@ class SndRcvHandler(object):
             if conf.debug_match:
                 debug.recv.append(r)
 
+    def _sndrcv_stop(self):
+        """Stops receiving, once every packet has been answered"""
+        self.sniffer.stop(join=False)
+
     def _sndrcv_rcv(self, callback):
         """Function used to receive packets and check their hashret"""
         self.sniffer = None
@@ -270,18 +406,202 @@ class SndRcvHandler(object):
                 raise
 
 
+class WindowedSndRcvHandler(SndRcvHandler):
+    """
+    Util to send/receive many packets with a bounded number of them
+    waiting for an answer, used by sr*() when a window is given.
+    Do not use directly.
+
+    Notes::
+      - at most `window` packets wait for an answer at any time: the
+        emission pauses until answers arrive or packets time out
+      - each packet waits `timeout` seconds (default_timeout if None) for
+        its answer, then is sent again, up to `retry` times. The retries
+        are interleaved with the emission of the other packets
+      - with `pps`, the packets are paced by a TokenBucket. Its rate grows
+        with the answers to first tries, and is halved when a retried
+        packet is answered, as its first try was likely lost
+      - with `prn` and `prnfail`, the answers and the unanswered packets
+        are handed to them as they come, instead of being stored
+    """
+    default_timeout = 2
+
+    def __init__(self, pks, pkt, *args, **kwargs):
+        self.window = kwargs.pop("window")
+        self.bucket = TokenBucket(kwargs.pop("pps", None))
+        self.prn = kwargs.pop("prn", None)
+        self.prnfail = kwargs.pop("prnfail", None)
+        # {index key: [packet, number of retries]}
+        self.inflight = {}
+        # (expiry time, index key), in sending order
+        self.deadlines = collections.deque()
+        self.resend = collections.deque()
+        self.unans = []
+        self.cond = Condition()
+        self.last_decrease = 0
+        SndRcvHandler.__init__(self, pks, pkt, *args, **kwargs)
+
+    def _sndrcv_loop(self, threaded, _flood):
+        if self.timeout is None:
+            self.timeout = self.default_timeout
+        self.index = self.index_class(multi=self.multi)
+        snd_thread = Thread(
+            target=self._sndrcv_snd
+        )
+        snd_thread.setDaemon(True)
+        self._sndrcv_rcv(snd_thread.start)
+        snd_thread.join()
+        self.tobesent = self.unans
+        self._sndrcv_end()
+
+    def _expire(self):
+        """Handles the packets whose answer is late. Called with the
+        condition held"""
+        now = time.time()
+        while self.deadlines and self.deadlines[0][0] <= now:
+            _, n = self.deadlines.popleft()
+            self.index.discard(n)
+            entry = self.inflight.pop(n, None)
+            if entry is None:
+                # Answered
+                continue
+            pkt, tries = entry
+            if tries < self.retry:
+                self.resend.append((pkt, tries + 1))
+            elif self.prnfail is not None:
+                self.prnfail(pkt)
+            else:
+                self.unans.append(pkt)
+
+    def _next_packet(self, packets):
+        """Returns the next packet to send, after storing it in the index,
+        or None when all the packets are answered or have expired"""
+        with self.cond:
+            while True:
+                self._expire()
+                if len(self.inflight) < self.window:
+                    if self.resend:
+                        pkt, tries = self.resend.popleft()
+                    else:
+                        pkt, tries = next(packets, None), 0
+                    if pkt is not None:
+                        n = self.index.add(pkt)
+                        self.inflight[n] = [pkt, tries]
+                        return n, pkt
+                    if not self.inflight:
+                        return None
+                delay = None
+                if self.deadlines:
+                    delay = max(self.deadlines[0][0] - time.time(), 0)
+                self.cond.wait(delay)
+
+    def _sndrcv_snd(self):
+        """Function used in the sending thread of the windowed mode"""
+        try:
+            if self.verbose:
+                print("Begin emission:")
+            i = 0
+            packets = iter(self.tobesent)
+            while True:
+                found = self._next_packet(packets)
+                if found is None:
+                    break
+                n, p = found
+                self.bucket.wait()
+                self.pks.send(p)
+                with self.cond:
+                    self.deadlines.append((time.time() + self.timeout, n))
+                time.sleep(self.inter)
+                i += 1
+            if self.verbose:
+                print("Finished sending %i packets." % i)
+        except SystemExit:
+            pass
+        except Exception:
+            log_runtime.exception("--- Error sending packets")
+        finally:
+            self.sniffer.stop(join=False)
+
+    def _process_packet(self, r):
+        """Internal function used to process each packet."""
+        if r is None:
+            return
+        found = self.index.lookup(r)
+        if found is None:
+            if self.verbose > 1:
+                os.write(1, b".")
+            self.nbrecv += 1
+            if conf.debug_match:
+                debug.recv.append(r)
+            return
+        n, sentpkt = found
+        with self.cond:
+            entry = self.inflight.pop(n, None)
+            if entry is not None:
+                self.notans -= 1
+                if self.bucket.pps:
+                    self._adapt_rate(entry[1])
+                self.cond.notify()
+        if self.verbose > 1:
+            os.write(1, b"*")
+        if self.prn is not None:
+            self.prn(sentpkt, r)
+        else:
+            self.ans.append((sentpkt, r))
+
+    def _adapt_rate(self, tries):
+        """Grows the sending rate when a first try is answered, halves it
+        (at most once per timeout) when a retry is answered"""
+        if not tries:
+            self.bucket.pps += float(self.bucket.pps) / self.window
+            return
+        now = time.time()
+        if now - self.last_decrease >= self.timeout:
+            self.bucket.pps = max(self.bucket.pps / 2., 1)
+            self.last_decrease = now
+
+    def _sndrcv_rcv(self, callback):
+        """Function used to receive packets, until the sending thread
+        stops the sniffer"""
+        self.sniffer = None
+        try:
+            self.sniffer = AsyncSniffer()
+            self.sniffer._run(
+                prn=self._process_packet,
+                store=False,
+                opened_socket=self.pks,
+                session=self.session,
+                started_callback=callback
+            )
+        except KeyboardInterrupt:
+            if self.chainCC:
+                raise
+
+
 def sndrcv(*args, **kwargs):
     """Scapy raw function to send a packet and receive its answer.
     WARNING: This is an internal function. Using sr/srp/sr1/srp is
     more appropriate in many cases.
     """
-    sndrcver = SndRcvHandler(*args, **kwargs)
+    if kwargs.get("window"):
+        sndrcver = WindowedSndRcvHandler(*args, **kwargs)
+    else:
+        kwargs.pop("window", None)
+        # Only used by WindowedSndRcvHandler
+        windowed = [arg for arg in ["pps", "prn", "prnfail"]
+                    if kwargs.pop(arg, None) is not None]
+        if windowed:
+            raise Scapy_Exception("%s can only be used with a window" %
+                                  ", ".join(windowed))
+        sndrcver = SndRcvHandler(*args, **kwargs)
     return sndrcver.results()
 
 
-def __gen_send(s, x, inter=0, loop=0, count=None, verbose=None, realtime=None, return_packets=False, *args, **kargs):  # noqa: E501
+def __gen_send(s, x, inter=0, loop=0, count=None, verbose=None, realtime=None, return_packets=False, batch=False, pps=None, mbps=None, template=False, frames=False, *args, **kargs):  # noqa: E501
     if isinstance(x, str):
         x = conf.raw_layer(load=x)
+    if template and isinstance(x, Packet):
+        x = PacketTemplate(x)
     if not isinstance(x, Gen):
         x = SetGen(x)
     if verbose is None:
@@ -293,8 +613,17 @@ def __gen_send(s, x, inter=0, loop=0, count=None, verbose=None, realtime=None, r
         loop = -1
     if return_packets:
         sent_packets = PacketList()
+    bucket = TokenBucket(pps, mbps)
     try:
         while loop:
+            if batch:
+                pkts = list(x) if return_packets else x
+                n += s.send_many(pkts, pps=pps, mbps=mbps)
+                if return_packets:
+                    sent_packets.extend(pkts)
+                if loop < 0:
+                    loop += 1
+                continue
             dt0 = None
             for p in x:
                 if realtime:
@@ -305,7 +634,19 @@ def __gen_send(s, x, inter=0, loop=0, count=None, verbose=None, realtime=None, r
                             time.sleep(st)
                     else:
                         dt0 = ct - float(p.time)
-                s.send(p)
+                if mbps and frames:
+                    # Build the frame once, to both pace and send it (the
+                    # layer 2 sockets send it as it is)
+                    sx = raw(p)
+                    bucket.wait(1, len(sx))
+                    try:
+                        p.sent_time = time.time()
+                    except AttributeError:
+                        pass
+                    s.send(sx)
+                else:
+                    bucket.wait(1, len(p) if mbps else 0)
+                    s.send(p)
                 if return_packets:
                     sent_packets.append(p)
                 n += 1
@@ -325,7 +666,8 @@ def __gen_send(s, x, inter=0, loop=0, count=None, verbose=None, realtime=None, r
 @conf.commands.register
 def send(x, inter=0, loop=0, count=None,
          verbose=None, realtime=None,
-         return_packets=False, socket=None, *args, **kargs):
+         return_packets=False, socket=None, batch=False, pps=None,
+         mbps=None, template=False, *args, **kargs):
     """
     Send packets at layer 3
 
@@ -336,6 +678,12 @@ def send(x, inter=0, loop=0, count=None,
     :param verbose: verbose mode (default None=conf.verbose)
     :param realtime: check that a packet was sent before sending the next one
     :param return_packets: return the sent packets
+    :param batch: send the packets in batches with the socket's send_many()
+        (inter and realtime are ignored)
+    :param pps: the maximum rate in packets per second
+    :param mbps: the maximum rate in megabits per second
+    :param template: build the packets generated by x by patching one
+        build of it (see PacketTemplate)
     :param socket: the socket to use (default is conf.L3socket(kargs))
     :param iface: the interface to send the packets on
     :param monitor: (not on linux) send in monitor mode
@@ -345,16 +693,27 @@ def send(x, inter=0, loop=0, count=None,
     socket = socket or conf.L3socket(*args, **kargs)
     results = __gen_send(socket, x, inter=inter, loop=loop,
                          count=count, verbose=verbose,
-                         realtime=realtime, return_packets=return_packets)
+                         realtime=realtime, return_packets=return_packets,
+                         batch=batch, pps=pps, mbps=mbps,
+                         template=template)
     if need_closing:
         socket.close()
     return results
 
 
+def _resolve_neighbors(x):
+    """Resolves at once the missing l2 destinations of the packets, rather
+    than one by one when they are built (see Neighbor.resolve_all)"""
+    neighbor = getattr(conf, "neighbor", None)
+    if neighbor is not None and isinstance(x, (Packet, list, PacketList)):
+        neighbor.resolve_all(x)
+
+
 @conf.commands.register
 def sendp(x, inter=0, loop=0, iface=None, iface_hint=None, count=None,
           verbose=None, realtime=None,
-          return_packets=False, socket=None, *args, **kargs):
+          return_packets=False, socket=None, batch=False, pps=None,
+          mbps=None, template=False, *args, **kargs):
     """
     Send packets at layer 2
 
@@ -365,6 +724,12 @@ def sendp(x, inter=0, loop=0, iface=None, iface_hint=None, count=None,
     :param verbose: verbose mode (default None=conf.verbose)
     :param realtime: check that a packet was sent before sending the next one
     :param return_packets: return the sent packets
+    :param batch: send the packets in batches with the socket's send_many()
+        (inter and realtime are ignored)
+    :param pps: the maximum rate in packets per second
+    :param mbps: the maximum rate in megabits per second
+    :param template: build the packets generated by x by patching one
+        build of it (see PacketTemplate)
     :param socket: the socket to use (default is conf.L3socket(kargs))
     :param iface: the interface to send the packets on
     :param monitor: (not on linux) send in monitor mode
@@ -372,11 +737,14 @@ def sendp(x, inter=0, loop=0, iface=None, iface_hint=None, count=None,
     """
     if iface is None and iface_hint is not None and socket is None:
         iface = conf.route.route(iface_hint)[0]
+    _resolve_neighbors(x)
     need_closing = socket is None
     socket = socket or conf.L2socket(iface=iface, *args, **kargs)
     results = __gen_send(socket, x, inter=inter, loop=loop,
                          count=count, verbose=verbose,
-                         realtime=realtime, return_packets=return_packets)
+                         realtime=realtime, return_packets=return_packets,
+                         batch=batch, pps=pps, mbps=mbps,
+                         template=template, frames=True)
     if need_closing:
         socket.close()
     return results
@@ -551,6 +919,7 @@ def srp(x, promisc=None, iface=None, iface_hint=None, filter=None,
     """
     if iface is None and iface_hint is not None:
         iface = conf.route.route(iface_hint)[0]
+    _resolve_neighbors(x)
     s = conf.L2socket(promisc=promisc, iface=iface,
                       filter=filter, nofilter=nofilter, type=type)
     result = sndrcv(s, x, *args, **kargs)
@@ -755,13 +1124,15 @@ class AsyncSniffer(object):
 
     Args:
         count: number of packets to capture. 0 means infinity.
-        store: whether to store sniffed packets or discard them
+        store: whether to store sniffed packets or discard them, or a
+               PcapSpool to store them to a file instead of memory
         prn: function to apply to each packet. If something is returned, it
              is displayed.
              --Ex: prn = lambda x: x.summary()
         session: a session = a flow decoder used to handle stream of packets.
                  e.g: IPSession (to defragment on-the-flow) or NetflowSession
-        filter: BPF filter to apply.
+        filter: BPF filter to apply. With offline, it is applied to the
+                raw packets before they are dissected (see scapy.bpf).
         lfilter: Python function applied to each packet to determine if
                  further action may be done.
                  --Ex: lfilter = lambda x: x.haslayer(Padding)
@@ -855,18 +1226,36 @@ class AsyncSniffer(object):
                 sniff_sockets[opened_socket] = "socket0"
         if offline is not None:
             flt = karg.get('filter')
+            bpf = None
+            if flt is not None:
+                try:
+                    bpf = BPFFilter(flt)
+                except Scapy_Exception as e:
+                    # Not supported by scapy.bpf: let tcpdump filter
+                    log_runtime.info("Filtering with tcpdump: %s", e)
+
+            def _open_offline(fname):
+                if flt is None:
+                    return PcapReader(fname)
+                if bpf is not None:
+                    try:
+                        return PcapReader(fname, filter=bpf)
+                    except Scapy_Exception as e:
+                        # e.g. a link type not supported by scapy.bpf
+                        log_runtime.info("Filtering with tcpdump: %s", e)
+                return PcapReader(
+                    tcpdump(fname, args=["-w", "-", flt], getfd=True)
+                )
 
             if isinstance(offline, list) and \
                     all(isinstance(elt, str) for elt in offline):
-                sniff_sockets.update((PcapReader(
-                    fname if flt is None else
-                    tcpdump(fname, args=["-w", "-", flt], getfd=True)
-                ), fname) for fname in offline)
+                sniff_sockets.update((_open_offline(fname), fname)
+                                     for fname in offline)
             elif isinstance(offline, dict):
-                sniff_sockets.update((PcapReader(
-                    fname if flt is None else
-                    tcpdump(fname, args=["-w", "-", flt], getfd=True)
-                ), label) for fname, label in six.iteritems(offline))
+                sniff_sockets.update(
+                    (_open_offline(fname), label)
+                    for fname, label in six.iteritems(offline)
+                )
             else:
                 # Write Scapy Packet objects to a pcap file
                 def _write_to_pcap(packets_list):
@@ -880,10 +1269,7 @@ class AsyncSniffer(object):
                         all(isinstance(elt, Packet) for elt in offline):
                     tempfile_written, offline = _write_to_pcap(offline)
 
-                sniff_sockets[PcapReader(
-                    offline if flt is None else
-                    tcpdump(offline, args=["-w", "-", flt], getfd=True)
-                )] = offline
+                sniff_sockets[_open_offline(offline)] = offline
         if not sniff_sockets or iface is not None:
             if L2socket is None:
                 L2socket = conf.L2listen
@@ -938,9 +1324,10 @@ class AsyncSniffer(object):
             self.stop_cb = stop_cb
 
         try:
+            # Set before the callback, which may stop the sniffer
+            self.continue_sniff = True
             if started_callback:
                 started_callback()
-            self.continue_sniff = True
 
             # Start timeout
             if timeout is not None:
@@ -953,13 +1340,19 @@ class AsyncSniffer(object):
                     if remain <= 0:
                         break
                 sockets, read_func = select_func(sniff_sockets, remain)
-                read_func = read_func or _backup_read_func
                 dead_sockets = []
                 for s in sockets:
                     if s is close_pipe:
                         break
                     try:
-                        p = read_func(s)
+                        if read_func is None and hasattr(s, "recv_many"):
+                            # Receive all the packets available at once
+                            if count > 0:
+                                pkts = s.recv_many(count - session.count, 0)
+                            else:
+                                pkts = s.recv_many(timeout=0)
+                        else:
+                            pkts = [(read_func or _backup_read_func)(s)]
                     except EOFError:
                         # End of stream
                         try:
@@ -984,17 +1377,21 @@ class AsyncSniffer(object):
                         if conf.debug_dissector >= 2:
                             raise
                         continue
-                    if p is None:
-                        continue
-                    if lfilter and not lfilter(p):
-                        continue
-                    p.sniffed_on = sniff_sockets[s]
-                    # on_packet_received handles the prn/storage
-                    session.on_packet_received(p)
-                    # check
-                    if (stop_filter and stop_filter(p)) or \
-                            (0 < count <= session.count):
-                        self.continue_sniff = False
+                    for p in pkts:
+                        if p is None:
+                            continue
+                        if lfilter and not lfilter(p):
+                            continue
+                        p.sniffed_on = sniff_sockets[s]
+                        # on_packet_received handles the prn/storage
+                        session.on_packet_received(p)
+                        # check
+                        if (stop_filter and stop_filter(p)) or \
+                                (0 < count <= session.count):
+                            self.continue_sniff = False
+                        if not self.continue_sniff:
+                            break
+                    if not self.continue_sniff:
                         break
                 # Removed dead sockets
                 for s in dead_sockets:
@@ -1150,3 +1547,343 @@ def tshark(*args, **kargs):
 
     sniff(prn=_cb, store=False, *args, **kargs)
     print("\n%d packet%s captured" % (i[0], 's' if i[0] > 1 else ''))
+
+
+# ASYNCIO METHODS
+
+
+def _get_event_loop(loop=None):
+    if six.PY2:
+        raise Scapy_Exception("asyncio is only available on Python 3")
+    import asyncio
+    return loop or asyncio.get_event_loop()
+
+
+class AioSocket(object):
+    """
+    Adapter of a SuperSocket to asyncio (Python 3.5+).
+
+    The packets are received when the event loop reports the file
+    descriptor of the socket as readable (see loop.add_reader()), and only
+    while something waits for them: they are handed to prn, or to the
+    coroutines awaiting recv() or iterating over the socket.
+
+    Examples:
+      >>> sock = AioSocket(conf.L2listen(iface="eth0"))
+      >>> pkt = await sock.recv()
+      >>> async for pkt in sock:
+      ...     print(pkt.summary())
+
+    :param sock: a SuperSocket, with a fileno() usable by the event loop
+    :param loop: the event loop (default: asyncio.get_event_loop())
+    :param lfilter: Python function applied to each packet to determine if
+        it is kept
+    :param prn: function called with each packet, instead of handing it to
+        the coroutines. The socket is read until stop() is called
+    """
+    def __init__(self, sock, loop=None, lfilter=None, prn=None):
+        self.sock = sock
+        self.loop = _get_event_loop(loop)
+        self.lfilter = lfilter
+        self.prn = prn
+        self.queue = collections.deque()
+        self.waiters = collections.deque()
+        self.reading = False
+        self.running = True
+        self.error = None
+        if prn is not None:
+            self._resume()
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def _resume(self):
+        if self.running and not self.reading:
+            self.loop.add_reader(self.sock.fileno(), self._read)
+            self.reading = True
+
+    def _pause(self):
+        if self.reading:
+            self.loop.remove_reader(self.sock.fileno())
+            self.reading = False
+
+    def _read(self):
+        """Callback of the event loop, when the socket is readable"""
+        try:
+            pkts = self.sock.recv_many(timeout=0)
+        except EOFError:
+            self.stop()
+            return
+        except self.sock.read_allowed_exceptions or (IOError,):
+            return
+        except Exception as ex:
+            warning("Socket %s failed with '%s'." % (self.sock, ex))
+            self.stop(ex)
+            return
+        for p in pkts:
+            if p is None or (self.lfilter and not self.lfilter(p)):
+                continue
+            self._deliver(p)
+            if not self.running:
+                break
+        if self.prn is None and not self.waiters:
+            self._pause()
+
+    def _deliver(self, pkt):
+        """Hands a packet to prn, or to the first coroutine waiting for
+        one, or queues it"""
+        if self.prn is not None:
+            self.prn(pkt)
+            return
+        while self.waiters:
+            fut, _ = self.waiters.popleft()
+            # Skip the cancelled waiters
+            if not fut.done():
+                fut.set_result(pkt)
+                return
+        self.queue.append(pkt)
+
+    def _wait(self, end):
+        fut = self.loop.create_future()
+        if self.queue:
+            fut.set_result(self.queue.popleft())
+        elif not self.running:
+            fut.set_exception(self.error or end())
+        else:
+            self.waiters.append((fut, end))
+            self._resume()
+        return fut
+
+    def recv(self):
+        """Returns a future of the next packet. Once the socket is stopped
+        and the queued packets are consumed, it raises EOFError"""
+        return self._wait(EOFError)
+
+    def __aiter__(self):
+        return self
+
+    def __anext__(self):
+        return self._wait(StopAsyncIteration)
+
+    def send(self, x):
+        return self.sock.send(x)
+
+    def stop(self, error=None):
+        """Stops receiving: the coroutines waiting for a packet get
+        `error`, or the end of the packets"""
+        if not self.running:
+            return
+        self.running = False
+        self.error = error
+        self._pause()
+        while self.waiters:
+            fut, end = self.waiters.popleft()
+            if not fut.done():
+                fut.set_exception(error or end())
+
+    def close(self):
+        self.stop()
+        self.sock.close()
+
+
+class _AioSniffer(AioSocket):
+    """AioSocket that stops after some packets or some time, used by
+    asniff()"""
+    def __init__(self, sock, count=0, stop_filter=None, timeout=None,
+                 close_socket=False, **kwargs):
+        AioSocket.__init__(self, sock, **kwargs)
+        self.count = count
+        self.nbrecv = 0
+        self.stop_filter = stop_filter
+        self.close_socket = close_socket
+        self.timer = None
+        if timeout is not None:
+            self.timer = self.loop.call_later(timeout, self.stop)
+
+    def _deliver(self, pkt):
+        AioSocket._deliver(self, pkt)
+        self.nbrecv += 1
+        if (self.stop_filter and self.stop_filter(pkt)) or \
+                0 < self.count <= self.nbrecv:
+            self.stop()
+
+    def stop(self, error=None):
+        if not self.running:
+            return
+        AioSocket.stop(self, error)
+        if self.timer is not None:
+            self.timer.cancel()
+        if self.close_socket:
+            self.sock.close()
+
+
+@conf.commands.register
+def asniff(count=0, lfilter=None, stop_filter=None, timeout=None,
+           opened_socket=None, iface=None, L2socket=None, loop=None,
+           *arg, **karg):
+    """
+    Sniff packets from a coroutine (Python 3.5+): returns an asynchronous
+    iterator over the packets, read by the event loop (see AioSocket).
+
+    :param count: number of packets to capture. 0 means infinity
+    :param lfilter: Python function applied to each packet to determine if
+        it is kept
+    :param stop_filter: Python function applied to each packet to determine
+        if we have to stop the capture after this packet
+    :param timeout: stop sniffing after a given time (default: None)
+    :param opened_socket: provide a SuperSocket ready to use .recv() on.
+        It is not closed at the end of the capture
+    :param iface: interface to sniff on (default: None for sniffing on all
+        interfaces)
+    :param L2socket: use the provided L2socket (default: use conf.L2listen)
+    :param loop: the event loop (default: asyncio.get_event_loop())
+
+    Example:
+      >>> async for pkt in asniff(iface="eth0", count=10):
+      ...     print(pkt.summary())
+    """
+    if opened_socket is None:
+        if L2socket is None:
+            L2socket = conf.L2listen
+        sock = L2socket(type=ETH_P_ALL, iface=iface, *arg, **karg)
+    else:
+        sock = opened_socket
+    return _AioSniffer(sock, count=count, stop_filter=stop_filter,
+                       timeout=timeout, close_socket=opened_socket is None,
+                       loop=loop, lfilter=lfilter)
+
+
+class AsyncSndRcvHandler(SndRcvHandler):
+    """
+    Util to send/receive packets from an asyncio event loop, used by
+    asr*(). Do not use directly.
+
+    This shares the matching of SndRcvHandler, but the packets are sent
+    one at a time from callbacks of the event loop, and the answers are
+    received by an AioSocket: the other coroutines run meanwhile. The
+    results are set on the `result` future. Cancelling it stops sending
+    and receiving.
+    """
+    def __init__(self, pks, pkt, loop=None, **kwargs):
+        self.loop = _get_event_loop(loop)
+        self.result = self.loop.create_future()
+        self.timer = None
+        self._round = 0
+        SndRcvHandler.__init__(self, pks, pkt, **kwargs)
+
+    def _sndrcv_loop(self, threaded, _flood):
+        self.sniffer = AioSocket(self.rcv_pks, loop=self.loop,
+                                 prn=self._process_packet)
+        self.result.add_done_callback(self._cancel)
+        self._start_round()
+
+    def _start_round(self):
+        self.index = self.index_class(multi=self.multi)
+        self.sending = iter(self.tobesent)
+        self.nbsent = 0
+        if self.verbose:
+            print("Begin emission:")
+        self._send_next(self._round)
+
+    def _send_next(self, rnd):
+        """Sends one packet, then lets the event loop run"""
+        if rnd != self._round:
+            return
+        try:
+            p = next(self.sending)
+            # Populate the index before sending the packet, as in
+            # _sndrcv_snd()
+            self.index.add(p)
+            self.pks.send(p)
+        except StopIteration:
+            p = None
+        except Exception:
+            log_runtime.exception("--- Error sending packets")
+            p = None
+        if p is None:
+            if self.verbose:
+                print("Finished sending %i packets." % self.nbsent)
+            if self.timeout is not None:
+                self.timer = self.loop.call_later(self.timeout,
+                                                  self._end_round, rnd)
+            return
+        self.nbsent += 1
+        if self.inter:
+            self.loop.call_later(self.inter, self._send_next, rnd)
+        else:
+            self.loop.call_soon(self._send_next, rnd)
+
+    def _sndrcv_stop(self):
+        self.loop.call_soon(self._end_round, self._round)
+
+    def _end_round(self, rnd):
+        if rnd != self._round or self.result.done():
+            return
+        self._round += 1
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if self._next_round():
+            self._start_round()
+            return
+        self.sniffer.stop()
+        self._sndrcv_end()
+        self.result.set_result(self.results())
+
+    def _cancel(self, fut):
+        if fut.cancelled():
+            self._round += 1
+            if self.timer is not None:
+                self.timer.cancel()
+            self.sniffer.stop()
+
+
+def asndrcv(pks, pkt, **kwargs):
+    """Asynchronous version of sndrcv(), for Python 3.5+: returns a future
+    of its results. It accepts the same arguments, and the event loop as
+    `loop`.
+    WARNING: This is an internal function. Using asr/asrp is
+    more likely what you want.
+    """
+    return AsyncSndRcvHandler(pks, pkt, **kwargs).result
+
+
+@conf.commands.register
+def asr(x, promisc=None, filter=None, iface=None, nofilter=0, **kargs):
+    """
+    Send and receive packets at layer 3, from a coroutine (Python 3.5+).
+    Returns a future of the answered and unanswered packets
+
+      >>> ans, unans = await asr(IP(dst="192.168.1.0/24") / ICMP(),
+      ...                        timeout=2)
+
+    :param loop: the event loop (default: asyncio.get_event_loop())
+    """
+    s = conf.L3socket(promisc=promisc, filter=filter,
+                      iface=iface, nofilter=nofilter)
+    result = asndrcv(s, x, **kargs)
+    result.add_done_callback(lambda _: s.close())
+    return result
+
+
+@conf.commands.register
+def asrp(x, promisc=None, iface=None, iface_hint=None, filter=None,
+         nofilter=0, type=ETH_P_ALL, **kargs):
+    """
+    Send and receive packets at layer 2, from a coroutine (Python 3.5+).
+    Returns a future of the answered and unanswered packets
+
+    :param loop: the event loop (default: asyncio.get_event_loop())
+    """
+    if iface is None and iface_hint is not None:
+        iface = conf.route.route(iface_hint)[0]
+    s = conf.L2socket(promisc=promisc, iface=iface,
+                      filter=filter, nofilter=nofilter, type=type)
+    result = asndrcv(s, x, **kargs)
+    result.add_done_callback(lambda _: s.close())
+    return result
+
+
+for sr_func in [asr, asrp]:
+    if sr_func.__doc__ is not None:
+        sr_func.__doc__ += _DOC_SNDRCV_PARAMS
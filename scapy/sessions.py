@@ -7,11 +7,15 @@
 Sessions: decode flow of packets when sniffing
 """
 
-from collections import defaultdict
+import bisect
+import collections
+import time
+
 from scapy.compat import raw
 from scapy.config import conf
 from scapy.packet import NoPayload
 from scapy.plist import PacketList
+from scapy.utils import PcapSpool
 
 
 class DefaultSession(object):
@@ -20,8 +24,11 @@ class DefaultSession(object):
     def __init__(self, prn=None, store=False, supersession=None,
                  *args, **karg):
         self.__prn = prn
-        self.__store = store
         self.lst = []
+        if isinstance(store, PcapSpool):
+            # Store the packets in a file
+            self.lst, store = store, True
+        self.__store = store
         self.__count = 0
         self._supersession = supersession
         if self._supersession:
@@ -39,6 +46,8 @@ class DefaultSession(object):
         if self._supersession:
             self._supersession.store = val
         else:
+            if isinstance(val, PcapSpool):
+                self.lst, val = val, True
             self.__store = val
 
     @property
@@ -84,16 +93,130 @@ class DefaultSession(object):
                 print(result)
 
 
+class FlowTable(object):
+    """Table of the states of flows (e.g. the fragments of an IP packet),
+    with eviction.
+
+    The flows are kept in least recently used order. A flow is expired
+    when no packet has been seen for `timeout` seconds, and the least
+    recently used flows are evicted while the table holds more than
+    `max_flows` flows or `max_bytes` bytes. The times are the ones of the
+    packets, so that captures read offline expire as they would live.
+
+    :param factory: function returning the state of a new flow
+    :param timeout: idle timeout of a flow, in seconds (None: never)
+    :param max_flows: maximum number of flows (None: unlimited)
+    :param max_bytes: maximum number of bytes accounted for the flows
+        (None: unlimited)
+    """
+
+    def __init__(self, factory, timeout=None, max_flows=None,
+                 max_bytes=None):
+        self.factory = factory
+        self.timeout = timeout
+        self.max_flows = max_flows
+        self.max_bytes = max_bytes
+        # {key: [state, time of the last packet, bytes]}
+        self.flows = collections.OrderedDict()
+        self.nbytes = 0
+        self.created = 0
+        self.expired = 0
+        self.evicted = 0
+        self.dropped_bytes = 0
+
+    def __len__(self):
+        return len(self.flows)
+
+    def __contains__(self, key):
+        return key in self.flows
+
+    def __getitem__(self, key):
+        return self.flows[key][0]
+
+    def get(self, key, now=None, size=0):
+        """Returns the state of the flow `key`, created if needed, and
+        accounts for a packet of `size` bytes seen at `now`. The other
+        flows are expired or evicted if needed.
+        """
+        if now is None:
+            now = time.time()
+        flow = self.flows.pop(key, None)
+        if flow is None:
+            flow = [self.factory(), now, 0]
+            self.created += 1
+        # Move the flow to the most recently used end
+        self.flows[key] = flow
+        flow[1] = now
+        flow[2] += size
+        self.nbytes += size
+        self._evict(now)
+        return flow[0]
+
+    def _evict(self, now):
+        flows = self.flows
+        # The most recently used flow is kept
+        while len(flows) > 1:
+            key = next(iter(flows))
+            if self.timeout is not None and \
+                    now - flows[key][1] > self.timeout:
+                self.expired += 1
+            elif (self.max_flows is not None and
+                  len(flows) > self.max_flows) or \
+                    (self.max_bytes is not None and
+                     self.nbytes > self.max_bytes):
+                self.evicted += 1
+            else:
+                break
+            self.dropped_bytes += self._remove(key)[2]
+
+    def _remove(self, key):
+        flow = self.flows.pop(key)
+        self.nbytes -= flow[2]
+        return flow
+
+    def pop(self, key):
+        """Removes a complete flow, and returns its state"""
+        return self._remove(key)[0]
+
+    def stats(self):
+        """Returns a dict of the size of the table, and of the counters
+        of the created, expired and evicted flows"""
+        return {
+            "flows": len(self.flows),
+            "bytes": self.nbytes,
+            "created": self.created,
+            "expired": self.expired,
+            "evicted": self.evicted,
+            "dropped_bytes": self.dropped_bytes,
+        }
+
+
 class IPSession(DefaultSession):
     """Defragment IP packets 'on-the-flow'.
 
+    The fragments are stored in a FlowTable, `fragments`. Its limits can
+    be set with the `flow_timeout`, `max_flows` and `max_bytes` keyword
+    arguments (see FlowTable). By default, flows are not expired, so that
+    captures with long gaps can be read offline.
+
     Usage:
     >>> sniff(session=IPSession)
+    >>> sniff(session=IPSession, session_kwargs={"max_flows": 1000})
     """
+    flow_timeout = None
+    max_flows = 65536
+    max_bytes = None
 
     def __init__(self, *args, **kwargs):
+        for attr in ["flow_timeout", "max_flows", "max_bytes"]:
+            if attr in kwargs:
+                setattr(self, attr, kwargs.pop(attr))
         DefaultSession.__init__(self, *args, **kwargs)
-        self.fragments = defaultdict(list)
+        self.fragments = self._flow_table(list)
+
+    def _flow_table(self, factory):
+        return FlowTable(factory, timeout=self.flow_timeout,
+                         max_flows=self.max_flows, max_bytes=self.max_bytes)
 
     def _ip_process_packet(self, packet):
         from scapy.layers.inet import _defrag_list, IP
@@ -103,20 +226,22 @@ class IPSession(DefaultSession):
         packet._defrag_pos = 0
         if ip.frag != 0 or ip.flags.MF:
             uniq = (ip.id, ip.src, ip.dst, ip.proto)
-            self.fragments[uniq].append(packet)
+            fragments = self.fragments.get(uniq, float(packet.time),
+                                           len(packet))
+            fragments.append(packet)
             if not ip.flags.MF:  # end of frag
                 try:
-                    if self.fragments[uniq][0].frag == 0:
+                    if fragments[0].frag == 0:
                         # Has first fragment (otherwise ignore)
                         defrag, missfrag = [], []
-                        _defrag_list(self.fragments[uniq], defrag, missfrag)
+                        _defrag_list(fragments, defrag, missfrag)
                         defragmented_packet = defrag[0]
                         defragmented_packet = defragmented_packet.__class__(
                             raw(defragmented_packet)
                         )
                         return defragmented_packet
                 finally:
-                    del self.fragments[uniq]
+                    self.fragments.pop(uniq)
         else:
             return packet
 
@@ -133,33 +258,78 @@ class StringBuffer(object):
     (relatively to the first sequence number) the index of the data contained
     in the fragment.
 
-    If a TCP fragment is missed, this class will fill the missing space with
-    zeros.
+    The received ranges are kept as a sorted list of disjoint segments, so
+    that the missing ranges (holes) are known: `full()` is only True when
+    there is none, and `ready` is the length of the data received without
+    any hole from the start. When fragments overlap (e.g. retransmissions),
+    the data that was received first is kept.
+
+    The holes are filled with zeros in the content.
     """
     def __init__(self):
         self.content = bytearray(b"")
         self.content_len = 0
-        self.incomplete = []
+        # Start and end offsets of the received segments. Adjacent
+        # segments are merged.
+        self.starts = []
+        self.ends = []
 
     def append(self, data, seq):
-        data_len = len(data)
-        seq = seq - 1
-        if seq + data_len > self.content_len:
-            self.content += b"\x00" * (seq - self.content_len + data_len)
-            # If data was missing, mark it.
-            self.incomplete.append((self.content_len, seq))
-            self.content_len = seq + data_len
-            assert len(self.content) == self.content_len
-        # XXX removes empty space marker.
-        # for ifrag in self.incomplete:
-        #     if [???]:
-        #         self.incomplete.remove([???])
-        memoryview(self.content)[seq:seq + data_len] = data
+        start = seq - 1
+        end = start + len(data)
+        if start >= end:
+            return
+        if start < 0:
+            # Data before the start of the buffer
+            if end <= 0:
+                return
+            data = data[-start:]
+            start = 0
+        if end > self.content_len:
+            self.content += b"\x00" * (end - self.content_len)
+            self.content_len = end
+        # Segments overlapping (or adjacent to) [start, end)
+        i = bisect.bisect_left(self.ends, start)
+        j = bisect.bisect_right(self.starts, end)
+        # Only write the ranges that weren't received yet
+        content = memoryview(self.content)
+        pos = start
+        for k in range(i, j):
+            if self.starts[k] > pos:
+                content[pos:self.starts[k]] = data[pos - start:
+                                                   self.starts[k] - start]
+            pos = max(pos, self.ends[k])
+        if pos < end:
+            content[pos:end] = data[pos - start:]
+        # Merge the segments
+        if i < j:
+            start = min(start, self.starts[i])
+            end = max(end, self.ends[j - 1])
+        self.starts[i:j] = [start]
+        self.ends[i:j] = [end]
+
+    @property
+    def ready(self):
+        """Length of the data received without any hole from the start"""
+        if self.starts and self.starts[0] == 0:
+            return self.ends[0]
+        return 0
+
+    @property
+    def incomplete(self):
+        """List of the missing ranges, as (start, end) tuples"""
+        holes = list(zip(self.ends[:-1], self.starts[1:]))
+        if self.starts and self.starts[0] > 0:
+            holes.insert(0, (0, self.starts[0]))
+        return holes
+
+    def contiguous(self):
+        """Returns the data received without any hole from the start"""
+        return memoryview(self.content)[:self.ready].tobytes()
 
     def full(self):
-        # Should only be true when all missing data was filled up,
-        # (or there never was missing data)
-        return True  # XXX
+        """Returns True when no data is missing"""
+        return self.ready == self.content_len
 
     def clear(self):
         self.__init__()
@@ -194,7 +364,23 @@ class TCPSession(IPSession):
             # as you need additional data.
             return None
 
+    `tcp_reassemble` is only called when new data was received right
+    after the previous one: the data following a missing TCP fragment is
+    kept until the fragment is received. `data` never contains holes.
+
+    To avoid being called on each fragment, `tcp_reassemble` can store in
+    metadata["tcp_need"] the length of the data it needs: it won't be called
+    again before this length is reached, or before the end of the stream
+    (a segment with the FIN or RST flag), which sets metadata["tcp_end"].
+    A FIN or RST segment without data triggers the reassembly of the data
+    received so far.
+
     A (hard to understand) example can be found in scapy/layers/http.py
+
+    The streams are stored in a FlowTable, `tcp_frags`, with the same
+    limits as the IP fragments (see IPSession). They are matched by their
+    addresses and ports, or by `fmt` (formatted with sprintf()) when a
+    subclass changes it.
     """
 
     fmt = ('TCP {IP:%IP.src%}{IPv6:%IPv6.src%}:%r,TCP.sport% > ' +
@@ -204,10 +390,27 @@ class TCPSession(IPSession):
         super(TCPSession, self).__init__(*args, **kwargs)
         # The StringBuffer() is used to build a global
         # string from fragments and their seq nulber
-        self.tcp_frags = defaultdict(
+        self.tcp_frags = self._flow_table(
             lambda: (StringBuffer(), {})
         )
 
+    def _flow_key(self, pkt):
+        """Returns the key of the TCP stream of `pkt`, as a tuple
+        (src, sport, dst, dport), or as formatted by `fmt` if it was
+        changed"""
+        if self.fmt is not TCPSession.fmt:
+            return pkt.sprintf(self.fmt)
+        from scapy.layers.inet import IP, TCP
+        tcp = pkt[TCP]
+        ip = tcp.underlayer
+        if not isinstance(ip, IP):
+            from scapy.layers.inet6 import IPv6
+            # IPv6, possibly with extension headers
+            ip = pkt.getlayer(IP) or pkt.getlayer(IPv6)
+            if ip is None:
+                return (None, tcp.sport, None, tcp.dport)
+        return (ip.src, tcp.sport, ip.dst, tcp.dport)
+
     def _process_packet(self, pkt):
         """Process each packet: matches the TCP seq/ack numbers
         to follow the TCP streams, and orders the fragments.
@@ -215,45 +418,63 @@ class TCPSession(IPSession):
         from scapy.layers.inet import IP, TCP
         if TCP not in pkt:
             return pkt
-        pay = pkt[TCP].payload
+        tcp = pkt[TCP]
+        pay = tcp.payload
+        # Check TCP FIN or TCP RESET: they end the stream, unlike the PSH
+        # flag. The end is kept, as it may be received before the last
+        # data of the stream.
+        end = bool(tcp.flags.F or tcp.flags.R)
         if isinstance(pay, (NoPayload, conf.padding_layer)):
-            return pkt
-        new_data = raw(pay)
-        # Match packets by a uniqute TCP identifier
-        seq = pkt[TCP].seq
-        ident = pkt.sprintf(self.fmt)
-        data, metadata = self.tcp_frags[ident]
-        # Let's guess which class is going to be used
-        if "pay_class" not in metadata:
-            pay_class = pay.__class__
-            if not hasattr(pay_class, "tcp_reassemble"):
-                # Cannot tcp-reassemble
+            if not end:
                 return pkt
-            metadata["pay_class"] = pay_class
-        else:
+            # Reassemble the data received so far, if any
+            ident = self._flow_key(pkt)
+            if ident not in self.tcp_frags:
+                return pkt
+            data, metadata = self.tcp_frags.get(ident, float(pkt.time))
             pay_class = metadata["pay_class"]
-        # Get a relative sequence number for a storage purpose
-        relative_seq = metadata.get("relative_seq", None)
-        if not relative_seq:
-            relative_seq = metadata["relative_seq"] = seq - 1
-        seq = seq - relative_seq
-        # Add the data to the buffer
-        # Note that this take care of retransmission packets.
-        data.append(new_data, seq)
-        # Check TCP FIN or TCP RESET
-        if pkt[TCP].flags.F or pkt[TCP].flags.R or pkt[TCP].flags.P:
+            ready = 0
+        else:
+            new_data = raw(pay)
+            # Match packets by a uniqute TCP identifier
+            seq = tcp.seq
+            ident = self._flow_key(pkt)
+            data, metadata = self.tcp_frags.get(ident, float(pkt.time),
+                                                len(new_data))
+            # Let's guess which class is going to be used
+            if "pay_class" not in metadata:
+                pay_class = pay.__class__
+                if not hasattr(pay_class, "tcp_reassemble"):
+                    # Cannot tcp-reassemble
+                    self.tcp_frags.pop(ident)
+                    return pkt
+                metadata["pay_class"] = pay_class
+            else:
+                pay_class = metadata["pay_class"]
+            # Get a relative sequence number for a storage purpose
+            relative_seq = metadata.get("relative_seq", None)
+            if not relative_seq:
+                relative_seq = metadata["relative_seq"] = seq - 1
+            seq = seq - relative_seq
+            # Add the data to the buffer
+            # Note that this take care of retransmission packets.
+            ready = data.ready
+            data.append(new_data, seq)
+        if end:
             metadata["tcp_end"] = True
-        # XXX TODO: check that no empty space is missing in the buffer.
-        # XXX Currently, if a TCP fragment was missing, we won't notice it.
         packet = None
-        if data.full():
+        # Only reassemble when new data follows the previous one without
+        # any hole, and when the payload class may use it.
+        if data.ready > ready and (
+                metadata.get("tcp_end") or
+                data.ready >= metadata.get("tcp_need", 0)):
             # Reassemble using all previous packets
-            packet = pay_class.tcp_reassemble(bytes(data), metadata)
+            packet = pay_class.tcp_reassemble(data.contiguous(), metadata)
         # Stack the result on top of the previous frames
         if packet:
             data.clear()
-            del self.tcp_frags[ident]
-            pay.underlayer.remove_payload()
+            self.tcp_frags.pop(ident)
+            tcp.remove_payload()
             if IP in pkt:
                 pkt[IP].len = None
                 pkt[IP].chksum = None
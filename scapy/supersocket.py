@@ -23,7 +23,7 @@ from scapy.compat import raw, bytes_encode
 from scapy.error import warning, log_runtime
 import scapy.modules.six as six
 import scapy.packet
-from scapy.utils import PcapReader, tcpdump
+from scapy.utils import PcapReader, TokenBucket, tcpdump
 
 
 # Utils
@@ -76,22 +76,38 @@ class SuperSocket(six.with_metaclass(_SuperSocket_metaclass)):
             pass
         return self.outs.send(sx)
 
+    def send_many(self, x, pps=None, mbps=None):
+        """Sends many packets, optionally paced.
+
+        :param x: an iterable of packets
+        :param pps: the maximum rate in packets per second
+        :param mbps: the maximum rate in megabits per second
+        :returns: the number of packets sent
+        """
+        bucket = TokenBucket(pps, mbps)
+        n = 0
+        for p in x:
+            bucket.wait(1, len(p) if mbps else 0)
+            self.send(p)
+            n += 1
+        return n
+
     if six.PY2:
-        def _recv_raw(self, sock, x):
+        def _recv_raw(self, sock, x, flags=0):
             """Internal function to receive a Packet"""
-            pkt, sa_ll = sock.recvfrom(x)
+            pkt, sa_ll = sock.recvfrom(x, flags)
             return pkt, sa_ll, None
     else:
-        def _recv_raw(self, sock, x):
+        def _recv_raw(self, sock, x, flags=0):
             """Internal function to receive a Packet,
             and process ancillary data.
             """
             timestamp = None
             if not self.auxdata_available:
-                pkt, _, _, sa_ll = sock.recvmsg(x)
+                pkt, _, _, sa_ll = sock.recvmsg(x, 0, flags)
                 return pkt, sa_ll, timestamp
             flags_len = socket.CMSG_LEN(4096)
-            pkt, ancdata, flags, sa_ll = sock.recvmsg(x, flags_len)
+            pkt, ancdata, flags, sa_ll = sock.recvmsg(x, flags_len, flags)
             if not pkt:
                 return pkt, sa_ll, timestamp
             for cmsg_lvl, cmsg_type, cmsg_data in ancdata:
@@ -133,7 +149,10 @@ class SuperSocket(six.with_metaclass(_SuperSocket_metaclass)):
         return conf.raw_layer, self.ins.recv(x), None
 
     def recv(self, x=MTU):
-        cls, val, ts = self.recv_raw(x)
+        return self._dissect(*self.recv_raw(x))
+
+    def _dissect(self, cls, val, ts):
+        """Returns the packet dissected from the output of recv_raw()"""
         if not val or not cls:
             return
         try:
@@ -150,6 +169,51 @@ class SuperSocket(six.with_metaclass(_SuperSocket_metaclass)):
             pkt.time = ts
         return pkt
 
+    def recv_many(self, max_count=64, timeout=None):
+        """Receives the packets available on the socket.
+
+        :param max_count: the maximum number of packets to return
+        :param timeout: the maximum time to wait for a first packet (None:
+            wait forever)
+        :returns: a list of packets, empty if the timeout expired
+        """
+        pkts = []
+        sockets, read_func = self.select([self], timeout)
+        read_func = read_func or self.__class__.recv
+        while sockets:
+            try:
+                p = read_func(self)
+            except (EOFError,) + tuple(self.read_allowed_exceptions):
+                # Return the packets received so far: the next call raises
+                if pkts:
+                    break
+                raise
+            if p is None:
+                break
+            pkts.append(p)
+            if len(pkts) >= max_count:
+                break
+            sockets, read_func = self.select([self], 0)
+            read_func = read_func or self.__class__.recv
+        return pkts
+
+    def _recv_many_nonblock(self, max_count, timeout):
+        """Implements recv_many() for the sockets whose recv() accepts the
+        flags of recvmsg(): drains the socket with MSG_DONTWAIT"""
+        pkts = []
+        if not select([self.ins], [], [], timeout)[0]:
+            return pkts
+        while len(pkts) < max_count:
+            try:
+                p = self.recv(MTU, socket.MSG_DONTWAIT)
+            except socket.error as ex:
+                if ex.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    raise
+                break
+            if p is not None:
+                pkts.append(p)
+        return pkts
+
     def fileno(self):
         return self.ins.fileno()
 
@@ -239,8 +303,8 @@ class L3RawSocket(SuperSocket):
                 msg = "Your Linux Kernel does not support Auxiliary Data!"
                 log_runtime.info(msg)
 
-    def recv(self, x=MTU):
-        pkt, sa_ll, ts = self._recv_raw(self.ins, x)
+    def recv(self, x=MTU, flags=0):
+        pkt, sa_ll, ts = self._recv_raw(self.ins, x, flags)
         if sa_ll[2] == socket.PACKET_OUTGOING:
             return None
         if sa_ll[3] in conf.l2types:
@@ -272,6 +336,9 @@ class L3RawSocket(SuperSocket):
             pkt.time = ts
         return pkt
 
+    def recv_many(self, max_count=64, timeout=None):
+        return self._recv_many_nonblock(max_count, timeout)
+
     def send(self, x):
         try:
             sx = raw(x)
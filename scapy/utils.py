@@ -21,6 +21,10 @@ import gzip
 import re
 import struct
 import array
+import bisect
+import mmap
+import multiprocessing
+import numbers
 import subprocess
 import tempfile
 import threading
@@ -34,7 +38,10 @@ from scapy.data import MTU, DLT_EN10MB
 from scapy.compat import orb, raw, plain_str, chb, bytes_base64,\
     base64_bytes, hex_bytes, lambda_tuple_converter, bytes_encode
 from scapy.error import log_runtime, Scapy_Exception, warning
+from scapy.extlib import NUMPY, numpy
 from scapy.pton_ntop import inet_pton
+from scapy.checksum import checksum, checksum_update  # noqa: F401
+from scapy.bpf import BPFFilter
 
 ###########
 #  Tools  #
@@ -396,16 +403,6 @@ else:
     checksum_endian_transform = lambda chk: ((chk >> 8) & 0xff) | chk << 8
 
 
-def checksum(pkt):
-    if len(pkt) % 2 == 1:
-        pkt += b"\0"
-    s = sum(array.array("H", pkt))
-    s = (s >> 16) + (s & 0xffff)
-    s += s >> 16
-    s = ~s
-    return checksum_endian_transform(s) & 0xffff
-
-
 def _fletcher16(charbuf):
     # This is based on the GPLed C implementation in Zebra <http://www.zebra.org/>  # noqa: E501
     c0 = c1 = 0
@@ -923,7 +920,7 @@ def wrpcap(filename, pkt, *args, **kargs):
     :param sync: do not bufferize writes to the capture file
     """
     with PcapWriter(filename, *args, **kargs) as fdesc:
-        fdesc.write(pkt)
+        fdesc.write_many(pkt)
 
 
 @conf.commands.register
@@ -936,6 +933,25 @@ def rdpcap(filename, count=-1):
         return fdesc.read_all(count=count)
 
 
+@conf.commands.register
+def rdcolumns(filename, layers, fields, count=-1, as_numpy=None):
+    """Read some fields of the packets of a pcap or pcapng file, as columns
+
+    See RawPcapReader.read_columns().
+
+    >>> rdcolumns("capture.pcap", [Ether, IP, TCP],
+    ...           [IP.src, IP.dst, TCP.dport, "len"])
+
+    :param layers: the list of layers the packets must hold
+    :param fields: the fields to read
+    :param count: read only <count> packets
+    :param as_numpy: return NumPy arrays (default: if NumPy is available)
+    """
+    with RawPcapReader(filename) as fdesc:
+        return fdesc.read_columns(layers, fields, count=count,
+                                  as_numpy=as_numpy)
+
+
 class PcapReader_metaclass(type):
     """Metaclass for (Raw)Pcap(Ng)Readers"""
 
@@ -949,10 +965,12 @@ class PcapReader_metaclass(type):
             dct['alternative'].alternative = newcls
         return newcls
 
-    def __call__(cls, filename):
+    def __call__(cls, filename, filter=None):
         """Creates a cls instance, use the `alternative` if that
         fails.
 
+        :param filter: a BPF filter (as a string or a BPFFilter): the
+            packets that do not match it are skipped before being dissected
         """
         i = cls.__new__(cls, cls.__name__, cls.__bases__, cls.__dict__)
         filename, fdesc, magic = cls.open(filename)
@@ -971,6 +989,13 @@ class PcapReader_metaclass(type):
                         pass
                     raise Scapy_Exception("Not a supported capture file")
 
+        if filter is not None:
+            if not isinstance(filter, BPFFilter):
+                filter = BPFFilter(filter)
+            if getattr(i, "linktype", None) is not None:
+                # Report the unsupported link types now
+                filter.compile(i.linktype)
+            i.bpf = filter
         return i
 
     @staticmethod
@@ -997,6 +1022,8 @@ class RawPcapReader(six.with_metaclass(PcapReader_metaclass)):
     nonblocking_socket = True
     PacketMetadata = collections.namedtuple("PacketMetadata",
                                             ["sec", "usec", "wirelen", "caplen"])  # noqa: E501
+    # The BPFFilter the packets must match
+    bpf = None
 
     def __init__(self, filename, fdesc, magic):
         self.filename = filename
@@ -1046,11 +1073,17 @@ class RawPcapReader(six.with_metaclass(PcapReader_metaclass)):
 
         raise EOFError when no more packets are available
         """
-        hdr = self.f.read(16)
-        if len(hdr) < 16:
-            raise EOFError
-        sec, usec, caplen, wirelen = struct.unpack(self.endian + "IIII", hdr)
-        return (self.f.read(caplen)[:size],
+        while True:
+            hdr = self.f.read(16)
+            if len(hdr) < 16:
+                raise EOFError
+            sec, usec, caplen, wirelen = struct.unpack(self.endian + "IIII",
+                                                       hdr)
+            s = self.f.read(caplen)
+            if self.bpf is None or \
+                    self.bpf.match(s, self.linktype, wirelen):
+                break
+        return (s[:size],
                 RawPcapReader.PacketMetadata(sec=sec, usec=usec,
                                              wirelen=wirelen, caplen=caplen))
 
@@ -1077,6 +1110,60 @@ class RawPcapReader(six.with_metaclass(PcapReader_metaclass)):
             res.append(p)
         return res
 
+    def _read_raw_packet(self, size=MTU):
+        """Returns the next packet of the file as a tuple (pkt_data,
+        linktype, time, wirelen)"""
+        s, pkt_info = RawPcapReader.read_packet(self, size=size)
+        power = 1e-9 if self.nano else 1e-6
+        return (s, self.linktype, pkt_info.sec + power * pkt_info.usec,
+                pkt_info.wirelen)
+
+    def read_columns(self, layers, fields, count=-1, as_numpy=None):
+        """Read some fields of the packets of the file, as columns
+
+        The packets that hold all the `layers` give a row each. They are
+        dissected along `layers` without building Packet objects, and only
+        the packets that do not follow this layout are fully dissected.
+
+        >>> with RawPcapReader("capture.pcap") as fdesc:
+        ...     cols = fdesc.read_columns([Ether, IP, TCP],
+        ...                               [IP.src, "TCP.dport", "len"])
+        >>> cols["TCP.dport"]
+        array('q', [80, 443])
+
+        :param layers: the list of layers the packets must hold. The
+            link-layer is prepended when missing.
+        :param fields: the fields to read: field objects (IP.src),
+            "layer.field" strings or (layer, field name) tuples, and the
+            packet "time", "len" (wire length) and "caplen"
+        :param count: read only <count> packets
+        :param as_numpy: return NumPy arrays (default: if NumPy is
+            available), instead of array.array (or lists)
+        :return: a dict mapping "layer.field" (or "time", "len" and
+            "caplen") to the column of values
+        """
+        extractor = _ColumnsExtractor(layers, fields)
+        if as_numpy is None:
+            as_numpy = bool(NUMPY)
+        elif as_numpy and not NUMPY:
+            raise ImportError("NumPy is not available")
+        columns = [[] for _ in extractor.names]
+        while count != 0:
+            count -= 1
+            try:
+                s, linktype, pkt_time, wirelen = self._read_raw_packet()
+            except EOFError:
+                break
+            row = extractor.extract(s, linktype, pkt_time, wirelen)
+            if row is None:
+                continue
+            for column, val in zip(columns, row):
+                column.append(val)
+        return dict(
+            (name, extractor.to_column(column, as_numpy))
+            for name, column in zip(extractor.names, columns)
+        )
+
     def recv(self, size=MTU):
         """ Emulate a socket
         """
@@ -1213,9 +1300,22 @@ class RawPcapNgReader(RawPcapReader):
                 raise EOFError
             res = self.blocktypes.get(blocktype,
                                       lambda block, size: None)(block, size)
-            if res is not None:
+            if res is not None and (
+                    self.bpf is None or
+                    self.bpf.match(res[0], res[1].linktype, res[1].wirelen)):
                 return res
 
+    def _read_raw_packet(self, size=MTU):
+        rp = RawPcapNgReader.read_packet(self, size=size)
+        if rp is None:
+            raise EOFError
+        s, (linktype, tsresol, tshigh, tslow, wirelen) = rp
+        if tshigh is None:
+            pkt_time = None
+        else:
+            pkt_time = float((tshigh << 32) + tslow) / tsresol
+        return s, linktype, pkt_time, wirelen
+
     def read_options(self, options):
         """Section Header Block"""
         opts = self.default_options.copy()
@@ -1320,11 +1420,616 @@ class PcapNgReader(RawPcapNgReader):
         return self.read_packet()
 
 
+class _ColumnsExtractor(object):
+    """Extract the values of some fields of raw packets, for
+    RawPcapReader.read_columns().
+
+    The layers are dissected one after the other, reusing one instance of
+    each layer: as long as the packets follow the layer stack, no Packet
+    object is built. The others are fully dissected.
+    """
+    META_FIELDS = ["time", "len", "caplen"]
+
+    def __init__(self, layers, fields):
+        self.layers = list(layers)
+        if not self.layers:
+            raise Scapy_Exception("No layer provided")
+        self.specs = [self._resolve(fld) for fld in fields]
+        self.names = [name if cls is None else "%s.%s" % (cls.__name__, name)
+                      for cls, name in self.specs]
+        self.stacks = {}
+
+    def _resolve(self, fld):
+        """Returns (layer, field name) for a field given as a field
+        object of a layer (e.g. IP.src), a "layer.field" string (e.g.
+        "IP.src") or a (layer, field name) tuple. The layer is None for
+        the META_FIELDS."""
+        if isinstance(fld, tuple):
+            cls, name = fld
+        elif isinstance(fld, six.string_types):
+            if fld in self.META_FIELDS:
+                return None, fld
+            layer, _, name = fld.partition(".")
+            cls = next((c for c in self.layers if c.__name__ == layer), None)
+        else:
+            cls, name = next(((c, f.name) for c in self.layers
+                              for f in c.fields_desc if f is fld),
+                             (None, None))
+        if cls not in self.layers or \
+           name not in [f.name for f in cls.fields_desc]:
+            raise Scapy_Exception("Unknown field %r in layers %s" % (
+                fld, "/".join(c.__name__ for c in self.layers)
+            ))
+        return cls, name
+
+    def _stack(self, linktype):
+        """Returns the link-layer class, the layer instances used to
+        dissect the packets and the index of the layer of each field, for
+        a link type"""
+        try:
+            return self.stacks[linktype]
+        except KeyError:
+            pass
+        llcls = conf.l2types.get(linktype, conf.raw_layer)
+        layers = self.layers
+        if layers[0] is not llcls:
+            layers = [llcls] + layers
+        try:
+            protos = [cls() for cls in layers]
+        except Exception:
+            protos = None
+        index = [None if cls is None else layers.index(cls)
+                 for cls, _ in self.specs]
+        self.stacks[linktype] = (llcls, protos, index,
+                                 self._last_runs(layers, index))
+        return self.stacks[linktype]
+
+    def _last_runs(self, layers, index):
+        """Returns the fixed-size fields runs that are enough to get the
+        fields of the last layer, or None if it has to be fully dissected
+        """
+        from scapy.packet import Packet
+        cls = layers[-1]
+        _u = six.get_unbound_function
+        if any(_u(getattr(cls, meth)) is not _u(getattr(Packet, meth))
+               for meth in ["pre_dissect", "do_dissect", "post_dissect"]):
+            return None
+        needed = [[f.name for f in cls.fields_desc].index(name)
+                  for (_, name), i in zip(self.specs, index)
+                  if i == len(layers) - 1]
+        if len(cls.fields_desc) != cls._fixed_runs_size:
+            # fields_desc was changed in place
+            cls._compile_fixed_runs()
+        runs = []
+        start = 0
+        while needed and start <= max(needed):
+            run = cls._fixed_runs.get(start)
+            if run is None:
+                return None
+            runs.append(run)
+            start = run.stop
+        return runs
+
+    @staticmethod
+    def _dissect(protos, s, last_runs):
+        """Dissect `s` with the layer instances `protos`. Returns False if
+        the packet does not follow them."""
+        lower = None
+        for i, proto in enumerate(protos):
+            proto.fields = {}
+            proto.underlayer = lower
+            if i == len(protos) - 1 and last_runs is not None:
+                # Only dissect the fields that are needed
+                proto.raw_packet_cache_fields = {}
+                off = 0
+                for run in last_runs:
+                    if len(s) < off + run.sz:
+                        return False
+                    run.dissect(proto, s, off)
+                    off += run.sz
+                return True
+            s = proto.pre_dissect(s)
+            s = proto.do_dissect(s)
+            s = proto.post_dissect(s)
+            if i == len(protos) - 1:
+                return True
+            s, _ = proto.extract_padding(s)
+            if not s or \
+               proto.guess_payload_class(s) is not protos[i + 1].__class__:
+                return False
+            lower = proto
+
+    def extract(self, s, linktype, pkt_time, wirelen):
+        """Returns the values of the fields for the packet `s`, or None if
+        it does not hold all the layers"""
+        llcls, protos, index, last_runs = self._stack(linktype)
+        meta = {"time": pkt_time,
+                "len": len(s) if wirelen is None else wirelen,
+                "caplen": len(s)}
+        try:
+            if protos is not None and self._dissect(protos, s, last_runs):
+                row = []
+                for (cls, name), i in zip(self.specs, index):
+                    if cls is None:
+                        row.append(meta[name])
+                    else:
+                        row.append(protos[i].fields[name])
+                return row
+        except Exception:
+            # e.g. a truncated packet (KeyError), handled below
+            pass
+        try:
+            pkt = llcls(s)
+        except KeyboardInterrupt:
+            raise
+        except Exception:
+            if conf.debug_dissector:
+                raise
+            return None
+        if not all(cls in pkt for cls in self.layers):
+            return None
+        return [meta[name] if cls is None else pkt[cls].getfieldval(name)
+                for cls, name in self.specs]
+
+    @staticmethod
+    def to_column(values, as_numpy):
+        """Convert a list of values to a NumPy array or an array.array
+        (a list for values that are not all integers or floats)"""
+        from scapy.fields import FlagValue
+        values = [int(v) if isinstance(v, FlagValue) else v for v in values]
+        if as_numpy:
+            return numpy.array(values)
+        if all(isinstance(v, six.integer_types) for v in values):
+            # "q" and "Q" do not exist on Python 2
+            signed, unsigned = ("q", "Q") if six.PY3 else ("l", "L")
+            bits = array.array(signed).itemsize * 8
+            if all(-2**(bits - 1) <= v < 2**(bits - 1) for v in values):
+                return array.array(signed, values)
+            if all(0 <= v < 2**bits for v in values):
+                return array.array(unsigned, values)
+        elif all(isinstance(v, float) for v in values):
+            return array.array("d", values)
+        return values
+
+
+class RawMmapPcapReader(object):
+    """A pcap or pcapng reader with random access to the packets.
+
+    The file is memory-mapped and indexed when opened. The reader supports
+    len(), reader[i], slicing, iteration, and time-range seeks with
+    index_at() and between(). Each packet is returned as with
+    RawPcapReader.read_packet(), as a tuple (pkt_data, pkt_metadata).
+
+    >>> with RawMmapPcapReader("big.pcap", index_file=True) as fdesc:
+    ...     pkts = fdesc[5000000:5100000]
+
+    :param filename: the name of the capture file, or an open file object.
+        Compressed captures cannot be mapped.
+    :param index_file: if True, the index is saved to `filename` + ".idx",
+        and reloaded from there as long as the capture is not modified. A
+        path can also be provided.
+    :param index: the `index` of another reader of the same file, to use
+        instead of indexing it again
+    """
+    reader_class = RawPcapReader
+    _index_header = struct.Struct("<8sQdQQ")
+    _index_magic = b"SCAPYIX" + (b"<" if sys.byteorder == "little" else b">")
+    # "Q" does not exist on Python 2
+    _offset_typecode = "Q" if six.PY3 else "L"
+
+    def __init__(self, filename, index_file=None, index=None):
+        self.reader = self.reader_class(filename)
+        self.filename = self.reader.filename
+        self.fdesc = self.reader.f
+        if isinstance(self.fdesc, gzip.GzipFile):
+            self.fdesc.close()
+            raise Scapy_Exception("Cannot map a compressed capture file")
+        try:
+            self.mm = mmap.mmap(self.fdesc.fileno(), 0,
+                                access=mmap.ACCESS_READ)
+        except (AttributeError, EnvironmentError, ValueError):
+            self.fdesc.close()
+            raise Scapy_Exception("Cannot map %s" % self.filename)
+        self.reader.f = self.mm
+        self.ng = isinstance(self.reader, RawPcapNgReader)
+        if index_file is True:
+            index_file = "%s.idx" % self.filename
+        if index is not None:
+            self.offsets, self.times, self.idbs = index
+            for off in self.idbs:
+                self._read_block(off)
+        elif index_file is None or not self._load_index(index_file):
+            self._build_index()
+            if index_file is not None:
+                self._save_index(index_file)
+        self.sorted = all(self.times[i] <= self.times[i + 1]
+                          for i in range(len(self.times) - 1))
+
+    def _build_index(self):
+        """Find the offsets and times of the packets (and the offsets of
+        the Interface Description Blocks of a pcapng file)"""
+        self.offsets = array.array(self._offset_typecode)
+        self.times = array.array("d")
+        self.idbs = array.array(self._offset_typecode)
+        mm = self.mm
+        if not self.ng:
+            hdr = struct.Struct(self.reader.endian + "IIII")
+            power = 1e-9 if self.reader.nano else 1e-6
+            off = 24
+            while off + 16 <= len(mm):
+                sec, usec, caplen, _ = hdr.unpack_from(mm, off)
+                self.offsets.append(off)
+                self.times.append(sec + power * usec)
+                off += 16 + caplen
+            return
+        hdr = struct.Struct(self.reader.endian + "2I")
+        off = 0
+        while off + 12 <= len(mm):
+            blocktype, blocklen = hdr.unpack_from(mm, off)
+            if blocklen < 12:
+                warning("PcapNg: invalid block length %d, stopping the "
+                        "index at offset %d" % (blocklen, off))
+                break
+            if blocktype == 1:
+                self.idbs.append(off)
+                self._read_block(off)
+            elif blocktype in (2, 6):
+                # Packet Block and Enhanced Packet Block
+                fmt = "HxxII" if blocktype == 2 else "III"
+                intid, tshigh, tslow = struct.unpack_from(
+                    self.reader.endian + fmt, mm, off + 8
+                )
+                self.offsets.append(off)
+                self.times.append(float((tshigh << 32) + tslow) /
+                                  self.reader.interfaces[intid][2])
+            elif blocktype == 3:
+                # Simple Packet Block, without timestamp
+                self.offsets.append(off)
+                self.times.append(float("nan"))
+            off += blocklen + (-blocklen % 4)
+
+    @property
+    def index(self):
+        """The offsets and times of the packets, and the offsets of the
+        Interface Description Blocks of a pcapng file"""
+        return self.offsets, self.times, self.idbs
+
+    def _read_block(self, off):
+        """Process the pcapng block at `off`"""
+        blocktype, blocklen = struct.unpack_from(self.reader.endian + "2I",
+                                                 self.mm, off)
+        return self.reader.blocktypes[blocktype](
+            self.mm[off + 8:off + blocklen - 4], MTU
+        )
+
+    def _index_stat(self):
+        stat = os.stat(self.filename)
+        return stat.st_size, stat.st_mtime
+
+    def _load_index(self, index_file):
+        """Load the index from `index_file`. Returns False if it is
+        missing or outdated."""
+        try:
+            with open(index_file, "rb") as fdesc:
+                magic, size, mtime, nidbs, count = self._index_header.unpack(
+                    fdesc.read(self._index_header.size)
+                )
+                if magic != self._index_magic or \
+                   (size, mtime) != self._index_stat():
+                    return False
+                self.idbs = array.array(self._offset_typecode)
+                self.idbs.fromfile(fdesc, nidbs)
+                self.offsets = array.array(self._offset_typecode)
+                self.offsets.fromfile(fdesc, count)
+                self.times = array.array("d")
+                self.times.fromfile(fdesc, count)
+        except (EnvironmentError, EOFError, struct.error):
+            return False
+        for off in self.idbs:
+            self._read_block(off)
+        return True
+
+    def _save_index(self, index_file):
+        try:
+            with open(index_file, "wb") as fdesc:
+                fdesc.write(self._index_header.pack(
+                    self._index_magic, *(self._index_stat() +
+                                         (len(self.idbs), len(self.offsets)))
+                ))
+                self.idbs.tofile(fdesc)
+                self.offsets.tofile(fdesc)
+                self.times.tofile(fdesc)
+        except EnvironmentError as e:
+            warning("Cannot save the index to %s: %s" % (index_file, e))
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return [self._read_at(self.offsets[i])
+                    for i in range(*item.indices(len(self)))]
+        if item < 0:
+            item += len(self)
+        if not 0 <= item < len(self):
+            raise IndexError("packet index out of range")
+        return self._read_at(self.offsets[item])
+
+    def _read_at(self, off):
+        self.mm.seek(off)
+        return self.reader.read_packet()
+
+    def __iter__(self):
+        for off in self.offsets:
+            yield self._read_at(off)
+
+    def index_at(self, t):
+        """Returns the index of the first packet captured at or after `t`
+        (in seconds since the epoch)"""
+        if self.sorted:
+            return bisect.bisect_left(self.times, t)
+        return next((i for i, pkt_time in enumerate(self.times)
+                     if pkt_time >= t), len(self))
+
+    def between(self, start, stop):
+        """Returns the packets captured from `start` (included) to `stop`
+        (excluded), in seconds since the epoch"""
+        if self.sorted:
+            return self[self.index_at(start):self.index_at(stop)]
+        return [self._read_at(off)
+                for off, pkt_time in zip(self.offsets, self.times)
+                if start <= pkt_time < stop]
+
+    def select(self, filter, as_numpy=None, batch=4096):
+        """Returns the indexes of the packets that match a BPF filter.
+
+        The filter runs on the raw packets of the mapped file, before any
+        dissection. With NumPy, it runs on batches of packets at once.
+
+        >>> with MmapPcapReader("big.pcap") as fdesc:
+        ...     pkts = [fdesc[i] for i in fdesc.select("tcp port 80")]
+
+        :param filter: a BPF filter, as a string or a BPFFilter
+        :param as_numpy: use NumPy (default: if NumPy is available)
+        :param batch: the number of packets filtered at once
+        """
+        if not isinstance(filter, BPFFilter):
+            filter = BPFFilter(filter)
+        if as_numpy is None:
+            as_numpy = bool(NUMPY)
+        elif as_numpy and not NUMPY:
+            raise ImportError("NumPy is not available")
+        hdr = struct.Struct(self.reader.endian + "8xII")
+        res = []
+        for start in range(0, len(self), batch):
+            # {linktype: ([index], [pkt_data], [wirelen])}
+            packets = collections.defaultdict(lambda: ([], [], []))
+            for i in range(start, min(start + batch, len(self))):
+                off = self.offsets[i]
+                if self.ng:
+                    s, pkt_info = self._read_at(off)
+                    linktype, wirelen = pkt_info.linktype, pkt_info.wirelen
+                else:
+                    caplen, wirelen = hdr.unpack_from(self.mm, off)
+                    s = self.mm[off + 16:off + 16 + caplen]
+                    linktype = self.reader.linktype
+                for lst, val in zip(packets[linktype], (i, s, wirelen)):
+                    lst.append(val)
+            for linktype, (indexes, pkts, wirelens) in packets.items():
+                matches = filter.compile(linktype).match_many(
+                    pkts, wirelens, as_numpy=as_numpy
+                )
+                res.extend(i for i, match in zip(indexes, matches) if match)
+        return sorted(res)
+
+    def close(self):
+        self.mm.close()
+        self.fdesc.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tracback):
+        self.close()
+
+
+class MmapPcapReader(RawMmapPcapReader):
+    """A pcap or pcapng reader with random access to the packets, as
+    RawMmapPcapReader, that returns Packet objects (and PacketList objects
+    for slices)"""
+    reader_class = PcapReader
+
+    def __getitem__(self, item):
+        res = super(MmapPcapReader, self).__getitem__(item)
+        if isinstance(item, slice):
+            from scapy import plist
+            return plist.PacketList(res, name=os.path.basename(self.filename))
+        return res
+
+    def between(self, start, stop):
+        res = super(MmapPcapReader, self).between(start, stop)
+        if isinstance(res, list):
+            from scapy import plist
+            return plist.PacketList(res, name=os.path.basename(self.filename))
+        return res
+
+
+_parallel_reader = None
+
+
+def _parallel_init(filename, idbs):
+    """Open the capture file in a worker process of ParallelPcapReader"""
+    global _parallel_reader
+    _parallel_reader = MmapPcapReader(filename, index=(
+        array.array(RawMmapPcapReader._offset_typecode), array.array("d"),
+        idbs
+    ))
+
+
+def _parallel_dissect(offsets, prn, lfilter):
+    """Dissect the packets at `offsets`, in a worker process of
+    ParallelPcapReader. Returns the results of `prn`, or without `prn` the
+    offsets of the packets accepted by `lfilter`, since sending dissected
+    packets back would have them dissected again when unpickled."""
+    res = []
+    for off in offsets:
+        pkt = _parallel_reader._read_at(off)
+        if lfilter is None or lfilter(pkt):
+            res.append(off if prn is None else prn(pkt))
+    return res
+
+
+class ParallelPcapReader(object):
+    """A pcap or pcapng reader that runs `prn` and `lfilter` on the packets
+    in a pool of processes.
+
+    The capture is indexed (see RawMmapPcapReader) and split in chunks of
+    `chunk_size` packets, dissected by the processes. The results of `prn`
+    for the packets accepted by `lfilter` are returned in the order of the
+    file, and at most `max_pending` chunks are dissected ahead of the
+    reader.
+
+    Only the results of `prn` are pickled back from the processes, so
+    `prn` should extract what is needed from each packet. Without `prn`,
+    the processes only tell which packets are accepted by `lfilter`, and
+    these packets are dissected by the reader itself; without `prn` and
+    `lfilter`, no process is used. `prn` and `lfilter` have to be
+    picklable, e.g. module-level functions.
+
+    It can be used as a PcapReader, including as an opened_socket of
+    sniff() (without `prn`).
+
+    >>> def flow(pkt):
+    ...     return pkt[IP].src, pkt[IP].dst
+    >>> def is_ip(pkt):
+    ...     return IP in pkt
+    >>> with ParallelPcapReader("big.pcap", prn=flow,
+    ...                         lfilter=is_ip) as fdesc:
+    ...     flows = collections.Counter(fdesc)
+
+    :param filename: the name of the capture file
+    :param processes: the number of processes (default: the number of CPUs)
+    :param chunk_size: the number of packets dissected by a task
+    :param prn: function applied to each packet, whose result is returned
+        instead of the packet
+    :param lfilter: function telling if a packet is returned
+    :param max_pending: the number of chunks dissected ahead (default: twice
+        the number of processes)
+    """
+    read_allowed_exceptions = ()  # emulate SuperSocket
+    nonblocking_socket = True
+
+    def __init__(self, filename, processes=None, chunk_size=1000, prn=None,
+                 lfilter=None, max_pending=None):
+        self.reader = MmapPcapReader(filename)
+        self.filename = self.reader.filename
+        self.offsets, _, idbs = self.reader.index
+        processes = processes or multiprocessing.cpu_count()
+        self.chunk_size = chunk_size
+        self.prn = prn
+        self.lfilter = lfilter
+        self.max_pending = max_pending or 2 * processes
+        if prn is None and lfilter is None:
+            self.pool = None
+            self.results = (self.reader._read_at(off) for off in self.offsets)
+            return
+        self.pool = multiprocessing.Pool(processes, _parallel_init,
+                                         (self.filename, idbs))
+        self.results = self._read_chunks()
+
+    def _read_chunks(self):
+        pending = collections.deque()
+        for start in range(0, len(self.offsets), self.chunk_size):
+            pending.append(self.pool.apply_async(_parallel_dissect, (
+                self.offsets[start:start + self.chunk_size], self.prn,
+                self.lfilter
+            )))
+            if len(pending) >= self.max_pending:
+                for res in self._results(pending.popleft().get()):
+                    yield res
+        while pending:
+            for res in self._results(pending.popleft().get()):
+                yield res
+
+    def _results(self, chunk):
+        if self.prn is not None:
+            return chunk
+        # The offsets of the packets accepted by lfilter
+        return (self.reader._read_at(off) for off in chunk)
+
+    def __len__(self):
+        """The number of packets of the capture, before `lfilter`"""
+        return len(self.offsets)
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        """implement the iterator protocol on the packets (or the results
+        of `prn`)"""
+        try:
+            return self.read_packet()
+        except EOFError:
+            raise StopIteration
+    __next__ = next
+
+    def read_packet(self, size=MTU):
+        """return the next packet (or result of `prn`)
+
+        raise EOFError when no more packets are available
+        """
+        try:
+            return next(self.results)
+        except StopIteration:
+            raise EOFError
+
+    def read_all(self, count=-1):
+        """return a list of all the packets (a PacketList), or of the
+        results of `prn`"""
+        res = []
+        while count != 0:
+            count -= 1
+            try:
+                res.append(self.read_packet())
+            except EOFError:
+                break
+        if self.prn is not None:
+            return res
+        from scapy import plist
+        return plist.PacketList(res, name=os.path.basename(self.filename))
+
+    def recv(self, size=MTU):
+        return self.read_packet(size=size)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+        self.reader.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tracback):
+        self.close()
+
+    # emulate SuperSocket
+    @staticmethod
+    def select(sockets, remain=None):
+        return sockets, None
+
+
+def _is_pcap_record(pkt):
+    """Tells if `pkt` is a (bytes, timestamp) record of write_many()"""
+    return isinstance(pkt, tuple) and len(pkt) == 2 and \
+        isinstance(pkt[0], bytes) and isinstance(pkt[1], numbers.Number)
+
+
 class RawPcapWriter:
     """A stream PCAP writer with more control than wrpcap()"""
 
     def __init__(self, filename, linktype=None, gz=False, endianness="",
-                 append=False, sync=False, nano=False):
+                 append=False, sync=False, nano=False, background=False):
         """
         :param filename: the name of the file to write packets to, or an open,
             writable file-like object.
@@ -1337,6 +2042,10 @@ class RawPcapWriter:
             truncating it
         :param sync: do not bufferize writes to the capture file
         :param nano: use nanosecond-precision (requires libpcap >= 1.5.0)
+        :param background: build and write the records in a background
+            thread. write() and write_many() return immediately, flush()
+            waits for the pending writes. The packets must not be modified
+            until then.
 
         """
 
@@ -1358,6 +2067,45 @@ class RawPcapWriter:
             self.f = filename
             self.filename = getattr(filename, "name", "No name")
 
+        self._bg_queue = None
+        self._bg_thread = None
+        self._bg_error = None
+        if background:
+            self._bg_queue = six.moves.queue.Queue(maxsize=1024)
+            self._bg_thread = threading.Thread(target=self._background_write)
+            self._bg_thread.daemon = True
+            self._bg_thread.start()
+
+    def _background_write(self):
+        """Main loop of the background thread: run the queued writes"""
+        while True:
+            task = self._bg_queue.get()
+            try:
+                if task is None:
+                    return
+                func, args = task
+                func(*args)
+            except Exception as e:
+                self._bg_error = e
+            finally:
+                self._bg_queue.task_done()
+
+    def _in_background(self, func, *args):
+        """Queue a call to `func` to the background thread, if any. Returns
+        True if it was queued."""
+        if self._bg_thread is None or \
+           threading.current_thread() is self._bg_thread:
+            return False
+        self._check_background()
+        self._bg_queue.put((func, args))
+        return True
+
+    def _check_background(self):
+        """Raise the error of the background thread, if any"""
+        if self._bg_error is not None:
+            e, self._bg_error = self._bg_error, None
+            raise e
+
     def fileno(self):
         return self.f.fileno()
 
@@ -1385,6 +2133,8 @@ class RawPcapWriter:
                     bytes to write (as one record).
         :type pkt: iterable[scapy.packet.Packet], scapy.packet.Packet or bytes
         """
+        if self._in_background(self.write, pkt):
+            return
         if isinstance(pkt, bytes):
             if not self.header_present:
                 self._write_header(pkt)
@@ -1453,10 +2203,73 @@ class RawPcapWriter:
         if self.sync:
             self.f.flush()
 
+    def write_many(self, pkts, batch_size=1024):
+        """
+        Writes many packets, packing the records of `batch_size` packets
+        in a buffer written at once.
+
+        :param pkts: an iterable of bytes or (bytes, timestamp) tuples
+            (and Packets for a PcapWriter). Records without a timestamp
+            get the time at which their batch started. A single Packet or
+            bytes is written as by write().
+        :param batch_size: the number of records written at once
+        """
+        if self._in_background(self.write_many, pkts, batch_size):
+            return
+        if isinstance(pkts, bytes) or _is_pcap_record(pkts):
+            pkts = [pkts]
+        else:
+            # Import here to avoid a circular dependency
+            from scapy.plist import SndRcvList
+            if isinstance(pkts, SndRcvList):
+                pkts = (p for t in pkts for p in t)
+        hdr = struct.Struct(self.endian + "IIII")
+        scale = 1000000000 if self.nano else 1000000
+        buf = []
+        now = None
+        for pkt in pkts:
+            if not self.header_present:
+                self._write_header(pkt[0] if _is_pcap_record(pkt) else pkt)
+            rawpkt, pkt_time, wirelen = self._pack_record(pkt)
+            if pkt_time is None:
+                if now is None:
+                    now = time.time()
+                pkt_time = now
+            sec = int(pkt_time)
+            usec = int(round((pkt_time - sec) * scale))
+            caplen = len(rawpkt)
+            buf.append(hdr.pack(sec, usec, caplen,
+                                caplen if wirelen is None else wirelen))
+            buf.append(rawpkt)
+            if len(buf) >= 2 * batch_size:
+                self.f.write(b"".join(buf))
+                buf = []
+                now = None
+        if buf:
+            self.f.write(b"".join(buf))
+        if self.sync:
+            self.f.flush()
+
+    def _pack_record(self, pkt):
+        """Returns the raw bytes, timestamp (or None) and wire length (or
+        None) of an element passed to write_many()"""
+        if _is_pcap_record(pkt):
+            return pkt[0], pkt[1], None
+        return pkt, None, None
+
     def flush(self):
+        if self._bg_thread is not None:
+            self._bg_queue.join()
+            self._check_background()
         return self.f.flush()
 
     def close(self):
+        if self._bg_thread is not None:
+            self._bg_queue.join()
+            self._bg_queue.put(None)
+            self._bg_thread.join()
+            self._bg_thread = None
+            self._check_background()
         if not self.header_present:
             self._write_header(None)
         return self.f.close()
@@ -1472,6 +2285,11 @@ class RawPcapWriter:
 class PcapWriter(RawPcapWriter):
     """A stream PCAP writer with more control than wrpcap()"""
 
+    def __init__(self, *args, **kargs):
+        RawPcapWriter.__init__(self, *args, **kargs)
+        # Packet classes whose linktype has been checked by write_many()
+        self._checked_classes = set()
+
     def _write_header(self, pkt):
         if self.linktype is None:
             try:
@@ -1532,6 +2350,148 @@ class PcapWriter(RawPcapWriter):
         RawPcapWriter._write_packet(
             self, rawpkt, sec=sec, usec=usec, caplen=caplen, wirelen=wirelen)
 
+    def _pack_record(self, pkt):
+        if isinstance(pkt, bytes) or _is_pcap_record(pkt):
+            return RawPcapWriter._pack_record(self, pkt)
+        cls = pkt.__class__
+        if cls not in self._checked_classes:
+            self._checked_classes.add(cls)
+            if self.linktype != conf.l2types.get(cls, None):
+                warning("Inconsistent linktypes detected!"
+                        " The resulting PCAP file might contain"
+                        " invalid packets."
+                        )
+        return raw(pkt), pkt.time, pkt.wirelen
+
+
+class PcapSpool(object):
+    """A list of packets, or of (sent, received) couples as in a SndRcvList,
+    that writes them to a pcap file as they are appended instead of keeping
+    them in memory. Only an index of the records is kept: the packets are
+    read back, and dissected with their original class, when accessed.
+
+    It can be passed as `store` to sniff(), and as `spool` to sr() and its
+    variants: the PacketList or SndRcvList they return reads it lazily.
+
+    >>> spool = PcapSpool("/tmp/capture.pcap")
+    >>> pkts = sniff(iface="eth0", store=spool, timeout=86400)
+    >>> pkts[-10:].summary()
+
+    :param filename: the name of the capture file (default: a temporary
+        file, deleted when Scapy exits)
+    """
+    # "Q" does not exist on Python 2
+    _offset_typecode = "Q" if six.PY3 else "L"
+
+    def __init__(self, filename=None):
+        if filename is None:
+            filename = get_temp_file(autoext=".pcap")
+        self.filename = filename
+        self.writer = PcapWriter(filename)
+        self.reader = None
+        self.lock = threading.Lock()
+        self.pairs = None
+        # Offset of the first record of each element
+        self.offsets = array.array(self._offset_typecode)
+        # Class of each record, as an index in self.classes
+        self.codes = array.array("H")
+        self.classes = []
+        self._class_codes = {}
+        self._dirty = False
+
+    def __repr__(self):
+        return "<%s %s: %d %s>" % (self.__class__.__name__, self.filename,
+                                   len(self),
+                                   "couples" if self.pairs else "packets")
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def _write(self, pkt):
+        cls = pkt.__class__
+        code = self._class_codes.get(cls)
+        if code is None:
+            code = self._class_codes[cls] = len(self.classes)
+            self.classes.append(cls)
+        self.codes.append(code)
+        self.writer._write_packet(pkt)
+
+    def append(self, elt):
+        """Writes a packet, or a (sent, received) couple, to the file"""
+        with self.lock:
+            if self.pairs is None:
+                self.pairs = isinstance(elt, tuple)
+            if not self.writer.header_present:
+                self.writer._write_header(elt[0] if self.pairs else elt)
+            self.offsets.append(self.writer.f.tell())
+            if self.pairs:
+                self._write(elt[0])
+                self._write(elt[1])
+            else:
+                self._write(elt)
+            self._dirty = True
+
+    def _read_record(self, hdr, code):
+        sec, usec, caplen, wirelen = hdr.unpack(self.reader.read(16))
+        s = self.reader.read(caplen)
+        cls = self.classes[code]
+        try:
+            p = cls(s)
+        except KeyboardInterrupt:
+            raise
+        except Exception:
+            if conf.debug_dissector:
+                raise
+            p = conf.raw_layer(s)
+        power = Decimal(10) ** Decimal(-9 if self.writer.nano else -6)
+        p.time = EDecimal(sec + power * usec)
+        p.wirelen = wirelen
+        return p
+
+    def _read(self, indexes):
+        """Yields the elements at `indexes`, read from the file"""
+        hdr = struct.Struct(self.writer.endian + "IIII")
+        width = 2 if self.pairs else 1
+        for i in indexes:
+            with self.lock:
+                if self._dirty:
+                    self.writer.flush()
+                    self._dirty = False
+                if self.reader is None:
+                    self.reader = open(self.filename, "rb")
+                self.reader.seek(self.offsets[i])
+                pkts = [self._read_record(hdr, self.codes[width * i + j])
+                        for j in range(width)]
+            yield tuple(pkts) if self.pairs else pkts[0]
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return list(self._read(range(*item.indices(len(self)))))
+        if item < 0:
+            item += len(self)
+        if not 0 <= item < len(self):
+            raise IndexError("packet index out of range")
+        return next(self._read([item]))
+
+    def __iter__(self):
+        return self._read(range(len(self)))
+
+    def __add__(self, other):
+        return list(self) + list(other)
+
+    def close(self):
+        """Closes the file. The elements cannot be read anymore"""
+        with self.lock:
+            self.writer.close()
+            if self.reader is not None:
+                self.reader.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tracback):
+        self.close()
+
 
 @conf.commands.register
 def import_hexcap():
@@ -2058,3 +3018,36 @@ class PeriodicSenderThread(threading.Thread):
 
     def stop(self):
         self._stopped.set()
+
+
+class TokenBucket(object):
+    """Paces a flow of packets at a rate of packets and/or megabits per
+    second. wait() is called before sending packets, and sleeps as long as
+    the previous packets would exceed the rate.
+
+    :param pps: the maximum rate in packets per second
+    :param mbps: the maximum rate in megabits per second
+    """
+
+    def __init__(self, pps=None, mbps=None):
+        self.pps = pps
+        self.bps = mbps * 1000000. if mbps else None
+        self.tat = 0
+
+    def wait(self, count=1, size=0):
+        """Waits until `count` packets of `size` bytes in total can be sent
+
+        :param count: the number of packets
+        :param size: the total size of the packets, in bytes
+        """
+        if not self.pps and not self.bps:
+            return
+        cost = float(count) / self.pps if self.pps else 0
+        if self.bps:
+            cost = max(cost, size * 8 / self.bps)
+        now = time.time()
+        if self.tat > now:
+            time.sleep(self.tat - now)
+        else:
+            self.tat = now
+        self.tat += cost
@@ -0,0 +1,85 @@
+# This file is part of Scapy
+# See http://www.secdev.org/projects/scapy for more information
+# This program is published under a GPLv2 license
+
+"""
+Check that the fixed-size fields runs (see FixedFieldsRun) dissect and build
+every layer of scapy/layers exactly like the generic per-field path, and
+compare their speed.
+"""
+
+from common import *
+import importlib
+import pkgutil
+import random
+import time
+
+import scapy.layers
+
+N = 1000
+SAMPLES = 20
+
+for _, modname, _ in pkgutil.iter_modules(scapy.layers.__path__):
+    try:
+        importlib.import_module("scapy.layers.%s" % modname)
+    except Exception as e:
+        print("Skipping scapy.layers.%s: %r" % (modname, e))
+
+
+def all_layers(cls=Packet):
+    for sub in cls.__subclasses__():
+        yield sub
+        for subsub in all_layers(sub):
+            yield subsub
+
+
+def outcome(func, *args):
+    try:
+        p = func(*args)
+        return raw(p), repr(p)
+    except Exception as e:
+        return type(e)
+
+
+layers = sorted(set(cls for cls in all_layers() if cls._fixed_runs and
+                    cls.__module__.startswith("scapy.layers.")),
+                key=lambda cls: (cls.__module__, cls.__name__))
+rnd = random.Random(0)
+mismatches = 0
+for cls in layers:
+    samples = [bytes(bytearray(rnd.randrange(256) for _ in range(64)))
+               for _ in range(SAMPLES)]
+    results = []
+    fixed_runs = cls._fixed_runs
+    for runs, zero_copy in [(fixed_runs, False), (fixed_runs, True),
+                            ({}, False)]:
+        cls._fixed_runs = runs
+        conf.zero_copy_dissection = zero_copy
+        results.append([outcome(cls)] +
+                       [outcome(cls, s) for s in samples])
+    cls._fixed_runs = fixed_runs
+    if outcome(cls) != outcome(cls):
+        # random default values
+        for res in results:
+            del res[0]
+    if any(res != results[-1] for res in results):
+        mismatches += 1
+        print("Mismatch: %s.%s" % (cls.__module__, cls.__name__))
+print("%d layers with fixed runs checked, %d mismatch(es)" % (len(layers),
+                                                              mismatches))
+
+raw_packet = raw(Ether() / IP() / TCP() / (b"x" * 10))
+for label, runs in [("generic", {}), ("fixed runs", None)]:
+    saved = {}
+    if runs is not None:
+        for cls in [Ether, IP, TCP]:
+            saved[cls] = cls._fixed_runs
+            cls._fixed_runs = runs
+    start = time.time()
+    for i in range(N):
+        raw(Ether(raw_packet))
+    print("Ether/IP/TCP dissect & build (%s) - %.2fs" % (
+        label, time.time() - start))
+    for cls, runs in saved.items():
+        cls._fixed_runs = runs
+assert mismatches == 0
@@ -0,0 +1,59 @@
+# This file is part of Scapy
+# See http://www.secdev.org/projects/scapy for more information
+# This program is published under a GPLv2 license
+
+"""
+Time haslayer() and getlayer() lookups on freshly dissected packets, from
+a single lookup per packet to several of them.
+
+Usage: python layer_lookup.py [number of packets]
+"""
+
+from common import *
+import gc
+import time
+
+N = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+
+data = raw(Ether() / IP() / TCP(options=[("MSS", 1460)]) / Raw(b"X" * 100))
+
+
+def dissect():
+    pkts = [Ether(data) for _ in range(N)]
+    # Complete the (lazy) dissections before timing the lookups
+    for p in pkts:
+        p.lastlayer()
+    return pkts
+
+
+def one_class(p):
+    return TCP in p
+
+
+def one_name(p):
+    return "IP" in p
+
+
+def two(p):
+    return TCP in p and p[TCP].dport
+
+
+def five(p):
+    return (TCP in p, UDP in p, p[IP].src, p.getlayer(TCP).dport,
+            p.haslayer(Raw))
+
+
+def ten(p):
+    return five(p) + five(p)
+
+
+for test in [one_class, one_name, two, five, ten]:
+    fresh = dissect()
+    gc.disable()
+    start = time.time()
+    for p in fresh:
+        test(p)
+    duration = time.time() - start
+    gc.enable()
+    print("%-9s - %.2fus per packet" % (test.__name__,
+                                        duration * 1e6 / N))
@@ -0,0 +1,56 @@
+# This file is part of Scapy
+# See http://www.secdev.org/projects/scapy for more information
+# This program is published under a GPLv2 license
+
+"""
+Compare ParallelPcapReader to a serial reading of the same capture, with a
+prn function extracting the flow of each packet.
+
+Usage: python parallel_pcap.py [number of packets] [processes]
+"""
+
+from common import *
+import collections
+import multiprocessing
+import tempfile
+import time
+
+N = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+PROCESSES = int(sys.argv[2]) if len(sys.argv) > 2 else \
+    multiprocessing.cpu_count()
+
+
+def flow(pkt):
+    return pkt[IP].src, pkt[IP].dst, pkt.sport, pkt.dport
+
+
+def is_tcp(pkt):
+    return TCP in pkt
+
+
+fd, filename = tempfile.mkstemp(suffix=".pcap")
+os.close(fd)
+with PcapWriter(filename) as fdesc:
+    for i in range(N):
+        src = "10.0.%d.%d" % (i // 256 % 256, i % 256)
+        fdesc.write(Ether() / IP(src=src) /
+                    (TCP(sport=i % 65536, options=[("MSS", 1460)])
+                     if i % 2 else UDP(sport=i % 65536)) / Raw(b"X" * 100))
+
+print("%d packets, %d processes" % (N, PROCESSES))
+
+start = time.time()
+with PcapReader(filename) as fdesc:
+    ref = collections.Counter(flow(p) for p in fdesc if is_tcp(p))
+serial = time.time() - start
+print("Serial   - %.2fs" % serial)
+
+start = time.time()
+with ParallelPcapReader(filename, processes=PROCESSES, prn=flow,
+                        lfilter=is_tcp) as fdesc:
+    res = collections.Counter(fdesc)
+parallel = time.time() - start
+print("Parallel - %.2fs (x%.2f)" % (parallel, serial / parallel))
+
+assert res == ref
+os.remove(filename)